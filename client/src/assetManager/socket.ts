@@ -1,3 +1,5 @@
+import { useToast } from "vue-toastification";
+
 import type { Asset } from "../core/models/types";
 import { socketManager } from "../core/socket";
 import { baseAdjust } from "../core/utils";
@@ -6,6 +8,8 @@ import { assetStore } from "./state";
 
 export const socket = socketManager.socket("/pa_assetmgmt");
 
+const toast = useToast();
+
 let disConnected = false;
 
 socket.on("connect", () => {
@@ -39,8 +43,23 @@ socket.on("Asset.Upload.Finish", (data: { asset: Asset; parent: number }) => {
     assetStore.resolveUpload(data.asset.name);
 });
 
+socket.on("Asset.Export.Start", (uuid: string) => {
+    toast.info("Preparing export", { id: uuid, timeout: false });
+});
+
+socket.on("Asset.Export.Progress", (data: { uuid: string; done: number; total: number }) => {
+    const percentage = data.total > 0 ? Math.floor((100 * data.done) / data.total) : 100;
+    toast.update(data.uuid, { content: `Preparing export (${percentage}%)`, options: { timeout: false } }, true);
+});
+
 socket.on("Asset.Export.Finish", (uuid: string) => {
-    window.open(baseAdjust(`/static/temp/${uuid}.paa`));
+    toast.dismiss(uuid);
+    window.open(baseAdjust(`/api/assets/export/${uuid}`));
+});
+
+socket.on("Asset.Export.Fail", (uuid: string) => {
+    toast.dismiss(uuid);
+    toast.error("Export failed");
 });
 
 socket.on("Asset.Import.Finish", (name: string) => {
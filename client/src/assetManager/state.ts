@@ -1,5 +1,6 @@
 import type { ComputedRef } from "@vue/reactivity";
 import { computed } from "@vue/runtime-core";
+import { useToast } from "vue-toastification";
 
 import type { Asset } from "../core/models/types";
 import { Store } from "../core/store";
@@ -8,6 +9,8 @@ import { router } from "../router";
 
 import { socket } from "./socket";
 
+const toast = useToast();
+
 interface AssetState {
     modalActive: boolean;
 
@@ -203,7 +206,7 @@ class AssetStore extends Store<AssetState> {
             const slices = Math.ceil(file.size / CHUNK_SIZE);
             this._state.pendingUploads.push(file.name);
             for (let slice = 0; slice < slices; slice++) {
-                await new Promise((resolve) => {
+                const accepted = await new Promise<boolean>((resolve) => {
                     const fr = new FileReader();
                     fr.readAsArrayBuffer(
                         file.slice(
@@ -227,6 +230,11 @@ class AssetStore extends Store<AssetState> {
                         );
                     };
                 });
+                if (!accepted) {
+                    toast.error(`Upload of ${file.name} was rejected by the server`);
+                    this.resolveUpload(file.name);
+                    break;
+                }
             }
         }
     }
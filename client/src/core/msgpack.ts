@@ -0,0 +1,127 @@
+// Minimal msgpack decoder for the payloads sent by server/api/socket/encoding.py
+// Extension types are not used by the server and are not supported.
+// Kept in house, the payloads only use the basic types and a dependency would be overkill.
+
+const textDecoder = new TextDecoder();
+
+class Reader {
+    private offset = 0;
+    private view: DataView;
+    // Interned object keys, map keys are indices into this list when set
+    keys?: string[];
+
+    constructor(private bytes: Uint8Array) {
+        this.view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+    }
+
+    byte(): number {
+        return this.view.getUint8(this.offset++);
+    }
+
+    read(): unknown {
+        const type = this.byte();
+        if (type < 0x80) return type;
+        if (type < 0x90) return this.map(type & 0x0f);
+        if (type < 0xa0) return this.array(type & 0x0f);
+        if (type < 0xc0) return this.str(type & 0x1f);
+        if (type >= 0xe0) return type - 0x100;
+        switch (type) {
+            case 0xc0:
+                return null;
+            case 0xc2:
+                return false;
+            case 0xc3:
+                return true;
+            case 0xc4:
+                return this.bin(this.uint(1));
+            case 0xc5:
+                return this.bin(this.uint(2));
+            case 0xc6:
+                return this.bin(this.uint(4));
+            case 0xca:
+                return this.number((o) => this.view.getFloat32(o), 4);
+            case 0xcb:
+                return this.number((o) => this.view.getFloat64(o), 8);
+            case 0xcc:
+                return this.uint(1);
+            case 0xcd:
+                return this.uint(2);
+            case 0xce:
+                return this.uint(4);
+            case 0xcf:
+                return this.number((o) => Number(this.view.getBigUint64(o)), 8);
+            case 0xd0:
+                return this.number((o) => this.view.getInt8(o), 1);
+            case 0xd1:
+                return this.number((o) => this.view.getInt16(o), 2);
+            case 0xd2:
+                return this.number((o) => this.view.getInt32(o), 4);
+            case 0xd3:
+                return this.number((o) => Number(this.view.getBigInt64(o)), 8);
+            case 0xd9:
+                return this.str(this.uint(1));
+            case 0xda:
+                return this.str(this.uint(2));
+            case 0xdb:
+                return this.str(this.uint(4));
+            case 0xdc:
+                return this.array(this.uint(2));
+            case 0xdd:
+                return this.array(this.uint(4));
+            case 0xde:
+                return this.map(this.uint(2));
+            case 0xdf:
+                return this.map(this.uint(4));
+        }
+        throw new Error(`Unsupported msgpack type 0x${type.toString(16)}`);
+    }
+
+    private number(get: (offset: number) => number, size: number): number {
+        const value = get(this.offset);
+        this.offset += size;
+        return value;
+    }
+
+    private uint(size: 1 | 2 | 4): number {
+        if (size === 1) return this.number((o) => this.view.getUint8(o), 1);
+        if (size === 2) return this.number((o) => this.view.getUint16(o), 2);
+        return this.number((o) => this.view.getUint32(o), 4);
+    }
+
+    private str(length: number): string {
+        const value = textDecoder.decode(this.bytes.subarray(this.offset, this.offset + length));
+        this.offset += length;
+        return value;
+    }
+
+    private bin(length: number): Uint8Array {
+        const value = this.bytes.slice(this.offset, this.offset + length);
+        this.offset += length;
+        return value;
+    }
+
+    private array(length: number): unknown[] {
+        const value = new Array(length);
+        for (let i = 0; i < length; i++) value[i] = this.read();
+        return value;
+    }
+
+    private map(length: number): Record<string, unknown> {
+        const value: Record<string, unknown> = {};
+        for (let i = 0; i < length; i++) {
+            const key = this.read() as string | number;
+            value[this.keys === undefined ? key : this.keys[key as number]] = this.read();
+        }
+        return value;
+    }
+}
+
+// Decodes a `[keys, data]` payload and restores the interned object keys of data
+export function decodeInterned<T>(data: ArrayBuffer | ArrayBufferView): T {
+    const bytes = data instanceof ArrayBuffer ? data : data.buffer;
+    const offset = data instanceof ArrayBuffer ? 0 : data.byteOffset;
+    const reader = new Reader(new Uint8Array(bytes, offset, data.byteLength));
+    if (reader.byte() !== 0x92) throw new Error("Malformed payload");
+    reader.keys = reader.read() as string[];
+    return reader.read() as T;
+}
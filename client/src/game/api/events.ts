@@ -34,7 +34,7 @@ import { startDrawLoop, stopDrawLoop } from "../draw";
 import { getLocalId, getShapeFromGlobal } from "../id";
 import type { GlobalId } from "../id";
 import { compositeState } from "../layers/state";
-import type { Note, ServerFloor } from "../models/general";
+import type { Note, ServerFloor, ServerFloorShapes } from "../models/general";
 import type { Location } from "../models/settings";
 import { setCenterPosition } from "../position";
 import { deleteShapes } from "../shapes/utils";
@@ -43,7 +43,7 @@ import { visionState } from "../vision/state";
 
 import { sendClientLocationOptions } from "./emits/client";
 import { activeLayerToselect } from "./events/client";
-import { socket } from "./socket";
+import { socket, unpack } from "./socket";
 
 // Core WS events
 
@@ -86,7 +86,10 @@ socket.on("Board.Locations.Set", (locationInfo: Location[]) => {
     initiativeStore.clear();
 });
 
-socket.on("Board.Floor.Set", (floor: ServerFloor) => {
+// Floors are sent in chunks, the server waits for the acknowledgement of a chunk before sending more.
+// Only acknowledge once the chunk has been handled, so that a busy client is not flooded.
+socket.on("Board.Floor.Set", (data: ServerFloor | ArrayBuffer, ack?: () => void) => {
+    const floor = unpack(data);
     // It is important that this condition is evaluated before the async addFloor call.
     // The very first floor that arrives is the one we want to select
     // When this condition is evaluated after the await, we are at the mercy of the async scheduler
@@ -102,6 +105,13 @@ socket.on("Board.Floor.Set", (floor: ServerFloor) => {
         // Send initial viewport on connect (this can change due to other monitors etc)
         sendClientLocationOptions();
     }
+    ack?.();
+});
+
+// The floor itself comes with the shapes closest to the viewport, the others follow in these chunks
+socket.on("Board.Floor.Shapes.Add", (data: ServerFloorShapes | ArrayBuffer, ack?: () => void) => {
+    floorStore.addServerShapes(unpack(data));
+    ack?.();
 });
 
 // Varia
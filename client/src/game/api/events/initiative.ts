@@ -1,15 +1,31 @@
 import { getLocalId } from "../../id";
 import type { GlobalId } from "../../id";
-import type { InitiativeEffect, InitiativeSettings, InitiativeSort } from "../../models/initiative";
+import type {
+    InitiativeData,
+    InitiativeEffect,
+    InitiativeSettings,
+    InitiativeSort,
+} from "../../models/initiative";
 import { initiativeStore } from "../../ui/initiative/state";
 import { socket } from "../socket";
 
 socket.on("Initiative.Set", (data: InitiativeSettings) => initiativeStore.setData(data));
+socket.on("Initiative.Add", (data: Omit<InitiativeData, "shape"> & { shape: GlobalId }) => {
+    const shape = getLocalId(data.shape);
+    if (shape === undefined) return;
+    initiativeStore.updateActor({ ...data, shape });
+});
 socket.on("Initiative.Value.Set", (data: { shape: GlobalId; value: number }) =>
     initiativeStore.setInitiative(getLocalId(data.shape)!, data.value, false),
 );
 socket.on("Initiative.Remove", (data: GlobalId) => initiativeStore.removeInitiative(getLocalId(data)!, false));
 
+socket.on(
+    "Initiative.Order.Change",
+    (data: { shape: GlobalId; oldIndex: number; newIndex: number; sort: InitiativeSort }) =>
+        initiativeStore.applyOrderChange(data.oldIndex, data.newIndex, data.sort),
+);
+
 socket.on("Initiative.Turn.Update", (turn: number) => initiativeStore.setTurnCounter(turn, false));
 socket.on("Initiative.Round.Update", (round: number) => initiativeStore.setRoundCounter(round, false));
 socket.on("Initiative.Effect.New", (data: { actor: GlobalId; effect: InitiativeEffect }) => {
@@ -12,7 +12,7 @@ import type { Circle } from "../../../shapes/variants/circle";
 import type { Rect } from "../../../shapes/variants/rect";
 import { accessSystem } from "../../../systems/access";
 import { addShape, moveFloor, moveLayer } from "../../../temp";
-import { socket } from "../../socket";
+import { socket, unpack } from "../../socket";
 
 socket.on("Shape.Set", (data: ServerShape) => {
     // hard reset a shape
@@ -33,8 +33,8 @@ socket.on("Shape.Add", (shape: ServerShape) => {
     addShape(shape, SyncMode.NO_SYNC);
 });
 
-socket.on("Shapes.Add", (shapes: ServerShape[]) => {
-    for (const shape of shapes) {
+socket.on("Shapes.Add", (data: ServerShape[] | ArrayBuffer) => {
+    for (const shape of unpack(data)) {
         addShape(shape, SyncMode.NO_SYNC);
     }
 });
@@ -1,5 +1,6 @@
 import type { RouteLocationNormalized } from "vue-router";
 
+import { decodeInterned } from "../../core/msgpack";
 import { socketManager } from "../../core/socket";
 
 export const socket = socketManager.socket("/planarally");
@@ -8,6 +9,12 @@ export function createConnection(route: RouteLocationNormalized): void {
     // since socket.io v3 this is private, couldn't find an immediate 'clean' fix
     (socket.io as any).opts.query = `user=${decodeURIComponent(
         route.params.creator as string,
-    )}&room=${decodeURIComponent(route.params.room as string)}`;
+    )}&room=${decodeURIComponent(route.params.room as string)}&encoding=msgpack`;
     socket.connect();
 }
+
+// Large payloads are sent msgpack encoded if the server supports it (see server/api/socket/encoding.py)
+export function unpack<T>(data: T | ArrayBuffer): T {
+    if (data instanceof ArrayBuffer || ArrayBuffer.isView(data)) return decodeInterned<T>(data);
+    return data;
+}
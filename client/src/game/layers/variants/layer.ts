@@ -36,6 +36,8 @@ export class Layer {
     // The collection of shapes that this layer contains.
     // These are ordered on a depth basis.
     protected shapes: IShape[] = [];
+    // Position of the shapes in the server's ordering, used to restore the order of shapes loaded in chunks
+    private serverOrder: Map<LocalId, number> = new Map();
 
     points: Map<string, Set<LocalId>> = new Map();
 
@@ -145,26 +147,39 @@ export class Layer {
         this.shapes = shapes;
     }
 
-    setServerShapes(shapes: ServerShape[]): void {
+    setServerShapes(shapes: ServerShape[], indices?: number[]): void {
         if (this.isActiveLayer) selectionState.clear(); // TODO: Fix keeping selection on those items that are not moved.
+        this.addServerShapes(shapes, indices);
+    }
+
+    // When a floor is loaded in chunks, the shapes come with their index in the layer (see Board.Floor.Shapes.Add)
+    // and are put back in that order, no matter in which chunk they arrive.
+    addServerShapes(shapes: ServerShape[], indices?: number[]): void {
         // We need to ensure composites are added after all their variants have been added
-        const composites = [];
-        for (const serverShape of shapes) {
+        const composites: [ServerShape, number | undefined][] = [];
+        for (const [i, serverShape] of shapes.entries()) {
             if (serverShape.type_ === "togglecomposite") {
-                composites.push(serverShape);
+                composites.push([serverShape, indices?.[i]]);
             } else {
-                this.setServerShape(serverShape);
+                this.setServerShape(serverShape, indices?.[i]);
             }
         }
-        for (const composite of composites) this.setServerShape(composite);
+        for (const [composite, index] of composites) this.setServerShape(composite, index);
+
+        if (indices !== undefined) {
+            // Shapes without a server index (e.g. created while loading) stay on top
+            const order = (shape: IShape): number => this.serverOrder.get(shape.id) ?? Number.MAX_SAFE_INTEGER;
+            this.shapes.sort((a, b) => order(a) - order(b));
+        }
     }
 
-    private setServerShape(serverShape: ServerShape): void {
+    private setServerShape(serverShape: ServerShape, index?: number): void {
         const shape = createShapeFromDict(serverShape);
         if (shape === undefined) {
             console.log(`Shape with unknown type ${serverShape.type_} could not be added`);
             return;
         }
+        if (index !== undefined) this.serverOrder.set(shape.id, index);
         let invalidate = InvalidationMode.NO;
         if (visionState.state.mode === VisibilityMode.TRIANGLE_ITERATIVE) {
             invalidate = InvalidationMode.WITH_LIGHT;
@@ -187,6 +202,7 @@ export class Layer {
             );
         }
         this.shapes.splice(idx, 1);
+        this.serverOrder.delete(shape.id);
 
         if (shape.groupId !== undefined) {
             removeGroupMember(shape.groupId, shape.id, false);
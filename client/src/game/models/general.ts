@@ -23,12 +23,20 @@ export interface ServerLayer {
     name: string;
     groups: ServerGroup[];
     shapes: ServerShape[];
+    // Index of every shape in the layer, only present when the floor is loaded in chunks
+    indices?: number[];
     selectable: boolean;
     player_editable: boolean;
     player_visible: boolean;
     size?: number;
 }
 
+// Next chunk of shapes of a floor that is being loaded
+export interface ServerFloorShapes {
+    floor: string;
+    layers: Pick<ServerLayer, "name" | "shapes" | "indices">[];
+}
+
 export interface Note {
     title: string;
     text: string;
@@ -99,14 +99,26 @@ class InitiativeStore extends Store<InitiativeState> {
         } else {
             actor.initiative = initiative;
         }
+        this.sortData();
         sendInitiativeAdd(actor);
     }
 
+    updateActor(data: InitiativeData): void {
+        const actor = this._state.locationData.find((a) => a.shape === data.shape);
+        if (actor === undefined) {
+            this._state.locationData.push(data);
+        } else {
+            Object.assign(actor, data);
+        }
+        this.sortData();
+    }
+
     setInitiative(shapeId: LocalId, value: number, sync: boolean): void {
         const actor = this.getDataSet().find((a) => a.shape === shapeId);
         if (actor === undefined) return;
 
         actor.initiative = value;
+        this.sortData();
         if (sync) sendInitiativeSetValue({ shape: getGlobalId(shapeId), value });
     }
 
@@ -139,6 +151,22 @@ class InitiativeStore extends Store<InitiativeState> {
         }
     }
 
+    applyOrderChange(oldIndex: number, newIndex: number, sort: InitiativeSort): void {
+        const data = this.getDataSet();
+        data.splice(newIndex, 0, ...data.splice(oldIndex, 1));
+        this._state.sort = sort;
+        this.sortData();
+    }
+
+    // Mirrors the server side sort, so that value changes only need to send the changed actor
+    private sortData(): void {
+        if (this._state.sort === InitiativeSort.Manual) return;
+        const data = this.getDataSet();
+        const direction = this._state.sort === InitiativeSort.Down ? -1 : 1;
+        // Array.prototype.sort is stable, so actors with equal values keep their relative order
+        data.sort((a, b) => direction * ((a.initiative ?? 0) - (b.initiative ?? 0)));
+    }
+
     // TURN / ROUND TRACKING
 
     setTurnCounter(turn: number, sync: boolean): void {
@@ -194,6 +222,7 @@ class InitiativeStore extends Store<InitiativeState> {
 
     changeSort(sort: number, sync: boolean): void {
         this._state.sort = sort;
+        this.sortData();
         if (sync) sendInitiativeSetSort(sort);
     }
 
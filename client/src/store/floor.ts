@@ -23,7 +23,7 @@ import { MapLayer } from "../game/layers/variants/map";
 import { LayerName } from "../game/models/floor";
 import type { FloorId } from "../game/models/floor";
 import type { Floor, FloorType } from "../game/models/floor";
-import type { ServerFloor, ServerLayer } from "../game/models/general";
+import type { ServerFloor, ServerFloorShapes, ServerLayer } from "../game/models/general";
 import { groupToClient } from "../game/models/groups";
 import { TriangulationTarget, visionState } from "../game/vision/state";
 
@@ -124,6 +124,19 @@ class FloorStore extends Store<FloorState> {
         recalculateZIndices();
     }
 
+    addServerShapes(data: ServerFloorShapes): void {
+        const floor = this.getFloor({ name: data.floor }, false);
+        if (floor === undefined) return;
+        for (const serverLayer of data.layers) {
+            const layer = this.getLayer(floor, serverLayer.name as LayerName);
+            if (layer === undefined) continue;
+            layer.addServerShapes(serverLayer.shapes, serverLayer.indices);
+            layer.invalidate(true);
+        }
+        visionState.recalculateVision(floor.id);
+        visionState.recalculateMovement(floor.id);
+    }
+
     private addFloor(floor: Floor, targetIndex?: number): void {
         // We do some special magic here to allow out of order loading of floors on startup
         if (targetIndex !== undefined) {
@@ -259,7 +272,7 @@ class FloorStore extends Store<FloorState> {
         }
 
         // Load layer shapes
-        layer.setServerShapes(layerInfo.shapes);
+        layer.setServerShapes(layerInfo.shapes, layerInfo.indices);
     }
 
     addLayer(layer: Layer, floorId: number): void {
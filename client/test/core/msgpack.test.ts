@@ -0,0 +1,52 @@
+import { describe, expect, it } from "vitest";
+
+import { decodeInterned } from "../../src/core/msgpack";
+
+// Payloads as packed by server/api/socket/encoding.py
+function fromHex(hex: string): Uint8Array {
+    return new Uint8Array(hex.match(/../g)!.map((byte) => parseInt(byte, 16)));
+}
+
+const FLOOR = fromHex(
+    "929aa46e616d65a66c6179657273a5696e646578a474657874a6736861706573a475756964a178a179a776697369626c65a56f776e6572" +
+        "8400a5666c6f6f7201918200a6746f6b656e7304928505a16106cb3ff800000000000007fd08c309c08505a16206cd012c07d1ff3808" +
+        "c209c002ce0001117003d92878787878787878787878787878787878787878787878787878787878787878787878787878787878",
+);
+
+describe("decodeInterned", () => {
+    it("restores the interned keys", () => {
+        expect(decodeInterned(FLOOR)).toEqual({
+            name: "floor",
+            layers: [
+                {
+                    name: "tokens",
+                    shapes: [
+                        { uuid: "a", x: 1.5, y: -3, visible: true, owner: null },
+                        { uuid: "b", x: 300, y: -200, visible: false, owner: null },
+                    ],
+                },
+            ],
+            index: 70000,
+            text: "x".repeat(40),
+        });
+    });
+
+    it("accepts an ArrayBuffer", () => {
+        const buffer = FLOOR.buffer.slice(FLOOR.byteOffset, FLOOR.byteOffset + FLOOR.byteLength);
+        expect(decodeInterned<{ name: string }>(buffer).name).toBe("floor");
+    });
+
+    it("accepts a view into a larger buffer", () => {
+        const bytes = new Uint8Array(FLOOR.byteLength + 4);
+        bytes.set(FLOOR, 2);
+        expect(decodeInterned<{ index: number }>(bytes.subarray(2, 2 + FLOOR.byteLength)).index).toBe(70000);
+    });
+
+    it("turns non string keys into strings", () => {
+        expect(decodeInterned(fromHex("9291a131918100a36f6e65"))).toEqual([{ "1": "one" }]);
+    });
+
+    it("rejects payloads that are not a [keys, data] pair", () => {
+        expect(() => decodeInterned(fromHex("93000102"))).toThrow("Malformed payload");
+    });
+});
@@ -0,0 +1,21 @@
+from aiohttp import web
+from aiohttp_security import check_authorized
+from multidict import MultiDict
+
+from models import User
+from state.exports import export_manager
+
+
+async def get_export(request: web.Request):
+    user: User = await check_authorized(request)
+
+    job = export_manager.get(request.match_info["uuid"])
+    if job is None or job.user_id != user.id:
+        return web.HTTPNotFound()
+    if not job.done:
+        return web.HTTPConflict()
+
+    return web.FileResponse(
+        job.path,
+        headers=MultiDict({"Content-Disposition": f"Attachment;filename={job.name}"}),
+    )
@@ -2,11 +2,11 @@ from typing import Union
 from aiohttp import web
 from aiohttp_security import check_authorized
 from multidict import MultiDict
-from export.campaign import export_campaign
 
 from models import Location, LocationOptions, PlayerRoom, Room, User
 from models.db import db
 from models.role import Role
+from state.exports import export_manager
 
 
 async def get_list(request: web.Request):
@@ -185,8 +185,23 @@ async def export(request: web.Request):
         if room is None:
             return web.HTTPBadRequest()
 
-        fp, fl = export_campaign(room)
-        return web.FileResponse(
-            fp, headers=MultiDict({"Content-Disposition": f"Attachment;filename={fl}"})
-        )
+        job = export_manager.start_campaign(user.id, room)
+        return web.json_response({"uuid": job.uuid}, status=202)
     return web.HTTPUnauthorized()
+
+
+async def get_export(request: web.Request):
+    user: User = await check_authorized(request)
+
+    job = export_manager.get(request.match_info["uuid"])
+    if job is None or job.user_id != user.id:
+        return web.HTTPNotFound()
+    if job.failed:
+        return web.HTTPInternalServerError()
+    if not job.done:
+        return web.json_response({"uuid": job.uuid}, status=202)
+
+    return web.FileResponse(
+        job.path,
+        headers=MultiDict({"Content-Disposition": f"Attachment;filename={job.name}"}),
+    )
@@ -1,26 +1,24 @@
-import hashlib
-import io
+import asyncio
 import json
-import os
-import shutil
-import tarfile
-import tempfile
-import time
 from collections import defaultdict
 from pathlib import Path
-from typing import cast, Dict, List, Optional, Union
+from typing import Any, cast, Dict, List, Optional, Union
 from typing_extensions import TypedDict
 
 from aiohttp import web
 from aiohttp_security import authorized_userid
-from uuid import uuid4
+from peewee import chunked, fn
 
 import auth
 from app import app, sio
+from export.assets import read_asset_archive
 from models import Asset
+from models.db import db, db_executor
 from models.user import User
 from state.asset import asset_state
+from state.exports import export_manager
 from state.game import game_state
+from state.uploads import PendingUpload, UploadError, upload_manager
 from utils import logger
 from ..constants import ASSET_NS, GAME_NS
 from .common import UploadData
@@ -41,14 +39,16 @@ class AssetExport(TypedDict):
 
 
 async def update_live_game(user: User):
-    for sid, pr in game_state._sid_map.items():
-        if pr.player == user:
-            await sio.emit(
-                "Asset.List.Set",
-                Asset.get_user_structure(user),
-                room=sid,
-                namespace=GAME_NS,
-            )
+    # Every handler that changes assets ends up here, so this is where the cache is cleared
+    asset_state.invalidate_structure(user)
+
+    sids = list(game_state.get_sids(player=user))
+    if not sids:
+        return
+
+    structure = await asset_state.get_structure(user)
+    for sid in sids:
+        await sio.emit("Asset.List.Set", structure, room=sid, namespace=GAME_NS)
 
 
 @sio.on("connect", namespace=ASSET_NS)
@@ -186,66 +186,51 @@ def cleanup_assets(assets):
             cleanup_assets(asset["children"])
 
 
-def get_safe_members(
-    members: List[tarfile.TarInfo], directory: str
-) -> List[tarfile.TarInfo]:
-    safe_members: List[tarfile.TarInfo] = []
-    for member in members:
-        if member.islnk() or member.issym():
-            continue
-        if member.name.startswith("/") or ".." in member.name:
-            continue
-        # there is no real harm in extracting other files, but doesn't hurt to be a bit more strict
-        if member.name != "data" and not member.name.startswith("files"):
-            continue
-        safe_members.append(member)
-    return safe_members
-
-
-async def handle_paa_file(upload_data: UploadData, data: bytes, sid: str):
-    with tempfile.TemporaryDirectory() as tmpdir:
-        with tarfile.open(fileobj=io.BytesIO(data), mode="r:bz2") as tar:
-            files = tarfile.TarInfo("files")
-            files.type = tarfile.DIRTYPE
-            # We need to explicitly list our members for security reasons
-            # this is upload data so people could upload malicious stuff that breaks out of the path etc
-            tar.extractall(
-                path=tmpdir, members=get_safe_members(tar.getmembers(), tmpdir)
+def _insert_assets(
+    raw_assets: List[Dict[str, Any]], user: User, directory: int
+) -> None:
+    """
+    Creates the assets of an imported archive with a single bulk insert.
+
+    The ids are assigned up front, so that children can refer to their new parent.
+    The immediate transaction makes sure no other write can claim those ids in the meantime.
+    """
+    with db.atomic(lock_type="IMMEDIATE"):
+        next_id = (Asset.select(fn.MAX(Asset.id)).scalar() or 0) + 1
+        parent_map: Dict[int, int] = defaultdict(lambda: directory)
+        rows = []
+        for raw_asset in raw_assets:
+            rows.append(
+                {
+                    "id": next_id,
+                    "name": raw_asset["name"],
+                    "file_hash": raw_asset["file_hash"],
+                    "owner": user.id,
+                    "parent": parent_map[raw_asset["parent"]],
+                    "options": raw_asset["options"],
+                }
             )
+            parent_map[raw_asset["id"]] = next_id
+            next_id += 1
 
-        tmp_path = Path(tmpdir)
-        for asset in os.listdir(tmp_path / "files"):
-            if not (ASSETS_DIR / asset).exists():
-                shutil.move(str(tmp_path / "files" / asset), str(ASSETS_DIR / asset))
+        for batch in chunked(rows, 100):
+            Asset.insert_many(batch).execute()
 
-        with open(tmp_path / "data") as json_data:
-            raw_assets: List[AssetDict] = json.load(json_data)
+
+async def handle_paa_file(upload_data: UploadData, path: Path, sid: str):
+    loop = asyncio.get_running_loop()
+    raw_assets = await loop.run_in_executor(None, read_asset_archive, path, ASSETS_DIR)
 
     user = asset_state.get_user(sid)
-    parent_map: Dict[int, int] = defaultdict(lambda: upload_data["directory"])
-
-    for raw_asset in raw_assets:
-        new_asset = Asset.create(
-            name=raw_asset["name"],
-            file_hash=raw_asset["file_hash"],
-            owner=user,
-            parent=parent_map[raw_asset["parent"]],
-            options=raw_asset["options"],
-        )
-        parent_map[raw_asset["id"]] = new_asset.id
+    await db_executor.run(_insert_assets, raw_assets, user, upload_data["directory"])
 
     await sio.emit(
         "Asset.Import.Finish", upload_data["name"], room=sid, namespace=ASSET_NS
     )
 
 
-async def handle_regular_file(upload_data: UploadData, data: bytes, sid: str):
-    sh = hashlib.sha1(data)
-    hashname = sh.hexdigest()
-
-    if not (ASSETS_DIR / hashname).exists():
-        with open(ASSETS_DIR / hashname, "wb") as f:
-            f.write(data)
+async def handle_regular_file(upload_data: UploadData, upload: PendingUpload, sid: str):
+    hashname = upload.store()
 
     user = asset_state.get_user(sid)
 
@@ -279,33 +264,38 @@ async def handle_regular_file(upload_data: UploadData, data: bytes, sid: str):
 
 @sio.on("Asset.Upload", namespace=ASSET_NS)
 @auth.login_required(app, sio)
-async def assetmgmt_upload(sid: str, upload_data: UploadData):
-    uuid = upload_data["uuid"]
+async def assetmgmt_upload(sid: str, upload_data: UploadData) -> bool:
+    user = asset_state.get_user(sid)
+
+    try:
+        upload = upload_manager.add_slice(user.id, upload_data)
+    except UploadError as e:
+        logger.warning(f"{user.name} upload of {upload_data['name']} rejected: {e}")
+        return False
 
-    if uuid not in asset_state.pending_file_upload_cache:
-        asset_state.pending_file_upload_cache[uuid] = {}
-    asset_state.pending_file_upload_cache[uuid][upload_data["slice"]] = upload_data
-    if len(asset_state.pending_file_upload_cache[uuid]) != upload_data["totalSlices"]:
+    if upload is None:
         # wait for the rest of the slices
-        return
+        return True
 
     # All slices are present
-    data = b""
-    for slice_ in range(upload_data["totalSlices"]):
-        data += asset_state.pending_file_upload_cache[uuid][slice_]["data"]
-
-    del asset_state.pending_file_upload_cache[upload_data["uuid"]]
-
     file_name = upload_data["name"]
-    if file_name.endswith(".paa"):
-        await handle_paa_file(upload_data, data, sid)
-    elif file_name.endswith(".dd2vtt"):
-        await handle_ddraft_file(upload_data, data, sid)
-    else:
-        await handle_regular_file(upload_data, data, sid)
+    try:
+        if file_name.endswith(".paa"):
+            await handle_paa_file(upload_data, upload.path, sid)
+        elif file_name.endswith(".dd2vtt"):
+            with open(upload.path, "rb") as f:
+                data = f.read()
+            await handle_ddraft_file(upload_data, data, sid)
+        else:
+            await handle_regular_file(upload_data, upload, sid)
+    except Exception:
+        logger.exception(f"Failed to process upload {file_name} of {user.name}")
+        return False
+    finally:
+        upload.discard()
 
-    user = asset_state.get_user(sid)
     await update_live_game(user)
+    return True
 
 
 def export_asset(asset: Union[AssetDict, List[AssetDict]], parent=-1) -> AssetExport:
@@ -333,44 +323,31 @@ def export_asset(asset: Union[AssetDict, List[AssetDict]], parent=-1) -> AssetEx
     return {"file_hashes": file_hashes, "data": asset_info}
 
 
+class ExportRequest(TypedDict, total=False):
+    selection: List[int]
+    compression: str
+
+
 @sio.on("Asset.Export", namespace=ASSET_NS)
 @auth.login_required(app, sio)
-async def assetmgmt_export(sid: str, selection: List[int]):
+async def assetmgmt_export(sid: str, data: Union[List[int], ExportRequest]):
+    user = asset_state.get_user(sid)
+
+    # Older clients only send the selection
+    if isinstance(data, list):
+        data = {"selection": data}
 
     full_selection: List[AssetDict] = [
-        Asset.get_by_id(asset).as_dict(True, True) for asset in selection
+        Asset.get_by_id(asset).as_dict(True, True) for asset in data["selection"]
     ]
 
     asset_data = export_asset(full_selection)
-    json_data = json.dumps(asset_data["data"])
 
-    data_tar_info = tarfile.TarInfo(
-        "data",
+    job = export_manager.start(
+        user.id,
+        sid,
+        json.dumps(asset_data["data"]),
+        asset_data["file_hashes"],
+        data.get("compression", None),
     )
-    data_tar_info.size = len(json_data)
-    data_tar_info.mode = 0o755
-    data_tar_info.mtime = time.time()  # type: ignore
-
-    files_tar_info = tarfile.TarInfo("files")
-    files_tar_info.type = tarfile.DIRTYPE
-    files_tar_info.mode = 0o755
-    files_tar_info.mtime = time.time()  # type: ignore
-
-    uuid = uuid4()
-    static_folder = Path("static")
-    os.makedirs(static_folder / "temp", exist_ok=True)
-    with tarfile.open(static_folder / "temp" / f"{uuid}.paa", "w:bz2") as tar:
-        tar.addfile(data_tar_info, io.BytesIO(json_data.encode("utf-8")))
-        tar.addfile(files_tar_info)
-        for file_hash in asset_data["file_hashes"]:
-            try:
-                file_path = static_folder / "assets" / file_hash
-                info = tar.gettarinfo(str(file_path))
-                info.name = f"files/{file_hash}"
-                info.mtime = time.time()  # type: ignore
-                info.mode = 0o755
-                tar.addfile(info, open(file_path, "rb"))  # type: ignore
-            except FileNotFoundError:
-                pass
-
-    await sio.emit("Asset.Export.Finish", str(uuid), room=sid, namespace=ASSET_NS)
+    await sio.emit("Asset.Export.Start", job.uuid, room=sid, namespace=ASSET_NS)
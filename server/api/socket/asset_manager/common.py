@@ -1,7 +1,7 @@
 from typing import List
 from typing_extensions import TypedDict
 
-from utils import FILE_DIR
+from utils import ASSETS_DIR
 
 
 class UploadData(TypedDict):
@@ -12,8 +12,3 @@ class UploadData(TypedDict):
     slice: int
     totalSlices: int
     data: bytes
-
-
-ASSETS_DIR = FILE_DIR / "static" / "assets"
-if not ASSETS_DIR.exists():
-    ASSETS_DIR.mkdir()
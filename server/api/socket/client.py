@@ -8,7 +8,7 @@ from api.socket.constants import GAME_NS
 from app import app, sio
 from data_types.location import LocationOptions
 from models import Floor, Layer, LocationUserOption, PlayerRoom
-from models.db import db
+from models.db import db_executor
 from models.role import Role
 from models.user import UserOptions
 from state.game import game_state
@@ -44,9 +44,10 @@ class ClientOptions(TypedDict, total=False):
 async def set_client_default_options(sid: str, data: ClientOptions):
     pr: PlayerRoom = game_state.get(sid)
 
-    UserOptions.update(**data).where(
+    query = UserOptions.update(**data).where(
         UserOptions.id == pr.player.default_options
-    ).execute()
+    )
+    await db_executor.run(query.execute)
 
 
 @sio.on("Client.Options.Room.Set", namespace=GAME_NS)
@@ -54,12 +55,12 @@ async def set_client_default_options(sid: str, data: ClientOptions):
 async def set_client_room_options(sid: str, data: ClientOptions):
     pr: PlayerRoom = game_state.get(sid)
 
-    with db.atomic():
-        if pr.user_options is None:
-            pr.user_options = UserOptions.create_empty()
-            pr.save()
+    if pr.user_options is None:
+        pr.user_options = await db_executor.run(UserOptions.create_empty)
+        await db_executor.save(pr)
 
-        UserOptions.update(**data).where(UserOptions.id == pr.user_options).execute()
+    query = UserOptions.update(**data).where(UserOptions.id == pr.user_options)
+    await db_executor.run(query.execute)
 
 
 async def update_client_location(
@@ -67,14 +68,15 @@ async def update_client_location(
 ):
     pr = PlayerRoom.get(player=player, room=room)
 
-    LocationUserOption.update(
+    query = LocationUserOption.update(
         pan_x=data["pan_x"],
         pan_y=data["pan_y"],
         zoom_display=data["zoom_display"],
     ).where(
         (LocationUserOption.location == pr.active_location)
         & (LocationUserOption.user == pr.player)
-    ).execute()
+    )
+    await db_executor.run(query.execute)
 
     if pr.role != Role.DM:
         for p_sid, p_player in game_state.get_t(skip_sid=sid):
@@ -117,4 +119,4 @@ async def set_layer(sid: str, data: Dict[str, Any]):
     else:
         luo = LocationUserOption.get(user=pr.player, location=pr.active_location)
         luo.active_layer = layer
-        luo.save()
+        await db_executor.save(luo)
@@ -4,8 +4,10 @@ from urllib.parse import unquote
 from aiohttp_security import authorized_userid
 
 from api.socket.constants import GAME_NS
+from api.socket.encoding import payload_encoder
 from app import sio
 from models import PlayerRoom, Room, User
+from models.db import db_executor
 from models.role import Role
 from state.game import game_state
 from utils import logger
@@ -42,12 +44,13 @@ async def connect(sid, environ):
 
     pr: PlayerRoom = PlayerRoom.get(room=room, player=user)
     pr.last_played = date.today()
-    pr.save()
+    await db_executor.save(pr)
     await game_state.add_sid(sid, pr)
 
     logger.info(f"User {user.name} connected with identifier {sid}")
 
-    sio.enter_room(sid, pr.active_location.get_path(), namespace=GAME_NS)
+    sio.enter_room(sid, game_state.get_session(sid).location_path, namespace=GAME_NS)
+    payload_encoder.negotiate(sid, ref.get("encoding", None))
 
 
 @sio.on("disconnect", namespace=GAME_NS)
@@ -58,4 +61,5 @@ async def disconnect(sid):
     user = game_state.get_user(sid)
 
     logger.info(f"User {user.name} disconnected with identifier {sid}")
+    payload_encoder.forget(sid)
     await game_state.remove_sid(sid)
@@ -0,0 +1,75 @@
+"""
+Compact encoding of the large shape payloads of the game namespace.
+
+Clients that connect with `encoding=msgpack` in their query string receive
+`Board.Floor.Set` and `Shapes.Add` as a msgpack encoded binary attachment instead of JSON,
+if the server allows it (`allow_msgpack` in the Webserver config section)
+and the msgpack package is installed. Everything else is still sent as JSON.
+
+Object keys are interned: the payload is encoded as `[keys, data]`,
+where every object key in `data` is replaced by its index in `keys`.
+Packing a floor takes a while, so it runs on a worker thread instead of the event loop.
+"""
+
+import asyncio
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from config import config
+from utils import logger
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def intern_keys(data: Any) -> List[Any]:
+    keys: Dict[str, int] = {}
+    # Shapes all share the same few key layouts, so map those only once per layout
+    layouts: Dict[Tuple[Any, ...], List[int]] = {}
+    containers = (dict, list, tuple)
+
+    def walk(value: Any) -> Any:
+        if type(value) is dict:
+            layout = tuple(value)
+            indices = layouts.get(layout, None)
+            if indices is None:
+                # Like JSON, non string keys end up as strings on the client
+                indices = layouts[layout] = [
+                    keys.setdefault(str(k), len(keys)) for k in layout
+                ]
+            values = [walk(v) if type(v) in containers else v for v in value.values()]
+            return dict(zip(indices, values))
+        return [walk(v) if type(v) in containers else v for v in value]
+
+    tree = walk(data) if type(data) in containers else data
+    return [list(keys), tree]
+
+
+def pack(data: Any) -> bytes:
+    return msgpack.packb(intern_keys(data))
+
+
+class PayloadEncoder:
+    def __init__(self) -> None:
+        self._packed_sids: Set[str] = set()
+        self.allowed = config.getboolean("Webserver", "allow_msgpack", fallback=False)
+        if self.allowed and msgpack is None:
+            logger.warning("allow_msgpack is set, but msgpack is not installed")
+            self.allowed = False
+
+    def negotiate(self, sid: str, encoding: Optional[str]) -> None:
+        if encoding == "msgpack" and self.allowed:
+            self._packed_sids.add(sid)
+
+    def forget(self, sid: str) -> None:
+        self._packed_sids.discard(sid)
+
+    async def encode(self, sid: str, data: Any) -> Any:
+        """Returns the payload to emit to the given sid."""
+        if sid in self._packed_sids:
+            return await asyncio.get_running_loop().run_in_executor(None, pack, data)
+        return data
+
+
+payload_encoder = PayloadEncoder()
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from typing_extensions import TypedDict
 
 import auth
@@ -7,7 +7,9 @@ from app import app, sio
 from models import Floor, PlayerRoom
 from models.db import db
 from models.role import Role
+from models.shape.geometry import has_geometry_support
 from state.game import game_state
+from state.snapshots import snapshot_cache
 from utils import logger
 
 # DATA CLASSES FOR TYPE CHECKING
@@ -54,6 +56,30 @@ async def create_floor(sid: str, data: str):
         )
 
 
+@sio.on("Floor.Blockers.Get", namespace=GAME_NS)
+@auth.login_required(app, sio)
+async def get_floor_blockers(sid: str, data: str) -> Optional[Dict[str, bytes]]:
+    """
+    Answers with the precomputed vision and movement blockers of a floor
+    (see FloorSnapshot.get_blockers), or None if they can't be provided.
+
+    Experimental: the client does not request these yet and still triangulates its own shapes.
+    """
+    pr: PlayerRoom = game_state.get(sid)
+
+    if not has_geometry_support():
+        logger.warning("Floor blockers were requested, but NumPy is not installed")
+        return None
+
+    floor = Floor.get_or_none(location=pr.active_location, name=data)
+    if floor is None:
+        logger.warning(f"{pr.player.name} requested blockers of an unknown floor")
+        return None
+
+    snapshot = await snapshot_cache.get_floor(floor)
+    return snapshot.get_blockers(pr.role == Role.DM)
+
+
 @sio.on("Floor.Remove", namespace=GAME_NS)
 @auth.login_required(app, sio)
 async def remove_floor(sid: str, data: str):
@@ -69,7 +95,7 @@ async def remove_floor(sid: str, data: str):
     await sio.emit(
         "Floor.Remove",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -91,7 +117,7 @@ async def set_floor_visibility(sid: str, data: FloorVisibleData):
     await sio.emit(
         "Floor.Visible.Set",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -113,7 +139,7 @@ async def rename_floor(sid: str, data: FloorRename):
     await sio.emit(
         "Floor.Rename",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -135,7 +161,7 @@ async def set_floor_type(sid: str, data: FloorTypeData):
     await sio.emit(
         "Floor.Type.Set",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -157,7 +183,7 @@ async def set_floor_background(sid: str, data: FloorBackgroundData):
     await sio.emit(
         "Floor.Background.Set",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -181,7 +207,7 @@ async def reorder_floors(sid: str, data: List[str]):
     await sio.emit(
         "Floors.Reorder",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -1,25 +1,21 @@
-import json
 from typing import List, Optional
 from typing_extensions import TypedDict
 
 import auth
 from api.socket.constants import GAME_NS
 from app import app, sio
-from models import (
-    Initiative,
-    PlayerRoom,
-    Shape,
-)
-from models.db import db
+from models import PlayerRoom, Shape
 from models.role import Role
 from models.shape.access import has_ownership
 from state.game import game_state
+from state.initiative import LocationInitiative, initiative_engine
+from state.shapes import shape_store
 from utils import logger
 
 
 class ServerInitiativeEffect(TypedDict):
     name: str
-    turns: int
+    turns: str
     highlightsActor: bool
 
 
@@ -70,12 +66,6 @@ class ServerInitiativeOrderChange(TypedDict):
     newIndex: int
 
 
-def sort_initiative(data, sort: int):
-    if sort == 2:
-        return data
-    return sorted(data, key=lambda x: x.get("initiative", 0) or 0, reverse=sort == 0)
-
-
 @sio.on("Initiative.Request", namespace=GAME_NS)
 @auth.login_required(app, sio)
 async def request_initiatives(sid: str):
@@ -84,7 +74,7 @@ async def request_initiatives(sid: str):
     await sio.emit(
         "Initiative.Request",
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -94,7 +84,7 @@ async def request_initiatives(sid: str):
 async def update_initiative_option(sid: str, data: ServerInitiativeOption):
     pr: PlayerRoom = game_state.get(sid)
 
-    shape = Shape.get_or_none(uuid=data["shape"])
+    shape = shape_store.get(pr.active_location_id, data["shape"])
 
     if not has_ownership(shape, pr):
         logger.warning(
@@ -102,27 +92,18 @@ async def update_initiative_option(sid: str, data: ServerInitiativeOption):
         )
         return
 
-    location_data = Initiative.get_or_none(location=pr.active_location)
+    location_data = _get_location_data(pr)
     if location_data is None:
-        logger.error("Initiative updated for location without initiative tracking")
         return
 
-    json_data = json.loads(location_data.data)
-
-    with db.atomic():
-        for i, initiative_data in enumerate(json_data):
-            if initiative_data["shape"] == data["shape"]:
-                json_data[i][data["option"]] = data["value"]
-                break
-
-        location_data.data = json.dumps(json_data)
-        location_data.save()
+    location_data.set_option(data["shape"], data["option"], data["value"])
+    initiative_engine.mark_dirty(location_data)
 
     await sio.emit(
         "Initiative.Option.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -140,26 +121,16 @@ async def add_initiative(sid: str, data: ServerInitiativeData):
         )
         return
 
-    with db.atomic():
-        location_data, _ = Initiative.get_or_create(
-            location=pr.active_location, defaults={"round": 0, "turn": 0, "data": "[]"}
-        )
-        json_data = json.loads(location_data.data)
-
-        for initiative in json_data:
-            if initiative["shape"] == data["shape"]:
-                initiative.update(**data)
-                break
-        else:
-            json_data.append(data)
-
-        location_data.data = json.dumps(json_data)
-        location_data.save()
+    location_data = initiative_engine.get_or_create(pr.active_location_id)
+    actor = location_data.add(data)
+    location_data.apply_sort()
+    initiative_engine.mark_dirty(location_data)
 
     await sio.emit(
-        "Initiative.Set",
-        location_data.as_dict(),
-        room=pr.active_location.get_path(),
+        "Initiative.Add",
+        actor,
+        room=game_state.get_session(sid).location_path,
+        skip_sid=sid,
         namespace=GAME_NS,
     )
 
@@ -177,24 +148,18 @@ async def set_initiative_value(sid: str, data: ServerSetInitiativeValue):
         )
         return
 
-    with db.atomic():
-        location_data = Initiative.get(location=pr.active_location)
-        json_data = json.loads(location_data.data)
-
-        for initiative in json_data:
-            if initiative["shape"] == data["shape"]:
-                initiative["initiative"] = data["value"]
-                break
-
-        json_data = sort_initiative(json_data, location_data.sort)
-
-        location_data.data = json.dumps(json_data)
-        location_data.save()
+    location_data = initiative_engine.get(pr.active_location_id)
+    if location_data is None or not location_data.set_value(
+        data["shape"], data["value"]
+    ):
+        return
+    initiative_engine.mark_dirty(location_data)
 
     await sio.emit(
-        "Initiative.Set",
-        location_data.as_dict(),
-        room=pr.active_location.get_path(),
+        "Initiative.Value.Set",
+        data,
+        room=game_state.get_session(sid).location_path,
+        skip_sid=sid,
         namespace=GAME_NS,
     )
 
@@ -208,19 +173,15 @@ async def clear_initiatives(sid: str):
         logger.warning(f"{pr.player.name} attempted to clear all initiatives")
         return
 
-    with db.atomic():
-        location_data = Initiative.get(location=pr.active_location)
-        json_data = json.loads(location_data.data)
-
-        for initiative in json_data:
-            initiative["initiative"] = None
-
-        location_data.data = json.dumps(json_data)
-        location_data.save()
+    location_data = initiative_engine.get(pr.active_location_id)
+    if location_data is None:
+        return
+    location_data.clear_values()
+    initiative_engine.mark_dirty(location_data)
 
     await sio.emit(
         "Initiative.Clear",
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -238,18 +199,16 @@ async def remove_initiative(sid: str, data: str):
         )
         return
 
-    with db.atomic():
-        location_data = Initiative.get(location=pr.active_location)
-        json_data = json.loads(location_data.data)
-        location_data.data = json.dumps(
-            [initiative for initiative in json_data if initiative["shape"] != data]
-        )
-        location_data.save()
+    location_data = initiative_engine.get(pr.active_location_id)
+    if location_data is None:
+        return
+    location_data.remove(data)
+    initiative_engine.mark_dirty(location_data)
 
     await sio.emit(
         "Initiative.Remove",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -264,32 +223,23 @@ async def change_initiative_order(sid: str, data: ServerInitiativeOrderChange):
         logger.warning(f"{pr.player.name} attempted to reorder initiatives")
         return
 
-    old_index = data["oldIndex"]
-    new_index = data["newIndex"]
-
-    with db.atomic():
-        location_data = Initiative.get(location=pr.active_location)
-        json_data = json.loads(location_data.data)
-
-        if json_data[old_index]["shape"] != data["shape"]:
-            return
-
-        if json_data[new_index].get("initiative", 0) != json_data[old_index].get(
-            "initiative", 0
-        ):
-            location_data.sort = 2
-
-        json_data.insert(new_index, json_data.pop(old_index))
-
-        json_data = sort_initiative(json_data, location_data.sort)
-
-        location_data.data = json.dumps(json_data)
-        location_data.save()
+    location_data = initiative_engine.get(pr.active_location_id)
+    if location_data is None or not location_data.change_order(
+        data["shape"], data["oldIndex"], data["newIndex"]
+    ):
+        return
+    initiative_engine.mark_dirty(location_data)
 
+    # The client only applies the reorder once the server confirms it, so include the sender
     await sio.emit(
-        "Initiative.Set",
-        location_data.as_dict(),
-        room=pr.active_location.get_path(),
+        "Initiative.Order.Change",
+        {
+            "shape": data["shape"],
+            "oldIndex": data["oldIndex"],
+            "newIndex": data["newIndex"],
+            "sort": location_data.sort,
+        },
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -299,40 +249,21 @@ async def change_initiative_order(sid: str, data: ServerInitiativeOrderChange):
 async def update_initiative_turn(sid: str, turn: int):
     pr: PlayerRoom = game_state.get(sid)
 
-    location_data: Initiative = Initiative.get(location=pr.active_location)
-    json_data = json.loads(location_data.data)
+    location_data = initiative_engine.get(pr.active_location_id)
+    if location_data is None:
+        return
 
-    if pr.role != Role.DM and not has_ownership(
-        Shape.get_or_none(uuid=json_data[location_data.turn]["shape"]), pr
-    ):
+    if pr.role != Role.DM and not _owns_current_actor(pr, location_data):
         logger.warning(f"{pr.player.name} attempted to advance the initiative tracker")
         return
 
-    with db.atomic():
-        nextTurn = turn > location_data.turn
-        location_data.turn = turn
-
-        for i, effect in enumerate(json_data[turn]["effects"][-1:]):
-            try:
-                turns = int(effect["turns"])
-                if turns <= 0 and nextTurn:
-                    json_data[turn]["effects"].pop(i)
-                elif turns > 0 and nextTurn:
-                    effect["turns"] = str(turns - 1)
-                else:
-                    effect["turns"] = str(turns + 1)
-            except ValueError:
-                # For non-number inputs do not update the effect
-                pass
-
-        location_data.data = json.dumps(json_data)
-
-        location_data.save()
+    location_data.set_turn(turn)
+    initiative_engine.mark_dirty(location_data)
 
     await sio.emit(
         "Initiative.Turn.Update",
         turn,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -343,26 +274,21 @@ async def update_initiative_turn(sid: str, turn: int):
 async def update_initiative_round(sid: str, data: int):
     pr: PlayerRoom = game_state.get(sid)
 
-    location_data = Initiative.get(location=pr.active_location)
+    location_data = initiative_engine.get(pr.active_location_id)
+    if location_data is None:
+        return
+
+    if pr.role != Role.DM and not _owns_current_actor(pr, location_data):
+        logger.warning(f"{pr.player.name} attempted to advance the initiative tracker")
+        return
 
-    if pr.role != Role.DM:
-        json_data = json.loads(location_data.data)
-        if not has_ownership(
-            Shape.get_or_none(uuid=json_data[location_data.turn]["shape"]), pr
-        ):
-            logger.warning(
-                f"{pr.player.name} attempted to advance the initiative tracker"
-            )
-            return
-
-    with db.atomic():
-        location_data.round = data
-        location_data.save()
+    location_data.set_round(data)
+    initiative_engine.mark_dirty(location_data)
 
     await sio.emit(
         "Initiative.Round.Update",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -377,25 +303,17 @@ async def set_initiative_sort(sid: str, sort: int):
         logger.warning(f"{pr.player.name} attempted to change initiative sort")
         return
 
-    with db.atomic():
-        location_data = Initiative.get(location=pr.active_location)
-        location_data.sort = sort
-        json_data = json.loads(location_data.data)
-
-        json_data = sort_initiative(json_data, location_data.sort)
-
-        location_data.data = json.dumps(json_data)
-        location_data.save()
+    location_data = initiative_engine.get(pr.active_location_id)
+    if location_data is None:
+        return
+    location_data.set_sort(sort)
+    initiative_engine.mark_dirty(location_data)
 
     await sio.emit(
         "Initiative.Sort.Set",
-        room=pr.active_location.get_path(),
-        namespace=GAME_NS,
-    )
-    await sio.emit(
-        "Initiative.Set",
-        location_data.as_dict(),
-        room=pr.active_location.get_path(),
+        sort,
+        room=game_state.get_session(sid).location_path,
+        skip_sid=sid,
         namespace=GAME_NS,
     )
 
@@ -405,25 +323,24 @@ async def set_initiative_sort(sid: str, sort: int):
 async def new_initiative_effect(sid: str, data: ServerInitiativeEffectActor):
     pr: PlayerRoom = game_state.get(sid)
 
-    if not has_ownership(Shape.get_or_none(uuid=data["actor"]), pr):
+    if not has_ownership(shape_store.get(pr.active_location_id, data["actor"]), pr):
         logger.warning(f"{pr.player.name} attempted to create a new initiative effect")
         return
 
-    location_data = Initiative.get(location=pr.active_location)
-    with db.atomic():
-        json_data = json.loads(location_data.data)
-
-        for initiative in json_data:
-            if initiative["shape"] == data["actor"]:
-                initiative["effects"].append(data["effect"])
-
-        location_data.data = json.dumps(json_data)
-        location_data.save()
+    location_data = _get_location_data(pr)
+    if location_data is None:
+        return
+    effects = location_data.get_effects(data["actor"])
+    if effects is None:
+        return
+    effects.append(dict(data["effect"]))
+    location_data.mark_effects_changed()
+    initiative_engine.mark_dirty(location_data)
 
     await sio.emit(
         "Initiative.Effect.New",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -434,25 +351,24 @@ async def new_initiative_effect(sid: str, data: ServerInitiativeEffectActor):
 async def rename_initiative_effect(sid: str, data: ServerRenameInitiativeEffect):
     pr: PlayerRoom = game_state.get(sid)
 
-    if not has_ownership(Shape.get_or_none(uuid=data["shape"]), pr):
+    if not has_ownership(shape_store.get(pr.active_location_id, data["shape"]), pr):
         logger.warning(f"{pr.player.name} attempted to create a new initiative effect")
         return
 
-    location_data = Initiative.get(location=pr.active_location)
-    with db.atomic():
-        json_data = json.loads(location_data.data)
-
-        for initiative in json_data:
-            if initiative["shape"] == data["shape"]:
-                initiative["effects"][data["index"]]["name"] = data["name"]
-
-        location_data.data = json.dumps(json_data)
-        location_data.save()
+    location_data = _get_location_data(pr)
+    if location_data is None:
+        return
+    effects = location_data.get_effects(data["shape"])
+    if effects is None:
+        return
+    effects[data["index"]]["name"] = data["name"]
+    location_data.mark_effects_changed()
+    initiative_engine.mark_dirty(location_data)
 
     await sio.emit(
         "Initiative.Effect.Rename",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -463,25 +379,24 @@ async def rename_initiative_effect(sid: str, data: ServerRenameInitiativeEffect)
 async def set_initiative_effect_tuns(sid: str, data: ServerInitiativeEffectTurns):
     pr: PlayerRoom = game_state.get(sid)
 
-    if not has_ownership(Shape.get_or_none(uuid=data["shape"]), pr):
+    if not has_ownership(shape_store.get(pr.active_location_id, data["shape"]), pr):
         logger.warning(f"{pr.player.name} attempted to create a new initiative effect")
         return
 
-    location_data = Initiative.get(location=pr.active_location)
-    with db.atomic():
-        json_data = json.loads(location_data.data)
-
-        for initiative in json_data:
-            if initiative["shape"] == data["shape"]:
-                initiative["effects"][data["index"]]["turns"] = data["turns"]
-
-        location_data.data = json.dumps(json_data)
-        location_data.save()
+    location_data = _get_location_data(pr)
+    if location_data is None:
+        return
+    effects = location_data.get_effects(data["shape"])
+    if effects is None:
+        return
+    effects[data["index"]]["turns"] = data["turns"]
+    location_data.mark_effects_changed()
+    initiative_engine.mark_dirty(location_data)
 
     await sio.emit(
         "Initiative.Effect.Turns",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -492,25 +407,38 @@ async def set_initiative_effect_tuns(sid: str, data: ServerInitiativeEffectTurns
 async def remove_initiative_effect(sid: str, data: ServerRemoveInitiativeEffectActor):
     pr: PlayerRoom = game_state.get(sid)
 
-    if not has_ownership(Shape.get_or_none(uuid=data["shape"]), pr):
+    if not has_ownership(shape_store.get(pr.active_location_id, data["shape"]), pr):
         logger.warning(f"{pr.player.name} attempted to remove an initiative effect")
         return
 
-    location_data = Initiative.get(location=pr.active_location)
-    with db.atomic():
-        json_data = json.loads(location_data.data)
-
-        for initiative in json_data:
-            if initiative["shape"] == data["shape"]:
-                initiative["effects"].pop(data["index"])
-
-        location_data.data = json.dumps(json_data)
-        location_data.save()
+    location_data = _get_location_data(pr)
+    if location_data is None:
+        return
+    effects = location_data.get_effects(data["shape"])
+    if effects is None:
+        return
+    effects.pop(data["index"])
+    location_data.mark_effects_changed()
+    initiative_engine.mark_dirty(location_data)
 
     await sio.emit(
         "Initiative.Effect.Remove",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
+
+
+def _owns_current_actor(pr: PlayerRoom, location_data: LocationInitiative) -> bool:
+    actor = location_data.get_current_actor()
+    if actor is None:
+        return False
+    return has_ownership(shape_store.get(pr.active_location_id, actor["shape"]), pr)
+
+
+def _get_location_data(pr: PlayerRoom) -> Optional[LocationInitiative]:
+    location_data = initiative_engine.get(pr.active_location_id)
+    if location_data is None:
+        logger.error("Initiative updated for location without initiative tracking")
+    return location_data
@@ -1,16 +1,17 @@
+import asyncio
 import json
-from typing import List, Union
+import math
+from typing import Any, Dict, Iterator, List, Union
 
 from playhouse.shortcuts import update_model_from_dict
 from typing_extensions import TypedDict
 
 import auth
 from api.socket.constants import GAME_NS
+from api.socket.encoding import payload_encoder
 from app import app, sio
 from models import (
     Floor,
-    Initiative,
-    Layer,
     Location,
     LocationOptions,
     LocationUserOption,
@@ -19,11 +20,17 @@ from models import (
     PlayerRoom,
     Room,
     Shape,
+    clone,
 )
-from models.asset import Asset
+from models.db import db_executor
 from models.label import Label, LabelSelection
 from models.role import Role
+from models.shape.spatial import Bounds
+from state.asset import asset_state
 from state.game import game_state
+from state.initiative import initiative_engine
+from state.shapes import shape_store
+from state.snapshots import snapshot_cache
 from utils import logger
 
 from config import config
@@ -70,6 +77,73 @@ class LocationCloneData(TypedDict):
     room: str
 
 
+# Approximate amount of shape bytes per message when sending the floors of a location
+FLOOR_CHUNK_SIZE = 64 * 1024
+# Amount of floor chunks that can be underway before the client has to acknowledge them
+FLOOR_CHUNK_WINDOW = 4
+# Seconds to wait for an acknowledgement before giving up on the client
+FLOOR_CHUNK_TIMEOUT = 30
+
+
+def get_viewport(sid: str, client_options: Dict[str, Any]) -> Bounds:
+    """
+    The area of the location that the client looked at last,
+    based on the pan and zoom stored in its location user options.
+    The screen size is only known if the client already reported it this session.
+    """
+    options = client_options["location_user_options"]
+    grid_size = client_options.get("room_user_options", {}).get("grid_size")
+    if grid_size is None:
+        grid_size = client_options["default_user_options"].get("grid_size") or 50
+    # Same zoom curve as the client (see clientStore.zoomFactor)
+    zoom = (grid_size / 50) / (
+        -5 / 3 + (28 / 15) * math.exp(1.83 * options["zoom_display"])
+    )
+    x, y = -options["pan_x"], -options["pan_y"]
+    if zoom <= 0:
+        return (x, y, x, y)
+    screen = game_state.client_locations.get(sid)
+    width, height = (screen["client_w"], screen["client_h"]) if screen else (1920, 1080)
+    return (x, y, x + width / zoom, y + height / zoom)
+
+
+async def send_floor(
+    sid: str,
+    location: Location,
+    chunks: Iterator[Dict[str, Any]],
+    window: asyncio.Semaphore,
+) -> bool:
+    """
+    Sends the chunks of a floor, the first as Board.Floor.Set
+    and the others as Board.Floor.Shapes.Add.
+
+    Every chunk takes a slot in the window until the client acknowledges it,
+    the next chunk is only serialized once a slot is free.
+    This way a slow client makes the load take longer,
+    instead of making the server buffer the entire floor for it.
+
+    Returns False if the client stopped acknowledging, left or changed location.
+    """
+    for i, chunk in enumerate(chunks):
+        try:
+            await asyncio.wait_for(window.acquire(), FLOOR_CHUNK_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Client {sid} stopped acknowledging floor chunks")
+            return False
+        if not game_state.has_sid(sid):
+            return False
+        if game_state.get(sid).active_location_id != location.id:
+            return False
+        await sio.emit(
+            "Board.Floor.Set" if i == 0 else "Board.Floor.Shapes.Add",
+            await payload_encoder.encode(sid, chunk),
+            room=sid,
+            namespace=GAME_NS,
+            callback=lambda *args: window.release(),
+        )
+    return True
+
+
 @sio.on("Location.Load", namespace=GAME_NS)
 @auth.login_required(app, sio)
 async def _load_location(sid: str):
@@ -82,8 +156,11 @@ async def _load_location(sid: str):
 async def load_location(sid: str, location: Location, *, complete=False):
     pr: PlayerRoom = game_state.get(sid)
     if pr.active_location != location:
+        old_location_id = pr.active_location_id
         pr.active_location = location
-        pr.save()
+        game_state.reindex_sid(sid)
+        game_state.release_location(old_location_id)
+        await db_executor.save(pr)
 
     # 1. Load client options
 
@@ -161,17 +238,28 @@ async def load_location(sid: str, location: Location, *, complete=False):
         higher_floors = floors[index + 1 :] if index < len(floors) else []
         floors = [floors[index], *lower_floors, *higher_floors]
 
+    # Shapes are sent in chunks, closest to the client's viewport first,
+    # so that the client can show the initial screen before the entire floor is in.
+    viewport = get_viewport(sid, client_options)
+    window = asyncio.Semaphore(FLOOR_CHUNK_WINDOW)
     for floor in floors:
-        await sio.emit(
-            "Board.Floor.Set",
-            floor.as_dict(pr.player, pr.role == Role.DM),
-            room=sid,
-            namespace=GAME_NS,
+        snapshot = await snapshot_cache.get_floor(floor)
+        chunks = snapshot.as_chunks(
+            pr.player, pr.role == Role.DM, viewport, FLOOR_CHUNK_SIZE
         )
+        if not await send_floor(sid, location, chunks, window):
+            # Nothing left to do for clients that left or moved on to another location
+            if not game_state.has_sid(sid):
+                return
+            if game_state.get(sid).active_location_id != location.id:
+                return
+            # The remaining floors are skipped, the rest of the location is still sent
+            logger.warning(f"Stopped sending the floors of {location.name} to {sid}")
+            break
 
     # 6. Load Initiative
 
-    location_data = Initiative.get_or_none(location=location)
+    location_data = initiative_engine.get(location.id)
     if location_data:
         await sio.emit(
             "Initiative.Set", location_data.as_dict(), room=sid, namespace=GAME_NS
@@ -233,7 +321,7 @@ async def load_location(sid: str, location: Location, *, complete=False):
     if complete:
         await sio.emit(
             "Asset.List.Set",
-            Asset.get_user_structure(pr.player),
+            await asset_state.get_structure(pr.player),
             room=sid,
             namespace=GAME_NS,
         )
@@ -281,7 +369,7 @@ async def change_location(sid: str, data: LocationChangeData):
         for psid in game_state.get_sids(player=room_player.player, room=pr.room):
             try:
                 sio.leave_room(
-                    psid, room_player.active_location.get_path(), namespace=GAME_NS
+                    psid, game_state.get_session(psid).location_path, namespace=GAME_NS
                 )
                 sio.enter_room(psid, new_location.get_path(), namespace=GAME_NS)
             except KeyError:
@@ -299,7 +387,7 @@ async def change_location(sid: str, data: LocationChangeData):
                     namespace=GAME_NS,
                 )
         room_player.active_location = new_location
-        room_player.save()
+        await db_executor.save(room_player)
 
 
 @sio.on("Location.Options.Set", namespace=GAME_NS)
@@ -341,7 +429,7 @@ async def set_location_options(sid: str, data: LocationOptionsData):
         await sio.emit(
             "Location.Options.Set",
             data,
-            room=pr.active_location.get_path(),
+            room=game_state.get_session(sid).location_path,
             skip_sid=sid,
             namespace=GAME_NS,
         )
@@ -364,11 +452,13 @@ async def add_new_location(sid: str, location: str):
     for psid in game_state.get_sids(
         player=pr.player, active_location=pr.active_location
     ):
-        sio.leave_room(psid, pr.active_location.get_path(), namespace=GAME_NS)
+        sio.leave_room(
+            psid, game_state.get_session(psid).location_path, namespace=GAME_NS
+        )
         sio.enter_room(psid, new_location.get_path(), namespace=GAME_NS)
         await load_location(psid, new_location)
     pr.active_location = new_location
-    pr.save()
+    await db_executor.save(pr)
 
 
 @sio.on("Location.Clone", namespace=GAME_NS)
@@ -386,26 +476,11 @@ async def clone_location(sid: str, data: LocationCloneData):
         logger.warning(f"Destination room {data['room']} not found.")
         return
 
-    src_location = Location.get_by_id(data["location"])
-    new_location = Location.create(
-        room=room, name=src_location.name, index=room.locations.count()
-    )
+    await shape_store.flush()
+    await initiative_engine.flush()
 
-    new_groups = {}
-
-    for prev_floor in src_location.floors.order_by(Floor.index):
-        new_floor = new_location.create_floor(prev_floor.name)
-        for prev_layer in prev_floor.layers:
-            new_layer = new_floor.layers.where(Layer.name == prev_layer.name).get()
-            for src_shape in prev_layer.shapes:
-                new_group = None
-                if src_shape.group:
-                    group_id = src_shape.group.uuid
-                    if group_id not in new_groups:
-                        new_groups[group_id] = src_shape.group.make_copy()
-                    new_group = new_groups[group_id]
-
-                src_shape.make_copy(new_layer, new_group)
+    src_location = Location.get_by_id(data["location"])
+    await db_executor.run(clone.clone_location, src_location, room)
 
 
 @sio.on("Locations.Order.Set", namespace=GAME_NS)
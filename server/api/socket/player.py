@@ -34,7 +34,7 @@ async def bring_players(sid: str, data: BringPlayersData):
     await sio.emit(
         "Position.Set",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -64,6 +64,9 @@ async def set_player_role(sid: str, data: PlayerRoleChange):
     player_pr.save()
 
     for sid in game_state.get_sids(player=player_pr.player, room=pr.room):
+        # Make sure nothing is processed with the old role until the client has reconnected
+        game_state.get(sid).role = new_role
+        game_state.reindex_sid(sid)
         await sio.disconnect(sid, namespace=GAME_NS)
 
     for psid in game_state.get_sids(room=pr.room):
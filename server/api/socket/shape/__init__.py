@@ -1,9 +1,8 @@
 from typing import Any, Dict, List, Tuple, Union
 
-from peewee import Case
-
 import auth
 from api.socket.constants import GAME_NS
+from api.socket.encoding import payload_encoder
 from api.socket.groups import remove_group_if_empty
 from api.socket.shape.data_models import *
 from app import app, sio
@@ -23,16 +22,31 @@ from models import (
     User,
 )
 from models.campaign import Location
-from models.db import db
+from models.db import db, db_executor
 from models.role import Role
+from models.shape import load_options
 from models.shape.access import has_ownership
 from models.utils import get_table, reduce_data_to_model
 from state.game import game_state
+from state.positions import position_broadcaster
+from state.shapes import shape_store
+from state.snapshots import snapshot_cache
 from utils import logger
 
 from . import access, options, toggle_composite
 
 
+def get_shapes(location_id: int, uuids: List[str]) -> List[Shape]:
+    """
+    The shapes of the location with the given uuids, unknown uuids are skipped.
+
+    Handlers that change shapes should use the instances of the shape store,
+    saving another instance drops the changes that are still pending on the cached one.
+    """
+    shapes = [shape_store.get(location_id, uuid) for uuid in uuids]
+    return [shape for shape in shapes if shape is not None]
+
+
 @sio.on("Shape.Add", namespace=GAME_NS)
 @auth.login_required(app, sio)
 async def add_shape(sid: str, data: ShapeAdd):
@@ -55,39 +69,7 @@ async def add_shape(sid: str, data: ShapeAdd):
     if data["temporary"]:
         game_state.add_temp(sid, data["shape"]["uuid"])
     else:
-        with db.atomic():
-            data["shape"]["layer"] = layer
-            data["shape"]["index"] = layer.shapes.count()
-            # Shape itself
-            shape = Shape.create(**reduce_data_to_model(Shape, data["shape"]))
-            # Subshape
-            type_table = get_table(shape.type_)
-            subshape = type_table.create(
-                shape=shape,
-                **type_table.pre_create(
-                    **reduce_data_to_model(type_table, data["shape"])
-                ),
-            )
-            type_table.post_create(subshape, **data["shape"])
-            # Owners
-            for owner in data["shape"]["owners"]:
-                ShapeOwner.create(
-                    shape=shape,
-                    user=User.by_name(owner["user"]),
-                    edit_access=owner["edit_access"],
-                    movement_access=owner["movement_access"],
-                    vision_access=owner["vision_access"],
-                )
-            # Trackers
-            for tracker in data["shape"]["trackers"]:
-                # do not shortline this to **reduce_data_to_model(...), shape=shape
-                # if shape exists in the model it crashes
-                tracker_model = reduce_data_to_model(Tracker, tracker)
-                tracker_model.update(shape=shape)
-                Tracker.create(**tracker_model)
-            # Auras
-            for aura in data["shape"]["auras"]:
-                Aura.create(**reduce_data_to_model(Aura, aura))
+        shape = await db_executor.run(_create_shape, data["shape"], layer)
 
     for room_player in pr.room.players:
         is_dm = room_player.role == Role.DM
@@ -99,10 +81,49 @@ async def add_shape(sid: str, data: ShapeAdd):
             if not is_dm and not layer.player_visible:
                 continue
             if not data["temporary"]:
-                data["shape"] = shape.as_dict(room_player.player, is_dm)
+                data["shape"] = await db_executor.run(
+                    shape.as_dict, room_player.player, is_dm
+                )
             await sio.emit("Shape.Add", data["shape"], room=psid, namespace=GAME_NS)
 
 
+def _create_shape(data: ShapeKeys, layer: Layer) -> Shape:
+    with db.atomic():
+        data["layer"] = layer
+        data["index"] = Shape.get_next_index(layer)
+        # Shape itself
+        shape_data = reduce_data_to_model(Shape, data)
+        shape_data["options"] = load_options(shape_data.get("options", None))
+        shape = Shape.create(**shape_data)
+        # Subshape
+        type_table = get_table(shape.type_)
+        subshape = type_table.create(
+            shape=shape,
+            **type_table.pre_create(**reduce_data_to_model(type_table, data)),
+        )
+        type_table.post_create(subshape, **data)
+        # Owners
+        for owner in data["owners"]:
+            ShapeOwner.create(
+                shape=shape,
+                user=User.by_name(owner["user"]),
+                edit_access=owner["edit_access"],
+                movement_access=owner["movement_access"],
+                vision_access=owner["vision_access"],
+            )
+        # Trackers
+        for tracker in data["trackers"]:
+            # do not shortline this to **reduce_data_to_model(...), shape=shape
+            # if shape exists in the model it crashes
+            tracker_model = reduce_data_to_model(Tracker, tracker)
+            tracker_model.update(shape=shape)
+            Tracker.create(**tracker_model)
+        # Auras
+        for aura in data["auras"]:
+            Aura.create(**reduce_data_to_model(Aura, aura))
+    return shape
+
+
 @sio.on("Shapes.Position.Update", namespace=GAME_NS)
 @auth.login_required(app, sio)
 async def update_shape_positions(sid: str, data: PositionUpdateList):
@@ -111,8 +132,10 @@ async def update_shape_positions(sid: str, data: PositionUpdateList):
     shapes: List[Tuple[Shape, PositionUpdate]] = []
 
     for sh in data["shapes"]:
-        shape = Shape.get_or_none(Shape.uuid == sh["uuid"])
-        if shape is not None and not has_ownership(shape, pr, movement=True):
+        shape = shape_store.get(pr.active_location_id, sh["uuid"])
+        if shape is None:
+            continue
+        if not has_ownership(shape, pr, movement=True):
             logger.warning(
                 f"User {pr.player.name} attempted to move a shape it does not own."
             )
@@ -120,25 +143,25 @@ async def update_shape_positions(sid: str, data: PositionUpdateList):
         shapes.append((shape, sh))
 
     if not data["temporary"]:
-        with db.atomic():
-            for db_shape, data_shape in shapes:
-                points = data_shape["position"]["points"]
-                db_shape.x = points[0][0]
-                db_shape.y = points[0][1]
-                db_shape.angle = data_shape["position"]["angle"]
-                db_shape.save()
-
-                if len(points) > 1:
-                    # Subshape
-                    type_instance = db_shape.subtype
-                    type_instance.set_location(points[1:])
-
-    await sio.emit(
-        "Shapes.Position.Update",
+        # These are written to the db by the shape store's write-behind flush
+        for db_shape, data_shape in shapes:
+            points = data_shape["position"]["points"]
+            db_shape.x = points[0][0]
+            db_shape.y = points[0][1]
+            db_shape.angle = data_shape["position"]["angle"]
+            shape_store.mark_dirty(db_shape)
+
+            if len(points) > 1:
+                # Subshape
+                type_instance = shape_store.get_subtype(db_shape)
+                type_instance.set_location(points[1:])
+                shape_store.mark_dirty(type_instance)
+
+    await position_broadcaster.queue(
+        sid,
+        game_state.get_session(sid).location_path,
         data["shapes"],
-        room=pr.active_location.get_path(),
-        skip_sid=sid,
-        namespace=GAME_NS,
+        data["temporary"],
     )
 
 
@@ -161,8 +184,6 @@ async def remove_shapes(sid: str, data: TemporaryShapesList):
             logger.warning(f"Attempt to update unknown shape by {pr.player.name}")
             return
 
-        layer = shapes[0].layer
-
         group_ids = set()
 
         for shape in shapes:
@@ -175,11 +196,7 @@ async def remove_shapes(sid: str, data: TemporaryShapesList):
             if shape.group:
                 group_ids.add(shape.group)
 
-            old_index = shape.index
-            shape.delete_instance(True)
-            Shape.update(index=Shape.index - 1).where(
-                (Shape.layer == layer) & (Shape.index >= old_index)
-            ).execute()
+            await db_executor.run(shape.delete_instance, True)
 
         for group_id in group_ids:
             await remove_group_if_empty(group_id)
@@ -187,7 +204,7 @@ async def remove_shapes(sid: str, data: TemporaryShapesList):
     await sio.emit(
         "Shapes.Remove",
         data["uuids"],
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -203,24 +220,18 @@ async def change_shape_floor(sid: str, data: ShapeFloorChange):
         return
 
     floor: Floor = Floor.get(location=pr.active_location, name=data["floor"])
-    shapes: List[Shape] = [s for s in Shape.select().where(Shape.uuid << data["uuids"])]
+    shapes = get_shapes(pr.active_location_id, data["uuids"])
     layer: Layer = Layer.get(floor=floor, name=shapes[0].layer.name)
-    old_layer = shapes[0].layer
 
     for shape in shapes:
-        old_index = shape.index
         shape.layer = layer
-        shape.index = layer.shapes.count()
-        shape.save()
-
-        Shape.update(index=Shape.index - 1).where(
-            (Shape.layer == old_layer) & (Shape.index >= old_index)
-        ).execute()
+        shape.index = Shape.get_next_index(layer)
+        await db_executor.save(shape)
 
     await sio.emit(
         "Shapes.Floor.Change",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -236,7 +247,7 @@ async def change_shape_layer(sid: str, data: Dict[str, Any]):
         return
 
     floor = Floor.get(location=pr.active_location, name=data["floor"])
-    shapes: List[Shape] = [s for s in Shape.select().where(Shape.uuid << data["uuids"])]
+    shapes = get_shapes(pr.active_location_id, data["uuids"])
     layer = Layer.get(floor=floor, name=data["layer"])
     old_layer = shapes[0].layer
 
@@ -257,20 +268,15 @@ async def change_shape_layer(sid: str, data: Dict[str, Any]):
                 )
 
     for shape in shapes:
-        old_index = shape.index
-
         shape.layer = layer
-        shape.index = layer.shapes.count()
-        shape.save()
-        Shape.update(index=Shape.index - 1).where(
-            (Shape.layer == old_layer) & (Shape.index >= old_index)
-        ).execute()
+        shape.index = Shape.get_next_index(layer)
+        await db_executor.save(shape)
 
     if old_layer.player_visible and layer.player_visible:
         await sio.emit(
             "Shapes.Layer.Change",
             data,
-            room=pr.active_location.get_path(),
+            room=game_state.get_session(sid).location_path,
             skip_sid=sid,
             namespace=GAME_NS,
         )
@@ -293,7 +299,13 @@ async def change_shape_layer(sid: str, data: Dict[str, Any]):
                 elif layer.player_visible:
                     await sio.emit(
                         "Shapes.Add",
-                        [shape.as_dict(room_player.player, False) for shape in shapes],
+                        await payload_encoder.encode(
+                            psid,
+                            [
+                                shape.as_dict(room_player.player, False)
+                                for shape in shapes
+                            ],
+                        ),
                         room=psid,
                         namespace=GAME_NS,
                     )
@@ -305,7 +317,9 @@ async def move_shape_order(sid: str, data: ShapeOrder):
     pr: PlayerRoom = game_state.get(sid)
 
     if not data["temporary"]:
-        shape = Shape.get(uuid=data["uuid"])
+        shape = shape_store.get(pr.active_location_id, data["uuid"])
+        if shape is None:
+            raise Shape.DoesNotExist(data["uuid"])
         layer = shape.layer
 
         if pr.role != Role.DM and not layer.player_editable:
@@ -314,25 +328,15 @@ async def move_shape_order(sid: str, data: ShapeOrder):
             )
             return
 
-        target = data["index"]
-        sign = 1 if target < shape.index else -1
-        case = Case(
-            None,
-            (
-                (Shape.index == shape.index, target),
-                (
-                    (sign * Shape.index) < (sign * shape.index),
-                    (Shape.index + (sign * 1)),
-                ),
-            ),
-            Shape.index,
-        )
-        Shape.update(index=case).where(Shape.layer == layer).execute()
+        await db_executor.run(shape.set_order, data["index"])
+        await db_executor.save(shape)
+        # set_order can rebalance the whole layer with a bulk update
+        snapshot_cache.invalidate_layer(layer.id)
 
     await sio.emit(
         "Shape.Order.Set",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -352,24 +356,33 @@ async def move_shapes(sid: str, data: ServerShapeLocationMove):
     x = data["target"]["x"]
     y = data["target"]["y"]
 
-    shapes = [Shape.get_by_id(sh) for sh in data["shapes"]]
+    shapes = get_shapes(pr.active_location_id, data["shapes"])
 
     await sio.emit(
         "Shapes.Remove",
         [sh.uuid for sh in shapes],
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
     for shape in shapes:
         shape.layer = floor.layers.where(Layer.name == shape.layer.name)[0]
+        shape.index = Shape.get_next_index(shape.layer)
         shape.center_at(x, y)
-        shape.save()
+        await db_executor.save(shape)
+    # The shapes are no longer part of the location they were cached for
+    shape_store.evict([shape.uuid for shape in shapes])
 
     for psid, player in game_state.get_users(active_location=location):
         await sio.emit(
             "Shapes.Add",
-            [sh.as_dict(player, game_state.get(psid).role == Role.DM) for sh in shapes],
+            await payload_encoder.encode(
+                psid,
+                [
+                    sh.as_dict(player, game_state.get(psid).role == Role.DM)
+                    for sh in shapes
+                ],
+            ),
             room=psid,
             namespace=GAME_NS,
         )
@@ -383,12 +396,12 @@ async def set_circular_token_value(sid: str, data: TextUpdateData):
     if not data["temporary"]:
         shape: CircularToken = CircularToken.get_by_id(data["uuid"])
         shape.text = data["text"]
-        shape.save()
+        await db_executor.save(shape)
 
     await sio.emit(
         "Shape.CircularToken.Value.Set",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -402,12 +415,12 @@ async def set_text_value(sid: str, data: TextUpdateData):
     if not data["temporary"]:
         shape: Text = Text.get_by_id(data["uuid"])
         shape.text = data["text"]
-        shape.save()
+        await db_executor.save(shape)
 
     await sio.emit(
         "Shape.Text.Value.Set",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -426,12 +439,12 @@ async def update_rect_size(sid: str, data: RectSizeData):
             shape = Rect.get_by_id(data["uuid"])
         shape.width = data["w"]
         shape.height = data["h"]
-        shape.save()
+        await db_executor.save(shape)
 
     await sio.emit(
         "Shape.Rect.Size.Update",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -449,12 +462,12 @@ async def update_circle_size(sid: str, data: CircleSizeData):
         except CircularToken.DoesNotExist:
             shape = Circle.get_by_id(data["uuid"])
         shape.radius = data["r"]
-        shape.save()
+        await db_executor.save(shape)
 
     await sio.emit(
         "Shape.Circle.Size.Update",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -469,12 +482,12 @@ async def update_text_size(sid: str, data: TextSizeData):
         shape = Text.get_by_id(data["uuid"])
 
         shape.font_size = data["font_size"]
-        shape.save()
+        await db_executor.save(shape)
 
     await sio.emit(
         "Shape.Text.Size.Update",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -488,8 +501,10 @@ async def update_shape_options(sid: str, data: OptionUpdateList):
     shapes: List[Tuple[Shape, OptionUpdate]] = []
 
     for sh in data["options"]:
-        shape = Shape.get_or_none(Shape.uuid == sh["uuid"])
-        if shape is not None and not has_ownership(shape, pr, movement=True):
+        shape = shape_store.get(pr.active_location_id, sh["uuid"])
+        if shape is None:
+            continue
+        if not has_ownership(shape, pr, movement=True):
             logger.warning(
                 f"User {pr.player.name} attempted to change options for a shape it does not own."
             )
@@ -497,15 +512,14 @@ async def update_shape_options(sid: str, data: OptionUpdateList):
         shapes.append((shape, sh))
 
     if not data["temporary"]:
-        with db.atomic():
-            for db_shape, data_shape in shapes:
-                db_shape.options = data_shape["option"]
-                db_shape.save()
+        for db_shape, data_shape in shapes:
+            db_shape.set_options(load_options(data_shape["option"]))
+        await db_executor.save(*(db_shape for db_shape, _ in shapes))
 
     await sio.emit(
         "Shapes.Options.Update",
         data["options"],
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
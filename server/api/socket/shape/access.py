@@ -3,9 +3,13 @@ from api.socket.constants import GAME_NS
 from api.socket.shape.data_models import ServerShapeDefaultOwner, ServerShapeOwner
 from app import app, sio
 from models import PlayerRoom, Shape, ShapeOwner, User
+from models.db import db_executor
 from models.role import Role
 from models.shape.access import has_ownership
 from state.game import game_state
+from state.permissions import permission_index
+from state.shapes import shape_store
+from state.snapshots import snapshot_cache
 from utils import logger
 
 
@@ -39,8 +43,9 @@ async def add_shape_owner(sid: str, data: ServerShapeOwner):
     if PlayerRoom.get(room=pr.room, player=target_user).role == Role.DM:
         return
 
-    if not ShapeOwner.get_or_none(shape=shape, user=target_user):
-        ShapeOwner.create(
+    if target_user.id not in permission_index.get_owners(shape):
+        await db_executor.run(
+            ShapeOwner.create,
             shape=shape,
             user=target_user,
             edit_access=data["edit_access"],
@@ -50,7 +55,7 @@ async def add_shape_owner(sid: str, data: ServerShapeOwner):
     await sio.emit(
         "Shape.Owner.Add",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -105,12 +110,12 @@ async def update_shape_owner(sid: str, data: ServerShapeOwner):
     so.edit_access = data["edit_access"]
     so.movement_access = data["movement_access"]
     so.vision_access = data["vision_access"]
-    so.save()
+    await db_executor.save(so)
 
     await sio.emit(
         "Shape.Owner.Update",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -143,16 +148,19 @@ async def delete_shape_owner(sid: str, data: ServerShapeOwner):
         return
 
     try:
-        ShapeOwner.delete().where(
+        query = ShapeOwner.delete().where(
             (ShapeOwner.shape == shape) & (ShapeOwner.user == target_user)
-        ).execute()
+        )
+        await db_executor.run(query.execute)
+        permission_index.remove_owner(shape.uuid, target_user.id)
+        snapshot_cache.invalidate_shape(shape.uuid)
     except Exception:
         logger.warning(f"Could not delete shape-owner relation by {pr.player.name}")
 
     await sio.emit(
         "Shape.Owner.Delete",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -163,13 +171,12 @@ async def delete_shape_owner(sid: str, data: ServerShapeOwner):
 async def update_default_shape_owner(sid: str, data: ServerShapeDefaultOwner):
     pr: PlayerRoom = game_state.get(sid)
 
-    try:
-        shape: Shape = Shape.get(uuid=data["shape"])
-    except Shape.DoesNotExist as exc:
+    shape = shape_store.get(pr.active_location_id, data["shape"])
+    if shape is None:
         logger.warning(
             f"Attempt to update owner of unknown shape by {pr.player.name} [{data['shape']}]"
         )
-        raise exc
+        raise Shape.DoesNotExist(data["shape"])
 
     if not has_ownership(shape, pr):
         logger.warning(
@@ -186,7 +193,7 @@ async def update_default_shape_owner(sid: str, data: ServerShapeDefaultOwner):
     if "movement_access" in data:
         shape.default_movement_access = data["movement_access"]
 
-    shape.save()
+    await db_executor.save(shape)
 
     # We need to send each player their new view of the shape which includes the default access fields,
     # so there is no use in sending those separately
@@ -62,7 +62,7 @@ class ShapeKeys(TypedDict):
     type_: str
     x: int
     y: int
-    index: int
+    index: float
     angle: int
     floor: str
     layer: str
@@ -1,5 +1,3 @@
-import json
-from typing import Any, List
 from typing_extensions import TypedDict
 
 from playhouse.shortcuts import update_model_from_dict
@@ -9,9 +7,11 @@ from api.socket.constants import GAME_NS
 from api.socket.shape.utils import get_owner_sids, get_shape_or_none
 from app import app, sio
 from models import Aura, PlayerRoom, ShapeLabel, Tracker
+from models.db import db_executor
 from models.shape import Shape
 from models.utils import reduce_data_to_model
 from state.game import game_state
+from state.snapshots import snapshot_cache
 
 
 class ShapeSetBooleanValue(TypedDict):
@@ -81,13 +81,13 @@ async def set_invisible(sid: str, data: ShapeSetBooleanValue):
         return
 
     shape.is_invisible = data["value"]
-    shape.save()
+    await db_executor.save(shape)
 
     await sio.emit(
         "Shape.Options.Invisible.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -102,13 +102,13 @@ async def set_defeated(sid: str, data: ShapeSetBooleanValue):
         return
 
     shape.is_defeated = data["value"]
-    shape.save()
+    await db_executor.save(shape)
 
     await sio.emit(
         "Shape.Options.Defeated.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -123,13 +123,13 @@ async def set_locked(sid: str, data: ShapeSetBooleanValue):
         return
 
     shape.is_locked = data["value"]
-    shape.save()
+    await db_executor.save(shape)
 
     await sio.emit(
         "Shape.Options.Locked.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -144,13 +144,13 @@ async def set_token(sid: str, data: ShapeSetBooleanValue):
         return
 
     shape.is_token = data["value"]
-    shape.save()
+    await db_executor.save(shape)
 
     await sio.emit(
         "Shape.Options.Token.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -165,13 +165,13 @@ async def set_movement_block(sid: str, data: ShapeSetBooleanValue):
         return
 
     shape.movement_obstruction = data["value"]
-    shape.save()
+    await db_executor.save(shape)
 
     await sio.emit(
         "Shape.Options.MovementBlock.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -186,13 +186,13 @@ async def set_vision_block(sid: str, data: ShapeSetBooleanValue):
         return
 
     shape.vision_obstruction = data["value"]
-    shape.save()
+    await db_executor.save(shape)
 
     await sio.emit(
         "Shape.Options.VisionBlock.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -207,14 +207,14 @@ async def set_annotation(sid: str, data: ShapeSetStringValue):
         return
 
     shape.annotation = data["value"]
-    shape.save()
+    await db_executor.save(shape)
 
     if shape.annotation_visible:
         await sio.emit(
             "Shape.Options.Annotation.Set",
             data,
             skip_sid=sid,
-            room=pr.active_location.get_path(),
+            room=game_state.get_session(sid).location_path,
             namespace=GAME_NS,
         )
     else:
@@ -237,14 +237,14 @@ async def set_annotation_visible(sid: str, data: ShapeSetBooleanValue):
         return
 
     shape.annotation_visible = data["value"]
-    shape.save()
+    await db_executor.save(shape)
 
     owners = [*get_owner_sids(pr, shape, skip_sid=sid)]
 
     await sio.emit(
         "Shape.Options.AnnotationVisible.Set",
         data,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         skip_sid=sid,
         namespace=GAME_NS,
     )
@@ -270,13 +270,13 @@ async def remove_tracker(sid: str, data: ShapeSetStringValue):
         return
 
     tracker: Tracker = Tracker.get_by_id(data["value"])
-    tracker.delete_instance(True)
+    await db_executor.run(tracker.delete_instance, True)
 
     await sio.emit(
         "Shape.Options.Tracker.Remove",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -291,13 +291,13 @@ async def remove_aura(sid: str, data: ShapeSetStringValue):
         return
 
     aura = Aura.get_by_id(data["value"])
-    aura.delete_instance(True)
+    await db_executor.run(aura.delete_instance, True)
 
     await sio.emit(
         "Shape.Options.Aura.Remove",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -311,13 +311,13 @@ async def add_label(sid: str, data: ShapeSetStringValue):
     if shape is None:
         return
 
-    ShapeLabel.create(shape=shape, label=data["value"])
+    await db_executor.run(ShapeLabel.create, shape=shape, label=data["value"])
 
     await sio.emit(
         "Shape.Options.Label.Add",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -328,13 +328,13 @@ async def remove_label(sid: str, data: ShapeSetStringValue):
     pr: PlayerRoom = game_state.get(sid)
 
     label = ShapeLabel.get(shape=data["shape"], label=data["value"])
-    label.delete_instance(True)
+    await db_executor.run(label.delete_instance, True)
 
     await sio.emit(
         "Shape.Options.Label.Remove",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -349,14 +349,14 @@ async def set_name(sid: str, data: ShapeSetStringValue):
         return
 
     shape.name = data["value"]
-    shape.save()
+    await db_executor.save(shape)
 
     if shape.name_visible:
         await sio.emit(
             "Shape.Options.Name.Set",
             data,
             skip_sid=sid,
-            room=pr.active_location.get_path(),
+            room=game_state.get_session(sid).location_path,
             namespace=GAME_NS,
         )
     else:
@@ -379,7 +379,7 @@ async def set_name_visible(sid: str, data: ShapeSetBooleanValue):
         return
 
     shape.name_visible = data["value"]
-    shape.save()
+    await db_executor.save(shape)
 
     owners = [*get_owner_sids(pr, shape, skip_sid=sid)]
 
@@ -387,7 +387,7 @@ async def set_name_visible(sid: str, data: ShapeSetBooleanValue):
         "Shape.Options.NameVisible.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -412,13 +412,13 @@ async def set_show_badge(sid: str, data: ShapeSetBooleanValue):
         return
 
     shape.show_badge = data["value"]
-    shape.save()
+    await db_executor.save(shape)
 
     await sio.emit(
         "Shape.Options.ShowBadge.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -433,13 +433,13 @@ async def set_stroke_colour(sid: str, data: ShapeSetStringValue):
         return
 
     shape.stroke_colour = data["value"]
-    shape.save()
+    await db_executor.save(shape)
 
     await sio.emit(
         "Shape.Options.StrokeColour.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -454,13 +454,13 @@ async def set_fill_colour(sid: str, data: ShapeSetStringValue):
         return
 
     shape.fill_colour = data["value"]
-    shape.save()
+    await db_executor.save(shape)
 
     await sio.emit(
         "Shape.Options.FillColour.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -475,8 +475,7 @@ async def create_tracker(sid: str, data: TrackerDelta):
         return
 
     model = reduce_data_to_model(Tracker, data)
-    tracker = Tracker.create(**model)
-    tracker.save()
+    tracker = await db_executor.run(Tracker.create, **model)
 
     owners = [*get_owner_sids(pr, shape, skip_sid=sid)]
     for psid in owners:
@@ -512,7 +511,7 @@ async def update_tracker(sid: str, data: TrackerDelta):
     tracker = Tracker.get_by_id(data["uuid"])
     changed_visible = tracker.visible != data.get("visible", tracker.visible)
     update_model_from_dict(tracker, data)
-    tracker.save()
+    await db_executor.save(tracker)
 
     owners = [*get_owner_sids(pr, shape, skip_sid=sid)]
     for psid in owners:
@@ -560,13 +559,13 @@ async def move_tracker(sid: str, data: TrackerMove):
 
     tracker = Tracker.get_by_id(data["tracker"])
     tracker.shape = new_shape
-    tracker.save()
+    await db_executor.save(tracker)
 
     await sio.emit(
         "Shape.Options.Tracker.Move",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -581,8 +580,7 @@ async def create_aura(sid: str, data: AuraDelta):
         return
 
     model = reduce_data_to_model(Aura, data)
-    aura = Aura.create(**model)
-    aura.save()
+    aura = await db_executor.run(Aura.create, **model)
 
     owners = [*get_owner_sids(pr, shape, skip_sid=sid)]
     for psid in owners:
@@ -618,7 +616,7 @@ async def update_aura(sid: str, data: AuraDelta):
     aura = Aura.get_by_id(data["uuid"])
     changed_visible = aura.visible != data.get("visible", aura.visible)
     update_model_from_dict(aura, data)
-    aura.save()
+    await db_executor.save(aura)
 
     owners = [*get_owner_sids(pr, shape, skip_sid=sid)]
     for psid in owners:
@@ -666,13 +664,13 @@ async def move_aura(sid: str, data: AuraMove):
 
     aura = Aura.get_by_id(data["aura"])
     aura.shape = new_shape
-    aura.save()
+    await db_executor.save(aura)
 
     await sio.emit(
         "Shape.Options.Aura.Move",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -687,27 +685,20 @@ async def set_is_door(sid: str, data: ShapeSetBooleanValue):
         return
 
     shape.is_door = data["value"]
-    shape.save()
+    await db_executor.save(shape)
 
     await sio.emit(
         "Shape.Options.IsDoor.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
 
-def set_options(shape: Shape, key: str, value):
-    options = json.loads(shape.options)
-    for option in options:
-        if option[0] == key:
-            option[1] = value
-            break
-    else:
-        options.append([key, value])
-    shape.options = json.dumps(options)
-    shape.save()
+async def set_options(shape: Shape, key: str, value):
+    await shape.set_option(key, value=value)
+    snapshot_cache.invalidate_shape(shape.uuid)
 
 
 @sio.on("Shape.Options.DoorPermissions.Set", namespace=GAME_NS)
@@ -719,13 +710,13 @@ async def set_door_permissions(sid: str, data):
     if shape is None:
         return
 
-    set_options(shape, "door", data["value"])
+    await set_options(shape, "door", data["value"])
 
     await sio.emit(
         "Shape.Options.DoorPermissions.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -740,13 +731,13 @@ async def set_is_teleport_zone(sid: str, data: ShapeSetBooleanValue):
         return
 
     shape.is_teleport_zone = data["value"]
-    shape.save()
+    await db_executor.save(shape)
 
     await sio.emit(
         "Shape.Options.IsTeleportZone.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -760,18 +751,15 @@ async def set_is_immediate_teleport_zone(sid: str, data: ShapeSetBooleanValue):
     if shape is None:
         return
 
-    options: List[Any] = json.loads(shape.options)
-    for option in options:
-        if option[0] == "teleport":
-            option[1]["immediate"] = data["value"]
-    shape.options = json.dumps(options)
-    shape.save()
+    if "teleport" in shape.get_options():
+        await shape.set_option("teleport", "immediate", value=data["value"])
+        snapshot_cache.invalidate_shape(shape.uuid)
 
     await sio.emit(
         "Shape.Options.IsImmediateTeleportZone.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -785,13 +773,13 @@ async def set_tp_permissions(sid: str, data):
     if shape is None:
         return
 
-    set_options(shape, "teleport", data["value"])
+    await set_options(shape, "teleport", data["value"])
 
     await sio.emit(
         "Shape.Options.TeleportZonePermissions.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -805,13 +793,13 @@ async def set_skip_draw(sid: str, data: ShapeSetBooleanValue):
     if shape is None:
         return
 
-    set_options(shape, "skipDraw", data["value"])
+    await set_options(shape, "skipDraw", data["value"])
 
     await sio.emit(
         "Shape.Options.SkipDraw.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -825,24 +813,16 @@ async def set_skip_draw(sid: str, data: ShapeSetStringValue):
     if shape is None:
         return
 
-    options: List[Any] = json.loads(shape.options)
-    for i, option in enumerate(options[::-1]):
-        if data["value"] is None and option[0] in [
-            "svgAsset",
-            "svgPaths",
-            "svgWidth",
-            "svgHeight",
-        ]:
-            options.pop(i)
-        elif option[0] == "svgAsset":
-            option[1] = data["value"]
-    shape.options = json.dumps(options)
-    shape.save()
+    if data["value"] is None:
+        await shape.remove_options("svgAsset", "svgPaths", "svgWidth", "svgHeight")
+        snapshot_cache.invalidate_shape(shape.uuid)
+    elif "svgAsset" in shape.get_options():
+        await set_options(shape, "svgAsset", data["value"])
 
     await sio.emit(
         "Shape.Options.SvgAsset.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
@@ -5,6 +5,7 @@ from api.socket.constants import GAME_NS
 from api.socket.shape.utils import get_shape_or_none
 from app import app, sio
 from models import PlayerRoom
+from models.db import db_executor
 from models.shape import CompositeShapeAssociation, ToggleComposite
 from state.game import game_state
 
@@ -30,13 +31,13 @@ async def set_toggle_composite_active_variant(sid: str, data: VariantMessage):
     composite: ToggleComposite = shape.subtype
 
     composite.active_variant = data["variant"]
-    composite.save()
+    await db_executor.save(composite)
 
     await sio.emit(
         "ToggleComposite.Variants.Active.Set",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -51,13 +52,18 @@ async def add_toggle_composite_variant(sid: str, data: NewVariantMessage):
     if parent is None or variant is None:
         return
 
-    CompositeShapeAssociation.create(parent=parent, variant=variant, name=data["name"])
+    await db_executor.run(
+        CompositeShapeAssociation.create,
+        parent=parent,
+        variant=variant,
+        name=data["name"],
+    )
 
     await sio.emit(
         "ToggleComposite.Variants.Add",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -71,13 +77,13 @@ async def rename_toggle_composite_variant(sid: str, data: NewVariantMessage):
         parent=data["shape"], variant=data["variant"]
     )
     composite.name = data["name"]
-    composite.save()
+    await db_executor.save(composite)
 
     await sio.emit(
         "ToggleComposite.Variants.Rename",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
 
@@ -90,12 +96,12 @@ async def remove_toggle_composite_variant(sid: str, data: VariantMessage):
     composite = CompositeShapeAssociation.get(
         parent=data["shape"], variant=data["variant"]
     )
-    composite.delete_instance(True)
+    await db_executor.run(composite.delete_instance, True)
 
     await sio.emit(
         "ToggleComposite.Variants.Remove",
         data,
         skip_sid=sid,
-        room=pr.active_location.get_path(),
+        room=game_state.get_session(sid).location_path,
         namespace=GAME_NS,
     )
@@ -3,17 +3,17 @@ from typing import Generator, Union
 from models import PlayerRoom, Shape
 from models.shape.access import has_ownership
 from state.game import game_state
+from state.shapes import shape_store
 from utils import logger
 
 
 def get_shape_or_none(pr: PlayerRoom, shape_id: str, action: str) -> Union[Shape, None]:
-    try:
-        shape: Shape = Shape.get(uuid=shape_id)
-    except Shape.DoesNotExist as exc:
+    shape = shape_store.get(pr.active_location_id, shape_id)
+    if shape is None:
         logger.warning(
             f"Attempt by {pr.player.name} on unknown shape. {{method: {action}, shape id: {shape_id}}}"
         )
-        raise exc
+        raise Shape.DoesNotExist(shape_id)
 
     if not has_ownership(shape, pr):
         logger.warning(
@@ -0,0 +1,217 @@
+"""
+Fills the save file with synthetic campaigns to benchmark the server against.
+
+Everything is created through the regular models: a DM, a number of players,
+rooms with locations and floors and shapes of every shape type with trackers and auras.
+Every player owns a share of the tokens so that they can move them around in the load test.
+
+Point `save_file` in your server config to a scratch file before running this!
+
+Usage: `python benchmarks/generate_campaign.py [options]` from the server folder
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+from uuid import uuid4
+
+# Insert parent folder in the lookup
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import save
+
+save.check_existence()
+
+from models import (
+    AssetRect,
+    Aura,
+    Circle,
+    CircularToken,
+    Layer,
+    Line,
+    Location,
+    LocationOptions,
+    PlayerRoom,
+    Polygon,
+    Rect,
+    Room,
+    Shape,
+    ShapeOwner,
+    Text,
+    Tracker,
+    User,
+    UserOptions,
+)
+from models.db import db
+from models.role import Role
+from models.shape import CompositeShapeAssociation, ToggleComposite
+from models.shape.vertices import pack_vertices
+
+PASSWORD = "bench"
+
+
+def _point() -> float:
+    return random.uniform(-5000, 5000)
+
+
+# shape type -> subtype fields
+SUBTYPES: Dict[Any, Callable[[], Dict[str, Any]]] = {
+    AssetRect: lambda: {"width": 50, "height": 50, "src": "/static/img/d20.svg"},
+    Circle: lambda: {"radius": 25, "viewing_angle": None},
+    CircularToken: lambda: {
+        "radius": 25,
+        "viewing_angle": None,
+        "text": "X",
+        "font": "20px serif",
+    },
+    Line: lambda: {"x2": _point(), "y2": _point(), "line_width": 2},
+    Polygon: lambda: {
+        "vertices": pack_vertices([[_point(), _point()] for _ in range(8)]),
+        "line_width": 2,
+        "open_polygon": False,
+    },
+    Rect: lambda: {"width": 50, "height": 50},
+    Text: lambda: {"text": "Lorem ipsum", "font_size": 20},
+}
+
+
+def get_user(name: str) -> User:
+    user = User.by_name(name)
+    if user is None:
+        user = User(name=name, default_options=UserOptions.create())
+        user.set_password(PASSWORD)
+        user.save()
+    return user
+
+
+def create_shape(layer: Layer, index: int, type_: Any) -> Shape:
+    shape = Shape.create(
+        uuid=str(uuid4()),
+        layer=layer,
+        type_=type_.__name__.lower(),
+        x=_point(),
+        y=_point(),
+        index=index,
+        options={},
+        is_token=type_ in (CircularToken, AssetRect),
+        vision_obstruction=type_ in (Line, Polygon),
+    )
+    type_.create(shape=shape, **SUBTYPES[type_]())
+    Tracker.create(
+        uuid=str(uuid4()),
+        shape=shape,
+        visible=True,
+        name="HP",
+        value=10,
+        maxvalue=10,
+        draw=True,
+        primary_color="#00ff00",
+        secondary_color="#888888",
+    )
+    Aura.create(
+        uuid=str(uuid4()),
+        shape=shape,
+        vision_source=type_ is CircularToken,
+        visible=True,
+        name="Light",
+        value=20,
+        dim=20,
+        colour="rgba(255, 255, 255, 0.2)",
+        active=True,
+        border_colour="rgba(0, 0, 0, 0)",
+        angle=360,
+        direction=0,
+    )
+    return shape
+
+
+def create_toggle_composite(layer: Layer, index: int, variants: List[Shape]) -> Shape:
+    shape = Shape.create(
+        uuid=str(uuid4()),
+        layer=layer,
+        type_="togglecomposite",
+        x=variants[0].x,
+        y=variants[0].y,
+        index=index,
+        options={},
+    )
+    ToggleComposite.create(shape=shape, active_variant=variants[0].uuid)
+    for i, variant in enumerate(variants):
+        CompositeShapeAssociation.create(
+            parent=shape, variant=variant, name=f"variant {i}"
+        )
+    return shape
+
+
+def generate(args) -> None:
+    dm = get_user("bench-dm")
+    players = [get_user(f"bench-player-{i}") for i in range(args.players)]
+    types = list(SUBTYPES)
+
+    for r in range(args.rooms):
+        start = time.perf_counter()
+        shape_count = 0
+        with db.atomic():
+            room = Room.create(
+                name=f"bench-{r}-{uuid4().hex[:8]}",
+                creator=dm,
+                default_options=LocationOptions.create(),
+            )
+            locations = []
+            for l in range(args.locations):
+                location = Location.create(room=room, name=f"location {l}", index=l)
+                locations.append(location)
+                for f in range(args.floors):
+                    floor = location.create_floor(f"floor {f}")
+                    map_layer = floor.layers.where(Layer.name == "map").get()
+                    tokens = floor.layers.where(Layer.name == "tokens").get()
+                    for i in range(args.shapes):
+                        # Tokens for the players, everything else on the map layer
+                        type_ = types[i % len(types)]
+                        is_token = type_ in (CircularToken, AssetRect)
+                        layer = tokens if is_token else map_layer
+                        shape = create_shape(layer, i, type_)
+                        if layer == tokens and players:
+                            ShapeOwner.create(
+                                shape=shape,
+                                user=players[i % len(players)],
+                                edit_access=True,
+                                movement_access=True,
+                                vision_access=True,
+                            )
+                    variants = [create_shape(tokens, args.shapes, CircularToken)]
+                    variants.append(create_shape(tokens, args.shapes + 1, AssetRect))
+                    create_toggle_composite(tokens, args.shapes + 2, variants)
+                    shape_count += args.shapes + 3
+
+            PlayerRoom.create(
+                player=dm, room=room, role=Role.DM, active_location=locations[0]
+            )
+            for player in players:
+                PlayerRoom.create(
+                    player=player,
+                    room=room,
+                    role=Role.PLAYER,
+                    active_location=locations[0],
+                )
+        print(
+            f"Created room {dm.name}/{room.name} with {shape_count} shapes"
+            f" in {time.perf_counter() - start:.1f}s"
+        )
+
+    print(f"Users: {dm.name} and {args.players} bench-player-i (password: {PASSWORD})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rooms", type=int, default=1)
+    parser.add_argument("--locations", type=int, default=2, help="Locations per room")
+    parser.add_argument("--floors", type=int, default=1, help="Floors per location")
+    parser.add_argument("--shapes", type=int, default=1000, help="Shapes per floor")
+    parser.add_argument("--players", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    generate(args)
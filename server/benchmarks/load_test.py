@@ -0,0 +1,258 @@
+"""
+Load test for a running server, using simulated clients instead of browsers.
+
+Every client logs in, connects to the game namespace and loads the location,
+after which it keeps moving its own tokens around and updating the initiative
+of one of them for the given duration. The DM advances the initiative turn and round.
+Latencies are measured from emitting an event until the server acknowledged it,
+position updates are additionally measured until they arrived at the other clients.
+
+The users and room are expected to be created by generate_campaign.py.
+
+Usage: `python benchmarks/load_test.py ROOM [options]` from the server folder
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+import socketio
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# api.socket.constants.GAME_NS, not imported to keep the app out of this process
+GAME_NS = "/planarally"
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+
+    def add(self, name: str, latency: float) -> None:
+        self.latencies[name].append(latency * 1000)
+
+    def report(self) -> None:
+        duration = (self.end or time.perf_counter()) - self.start
+        print(
+            f"{'operation':<36}{'count':>8}{'errors':>8}{'ops/s':>9}"
+            f"{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}  (ms)"
+        )
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies[name])
+            print(f"{name:<36}{len(values):>8}{self.errors[name]:>8}", end="")
+            print(f"{len(values) / duration:>9.1f}", end="")
+            for p in (0.5, 0.9, 0.99):
+                print(f"{percentile(values, p):>9.1f}", end="")
+            print(f"{values[-1] if values else 0:>9.1f}")
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def unpack(data: Any) -> Any:
+    """Decodes the msgpack payloads of api/socket/encoding.py"""
+    if not isinstance(data, bytes):
+        return data
+    keys, tree = msgpack.unpackb(data, strict_map_key=False)
+
+    def walk(value: Any) -> Any:
+        if isinstance(value, dict):
+            return {keys[k]: walk(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [walk(v) for v in value]
+        return value
+
+    return walk(tree)
+
+
+class SimulatedClient:
+    def __init__(self, args, name: str, stats: Stats) -> None:
+        self.args = args
+        self.name = name
+        self.stats = stats
+        self.dm = name == args.creator
+        self.shapes: List[Dict[str, Any]] = []
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.sio.on("Board.Floor.Set", self.on_floor, namespace=GAME_NS)
+        self.sio.on("Board.Floor.Shapes.Add", self.on_floor, namespace=GAME_NS)
+        self.sio.on(
+            "Shapes.Position.Update", self.on_position_update, namespace=GAME_NS
+        )
+
+    async def call(self, event: str, data: Any = None) -> Any:
+        start = time.perf_counter()
+        try:
+            result = await self.sio.call(
+                event, data, namespace=GAME_NS, timeout=self.args.timeout
+            )
+        except Exception:
+            self.stats.errors[event] += 1
+            return None
+        self.stats.add(event, time.perf_counter() - start)
+        return result
+
+    async def connect(self, http: aiohttp.ClientSession) -> None:
+        start = time.perf_counter()
+        async with http.post(
+            f"{self.args.url}/api/login",
+            json={"username": self.name, "password": self.args.password},
+        ) as response:
+            response.raise_for_status()
+            cookies = response.cookies
+        self.stats.add("login", time.perf_counter() - start)
+
+        query = f"user={self.args.creator}&room={self.args.room}"
+        if self.args.msgpack:
+            query += "&encoding=msgpack"
+        start = time.perf_counter()
+        await self.sio.connect(
+            f"{self.args.url}?{query}",
+            headers={"Cookie": "; ".join(f"{k}={v.value}" for k, v in cookies.items())},
+            transports=["websocket"],
+            namespaces=[GAME_NS],
+            socketio_path=self.args.socketio_path,
+        )
+        self.stats.add("connect", time.perf_counter() - start)
+
+    async def load(self) -> None:
+        await self.call("Location.Load")
+        # Sent by the browser once it has a canvas
+        await self.call(
+            "Client.Options.Location.Set",
+            {
+                "pan_x": 0,
+                "pan_y": 0,
+                "zoom_display": 1,
+                "zoom_factor": 1,
+                "client_w": 1920,
+                "client_h": 1080,
+            },
+        )
+        self.shapes = self.shapes[: self.args.shapes_per_client]
+        if not self.shapes:
+            print(f"{self.name} does not own any shapes")
+
+    async def run(self, until: float) -> None:
+        tick = 0
+        if self.shapes:
+            await self.call("Initiative.Add", self._get_actor(self.shapes[0]))
+        while time.perf_counter() < until:
+            await asyncio.sleep(random.expovariate(self.args.rate))
+            tick += 1
+            if self.shapes:
+                await self.move_shapes(temporary=tick % 10 != 0)
+            if tick % 20 == 0 and self.shapes:
+                await self.call(
+                    "Initiative.Value.Set",
+                    {"shape": self.shapes[0]["uuid"], "value": random.randint(1, 20)},
+                )
+            if self.dm and tick % 50 == 0:
+                await self.call("Initiative.Turn.Update", 0)
+                await self.call("Initiative.Round.Update", tick // 50)
+
+    async def move_shapes(self, temporary: bool) -> None:
+        now = time.perf_counter()
+        updates = []
+        for shape in random.sample(self.shapes, min(3, len(self.shapes))):
+            shape["x"] += random.uniform(-10, 10)
+            shape["y"] += random.uniform(-10, 10)
+            updates.append(
+                {
+                    "uuid": shape["uuid"],
+                    "position": {"angle": 0, "points": [[shape["x"], shape["y"]]]},
+                    # Not used by the server, passed on as is to measure delivery
+                    "sent": now,
+                }
+            )
+        await self.call(
+            "Shapes.Position.Update", {"shapes": updates, "temporary": temporary}
+        )
+
+    async def disconnect(self) -> None:
+        await self.sio.disconnect()
+
+    async def on_floor(self, data: Any) -> None:
+        floor = unpack(data)
+        for layer in floor["layers"]:
+            for shape in layer["shapes"]:
+                owned = any(o["user"] == self.name for o in shape.get("owners", []))
+                if shape.get("is_token") and (owned or self.dm):
+                    self.shapes.append(shape)
+
+    async def on_position_update(self, data: List[Dict[str, Any]]) -> None:
+        now = time.perf_counter()
+        for update in data:
+            if "sent" in update:
+                latency = now - update["sent"]
+                self.stats.add("Shapes.Position.Update (delivery)", latency)
+
+    def _get_actor(self, shape: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "shape": shape["uuid"],
+            "initiative": None,
+            "isVisible": True,
+            "isGroup": False,
+            "effects": [],
+        }
+
+
+async def main(args) -> None:
+    setup_stats = Stats()
+    names = [args.creator] + [f"bench-player-{i}" for i in range(args.clients - 1)]
+    clients = [SimulatedClient(args, name, setup_stats) for name in names]
+
+    # Every client logs in separately, so do not share their session cookies
+    async with aiohttp.ClientSession(cookie_jar=aiohttp.DummyCookieJar()) as http:
+        # Clients join one after the other, but load the location concurrently
+        for client in clients:
+            await client.connect(http)
+        await asyncio.gather(*(client.load() for client in clients))
+        setup_stats.end = time.perf_counter()
+
+        print(f"{len(clients)} clients connected, running for {args.duration}s")
+        run_stats = Stats()
+        for client in clients:
+            client.stats = run_stats
+        until = time.perf_counter() + args.duration
+        await asyncio.gather(*(client.run(until) for client in clients))
+        run_stats.end = time.perf_counter()
+
+        for client in clients:
+            await client.disconnect()
+
+    print("\nSetup")
+    setup_stats.report()
+    print("\nRun")
+    run_stats.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("room", help="Name of the room to join")
+    parser.add_argument("--creator", default="bench-dm", help="Creator of the room")
+    parser.add_argument("--password", default="bench")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--socketio-path", default="socket.io")
+    parser.add_argument("--clients", type=int, default=10, help="Including the DM")
+    parser.add_argument("--duration", type=float, default=30, help="In seconds")
+    parser.add_argument("--rate", type=float, default=10, help="Actions per second")
+    parser.add_argument("--shapes-per-client", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--msgpack", action="store_true", help="Request msgpack")
+    args = parser.parse_args()
+    if args.msgpack and msgpack is None:
+        sys.exit("--msgpack requires the msgpack package")
+    asyncio.run(main(args))
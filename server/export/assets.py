@@ -0,0 +1,140 @@
+"""
+Reading and writing of asset archives (.paa).
+
+This module runs inside the export worker processes,
+so it should only depend on the standard library.
+"""
+
+import io
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import time
+from multiprocessing import Queue
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# compression name -> tarfile write mode
+COMPRESSION_MODES: Dict[str, str] = {"bz2": "w:bz2", "gz": "w:gz", "store": "w"}
+
+# Minimum amount of bytes between two progress reports of a job
+PROGRESS_STEP = 4 * 1024 * 1024
+
+# Archived files are named after their hash, anything else could escape the asset folder
+FILE_MEMBER = re.compile(r"files/([\w-]+)")
+
+_progress_queue: "Optional[Queue[Any]]" = None
+
+
+def init_worker(progress_queue: "Queue[Any]") -> None:
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def _report(job_id: str, done: int, total: int) -> None:
+    if _progress_queue is not None:
+        _progress_queue.put((job_id, done, total))
+
+
+def build_asset_archive(
+    job_id: str,
+    path: Path,
+    assets_dir: Path,
+    json_data: str,
+    file_hashes: List[str],
+    compression: str,
+    compression_level: int,
+) -> None:
+    """
+    Writes the asset data and the files it references to a .paa archive at `path`.
+    Files that no longer exist are skipped.
+    """
+    files = []
+    total = 0
+    for file_hash in dict.fromkeys(file_hashes):
+        file_path = assets_dir / file_hash
+        try:
+            size = file_path.stat().st_size
+        except FileNotFoundError:
+            continue
+        files.append((file_hash, file_path))
+        total += size
+
+    kwargs = {}
+    if compression != "store":
+        kwargs["compresslevel"] = compression_level
+
+    mtime = time.time()
+    done = 0
+    reported = 0
+    _report(job_id, done, total)
+
+    with tarfile.open(path, COMPRESSION_MODES[compression], **kwargs) as tar:  # type: ignore
+        encoded = json_data.encode("utf-8")
+        data_tar_info = tarfile.TarInfo("data")
+        data_tar_info.size = len(encoded)
+        data_tar_info.mode = 0o755
+        data_tar_info.mtime = mtime  # type: ignore
+        tar.addfile(data_tar_info, io.BytesIO(encoded))
+
+        files_tar_info = tarfile.TarInfo("files")
+        files_tar_info.type = tarfile.DIRTYPE
+        files_tar_info.mode = 0o755
+        files_tar_info.mtime = mtime  # type: ignore
+        tar.addfile(files_tar_info)
+
+        for file_hash, file_path in files:
+            try:
+                info = tar.gettarinfo(str(file_path))
+                info.name = f"files/{file_hash}"
+                info.mtime = mtime  # type: ignore
+                info.mode = 0o755
+                with open(file_path, "rb") as f:
+                    tar.addfile(info, f)
+            except FileNotFoundError:
+                continue
+            done += info.size
+            if done - reported >= PROGRESS_STEP:
+                reported = done
+                _report(job_id, done, total)
+
+    _report(job_id, total, total)
+
+
+def read_asset_archive(path: Path, assets_dir: Path) -> List[Dict[str, Any]]:
+    """
+    Walks the members of a .paa archive once, in stream mode,
+    and returns the asset data stored in it.
+
+    Files that are not yet present are written straight to the asset folder,
+    files that already exist are skipped without being decompressed to disk.
+    """
+    raw_assets: Optional[List[Dict[str, Any]]] = None
+
+    with tarfile.open(path, mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            if member.name == "data":
+                raw_assets = json.load(tar.extractfile(member))  # type: ignore
+                continue
+
+            match = FILE_MEMBER.fullmatch(member.name)
+            if match is None or (assets_dir / match.group(1)).exists():
+                continue
+
+            fd, tmp_path = tempfile.mkstemp(dir=assets_dir, prefix=".import-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    shutil.copyfileobj(tar.extractfile(member), f)  # type: ignore
+                os.replace(tmp_path, assets_dir / match.group(1))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    if raw_assets is None:
+        raise ValueError("Asset archive does not contain any asset data")
+    return raw_assets
@@ -1,8 +1,13 @@
 import json
 import os
+from collections import defaultdict
 from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, TextIO, Type
+
+from peewee import chunked
 from playhouse.shortcuts import model_to_dict
 
+from models.base import BaseModel
 from models.campaign import (
     Floor,
     Layer,
@@ -12,6 +17,7 @@ from models.campaign import (
     PlayerRoom,
     Room,
 )
+from models.db import db
 from models.shape import (
     AssetRect,
     Aura,
@@ -27,183 +33,445 @@ from models.shape import (
     Text,
     ToggleComposite,
     Tracker,
+    dump_options,
+    load_options,
 )
+from models.shape.vertices import pack_vertices, unpack_vertices
 from models.user import User, UserOptions
 
-
-def export_campaign(room: Room):
-    export_data = {}
-    # Room meta info
-    room_data = model_to_dict(room, recurse=False)
-    del room_data["id"]
-    default_options = model_to_dict(room.default_options, recurse=False)
-    del default_options["id"]
-    export_data["room"] = {"_": room_data, "default_options": default_options}
-
-    # Players meta info
-    player_data = []
-    user_data = {"_": [], "labels": []}
-    for pr in room.players:
-        _p = {}
-        player = model_to_dict(pr, recurse=False)
-        del player["id"]
-        del player["room"]
-        del player["last_played"]
-        _p["_"] = player
-
-        _p["user_options"] = model_to_dict(pr.user_options, recurse=False)
-        del _p["user_options"]["id"]
-
-        player_data.append(_p)
-
-        _u = {}
-        _u["_"] = model_to_dict(pr.player, recurse=False)
-        del _u["_"]["password_hash"]
-        default_options = model_to_dict(pr.player.default_options, recurse=False)
-        del default_options["id"]
-        _u["default_options"] = default_options
-
-        user_data["_"].append(_u)
-    export_data["players"] = player_data
-    export_data["users"] = user_data
-
-    notes = []
-    for note in room.notes:
-        n = model_to_dict(note, recurse=False)
-        del n["room"]
-        notes.append(n)
-    export_data["room"]["notes"] = notes
-
-    # Locations meta info
-    locations_data = []
-    for location in room.locations:
-        location_data = {}
-
-        _l = model_to_dict(location, recurse=False)
-        del _l["room"]
-        location_data["_"] = _l
-
-        location_options = model_to_dict(location.options, recurse=False)
-        del location_options["id"]
-        location_data["location_options"] = location_options
-
-        floors = []
-        for floor in location.floors:
-            floor_data = {}
-            _f = model_to_dict(floor, recurse=False)
-            del _f["location"]
-            floor_data["_"] = _f
-
-            layers = []
-            for layer in floor.layers:
-                layer_data = {}
-                _ly = model_to_dict(layer, recurse=False)
-                del _ly["floor"]
-                layer_data["_"] = _ly
-
-                shapes = []
-                for shape in layer.shapes:
-                    shape_data = {}
-                    shape_data["_"] = model_to_dict(shape, recurse=False)
-                    shape_data["st"] = model_to_dict(shape.subtype, recurse=False)
-
-                    owners = []
-                    for o in shape.owners:
-                        owner = model_to_dict(o, recurse=False)
-                        del owner["id"]
-                        owners.append(owner)
-
-                    shape_data["trackers"] = [
-                        model_to_dict(t, recurse=False) for t in shape.trackers
-                    ]
-                    shape_data["auras"] = [
-                        model_to_dict(a, recurse=False) for a in shape.auras
-                    ]
-
-                    labels = []
-                    for l in shape.labels:
-                        if not any(
-                            la["uuid"] == l.label.uuid for la in user_data["labels"]
-                        ):
-                            user_data["labels"].append(
-                                model_to_dict(l.label, recurse=False)
-                            )
-                        label = model_to_dict(l, recurse=False)
-                        del label["id"]
-                        labels.append(label)
-                    shape_data["labels"] = labels
-
-                    shape_data["access"] = owners
-                    shapes.append(shape_data)
-                layer_data["shapes"] = shapes
-
-                layers.append(layer_data)
-            floor_data["layers"] = layers
-
-            floors.append(floor_data)
-        location_data["floors"] = floors
-
-        locations_data.append(location_data)
-    export_data["locations"] = locations_data
-
-    static_folder = Path("static")
-    os.makedirs(static_folder / "temp", exist_ok=True)
-    filename = f"{room.name}-{room.creator.name}.json"
-    fullpath = static_folder / "temp" / filename
-    if os.path.exists(fullpath):
-        os.remove(fullpath)
-    with open(fullpath, "w") as fl:
-        json.dump(export_data, fl)
-    return fullpath, filename
-
-
-def import_campaign(fp: str):
-    with open(fp, "r") as f:
-        import_data = json.load(f)
-
-    USER_MAPPING = {}  # old_id -> new_id
-
-    # Load User data
-    for user_data in import_data["users"]["_"]:
-        default_options = UserOptions(**user_data["default_options"])
+# shape type -> subtype table
+SUBTYPE_TABLES: Dict[str, Type[BaseModel]] = {
+    "assetrect": AssetRect,
+    "circle": Circle,
+    "circulartoken": CircularToken,
+    "line": Line,
+    "polygon": Polygon,
+    "rect": Rect,
+    "text": Text,
+    "togglecomposite": ToggleComposite,
+}
+
+
+def _to_dict(model, *exclude: str) -> Dict[str, Any]:
+    data = model_to_dict(model, recurse=False)
+    for field in exclude:
+        del data[field]
+    return data
+
+
+def _shape_to_dict(shape: Shape) -> Dict[str, Any]:
+    data = _to_dict(shape)
+    # Keep the options as a list of pairs in exports, like the client uses them
+    data["options"] = dump_options(data["options"])
+    return data
+
+
+def _subtype_to_dict(subtype) -> Dict[str, Any]:
+    data = _to_dict(subtype)
+    # Keep the JSON text of the vertices in exports, independent of how they're stored
+    if isinstance(subtype, Polygon):
+        data["vertices"] = json.dumps(unpack_vertices(data["vertices"]))
+    return data
+
+
+def _group_by(query, key: str) -> Dict[Any, List[Any]]:
+    grouped: Dict[Any, List[Any]] = defaultdict(list)
+    for row in query:
+        grouped[getattr(row, key)].append(row)
+    return grouped
+
+
+def export_campaign(room: Room, path: Path) -> None:
+    """
+    Writes all data of a campaign to `path` as JSON.
+
+    Every table is read with a single query per location, keyed by parent id,
+    instead of following foreign keys one object at a time.
+    Locations are written to the file as soon as they are serialized,
+    so only a single location has to be kept in memory.
+    """
+    with open(path, "w") as f:
+        f.write("{")
+
+        _write_entry(f, "room", _get_room_data(room))
+
+        players = list(PlayerRoom.select().where(PlayerRoom.room == room))
+        users = {
+            u.id: u
+            for u in User.select().where(User.id << [pr.player_id for pr in players])
+        }
+        options = {
+            o.id: o
+            for o in UserOptions.select().where(
+                UserOptions.id
+                << [pr.user_options_id for pr in players]
+                + [u.default_options_id for u in users.values()]
+            )
+        }
+        player_data = []
+        user_data: Dict[str, Any] = {"_": [], "labels": []}
+        for pr in players:
+            player_data.append(
+                {
+                    "_": _to_dict(pr, "id", "room", "last_played"),
+                    "user_options": _get_options(options, pr.user_options_id),
+                }
+            )
+            user = users[pr.player_id]
+            user_data["_"].append(
+                {
+                    "_": _to_dict(user, "password_hash"),
+                    "default_options": _get_options(options, user.default_options_id),
+                }
+            )
+        _write_entry(f, "players", player_data)
+
+        # Labels are shared between shapes, only export each of them once
+        label_ids = {
+            shape_label.label_id
+            for shape_label in ShapeLabel.select(ShapeLabel.label)
+            .join(Shape)
+            .join(Layer)
+            .join(Floor)
+            .join(Location)
+            .where(Location.room == room)
+        }
+        user_data["labels"] = [
+            _to_dict(label)
+            for label in Label.select().where(Label.uuid << list(label_ids))
+        ]
+        # The importer needs the users before it can process the locations
+        _write_entry(f, "users", user_data)
+
+        locations = list(Location.select().where(Location.room == room))
+        location_options = {
+            o.id: o
+            for o in LocationOptions.select().where(
+                LocationOptions.id << [l.options_id for l in locations]
+            )
+        }
+        f.write('"locations": [')
+        for i, location in enumerate(locations):
+            if i > 0:
+                f.write(", ")
+            json.dump(_get_location_data(location, location_options), f)
+        f.write("]")
+
+        f.write("}")
+
+
+def _write_entry(f: TextIO, key: str, value: Any) -> None:
+    f.write(f"{json.dumps(key)}: ")
+    json.dump(value, f)
+    f.write(", ")
+
+
+def _get_options(options: Dict[int, Any], options_id: Optional[int]):
+    if options_id not in options:
+        return {}
+    return _to_dict(options[options_id], "id")
+
+
+def _get_room_data(room: Room) -> Dict[str, Any]:
+    return {
+        "_": _to_dict(room, "id"),
+        "default_options": _to_dict(room.default_options, "id"),
+        "notes": [_to_dict(note, "room") for note in room.notes],
+    }
+
+
+def _get_location_data(
+    location: Location,
+    location_options: Dict[int, LocationOptions],
+) -> Dict[str, Any]:
+    floors = list(Floor.select().where(Floor.location == location))
+    layers = _group_by(
+        Layer.select().join(Floor).where(Floor.location == location), "floor_id"
+    )
+    shapes = _group_by(
+        Shape.select().join(Layer).join(Floor).where(Floor.location == location),
+        "layer_id",
+    )
+
+    def for_location(model):
+        return (
+            model.select()
+            .join(Shape)
+            .join(Layer)
+            .join(Floor)
+            .where(Floor.location == location)
+        )
+
+    owners = _group_by(for_location(ShapeOwner), "shape_id")
+    trackers = _group_by(for_location(Tracker), "shape_id")
+    auras = _group_by(for_location(Aura), "shape_id")
+    shape_labels = _group_by(for_location(ShapeLabel), "shape_id")
+    subtypes: Dict[str, Any] = {}
+    for type_ in {shape.type_ for layer in shapes.values() for shape in layer}:
+        table = getattr(Shape, f"{type_}_set").field.model
+        for subtype in for_location(table):
+            subtypes[subtype.shape_id] = subtype
+
+    floors_data = []
+    for floor in floors:
+        layers_data = []
+        for layer in layers[floor.id]:
+            shapes_data = []
+            for shape in shapes[layer.id]:
+                shapes_data.append(
+                    {
+                        "_": _shape_to_dict(shape),
+                        "st": _subtype_to_dict(subtypes[shape.uuid]),
+                        "trackers": [_to_dict(t) for t in trackers[shape.uuid]],
+                        "auras": [_to_dict(a) for a in auras[shape.uuid]],
+                        "labels": [
+                            _to_dict(sl, "id") for sl in shape_labels[shape.uuid]
+                        ],
+                        "access": [_to_dict(o, "id") for o in owners[shape.uuid]],
+                    }
+                )
+            layers_data.append({"_": _to_dict(layer, "floor"), "shapes": shapes_data})
+        floors_data.append({"_": _to_dict(floor, "location"), "layers": layers_data})
+
+    return {
+        "_": _to_dict(location, "room"),
+        "location_options": _get_options(location_options, location.options_id),
+        "floors": floors_data,
+    }
+
+
+class JSONStreamReader:
+    """
+    Incremental reader for large JSON documents.
+
+    Containers can be walked entry by entry with `iter_object` and `iter_array`,
+    anything else is decoded as a whole with `read_value`.
+    Only the value that is currently being decoded has to fit in memory.
+    """
+
+    def __init__(self, f: TextIO, chunk_size: int = 64 * 1024) -> None:
+        self._f = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._consumed = 0
+        self._eof = False
+
+    @property
+    def position(self) -> int:
+        """Amount of characters that have been processed so far."""
+        return self._consumed + self._pos
+
+    def read_value(self) -> Any:
+        self._peek()
+        size = self._chunk_size
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill(size):
+                    raise
+                size *= 2
+                continue
+            # A number at the end of the buffer might continue in the next chunk
+            if end == len(self._buffer) and self._fill(size):
+                size *= 2
+                continue
+            self._pos = end
+            return value
+
+    def iter_object(self) -> Iterator[str]:
+        """
+        Yields the keys of an object.
+        The caller has to read each value before asking for the next key.
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self._expect(":")
+            yield key
+            if self._next() == "}":
+                return
+
+    def iter_array(self) -> Iterator[Any]:
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self.read_value()
+            if self._next() == "]":
+                return
+
+    def _fill(self, size: int) -> bool:
+        if self._eof:
+            return False
+        chunk = self._f.read(size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._consumed += self._pos
+        self._buffer = self._buffer[self._pos :] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos].isspace():
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill(self._chunk_size):
+                raise ValueError("Unexpected end of JSON data")
+
+    def _expect(self, char: str) -> None:
+        if self._peek() != char:
+            raise ValueError(f"Expected {char} at position {self.position}")
+        self._pos += 1
+
+    def _next(self) -> str:
+        """Consumes the separator after a container entry and returns it."""
+        char = self._peek()
+        if char not in ",]}":
+            raise ValueError(f"Unexpected {char} at position {self.position}")
+        self._pos += 1
+        return char
+
+
+class BulkInserter:
+    """
+    Collects rows per table and writes them with insert_many.
+
+    Tables are always written in the given order,
+    so rows can refer to rows of earlier tables that were added in the same batch.
+    """
+
+    def __init__(self, tables: List[Type[BaseModel]], batch_size: int = 1000) -> None:
+        self._rows: Dict[Type[BaseModel], List[Dict[str, Any]]] = {
+            table: [] for table in tables
+        }
+        self._batch_size = batch_size
+        self._pending = 0
+
+    def add(self, table: Type[BaseModel], row: Dict[str, Any]) -> None:
+        # Ignore data of columns that no longer exist
+        fields = table._meta.fields
+        self._rows[table].append({k: v for k, v in row.items() if k in fields})
+        self._pending += 1
+        if self._pending >= self._batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        for table, rows in self._rows.items():
+            if not rows:
+                continue
+            # Stay below the maximum number of variables of older SQLite versions
+            for batch in chunked(rows, max(1, 999 // len(rows[0]))):
+                table.insert_many(batch).execute()
+            rows.clear()
+        self._pending = 0
+
+
+def import_campaign(
+    fp: str, report_progress: Optional[Callable[[int, int], None]] = None
+):
+    """
+    Imports a campaign export.
+
+    The file is parsed incrementally and the whole import runs in a single transaction.
+    Shapes and their attributes are written with batched inserts,
+    the few rows whose new id is needed later on are created one by one.
+
+    `report_progress` is called with the amount of processed and total characters.
+    """
+    total = os.path.getsize(fp)
+
+    with open(fp, "r") as f, db.atomic():
+        reader = JSONStreamReader(f)
+        importer = CampaignImporter()
+        # The locations are streamed, everything else is small enough to be kept around.
+        # Exports list the users before the locations, which are needed to import them.
+        sections: Dict[str, Any] = {}
+        for key in reader.iter_object():
+            if key != "locations":
+                sections[key] = reader.read_value()
+                continue
+            if "users" in sections:
+                importer.import_users(sections["users"], sections["room"])
+                for location in reader.iter_array():
+                    importer.import_location(location)
+                    if report_progress:
+                        report_progress(reader.position, total)
+            else:
+                sections["locations"] = reader.read_value()
+
+        if importer.room_id is None:
+            importer.import_users(sections["users"], sections["room"])
+            for location in sections.get("locations", []):
+                importer.import_location(location)
+        importer.finish(sections["room"], sections["players"])
+
+    if report_progress:
+        report_progress(total, total)
+
+
+class CampaignImporter:
+    def __init__(self) -> None:
+        self.user_mapping: Dict[int, int] = {}  # old_id -> new_id
+        self.location_mapping: Dict[int, int] = {}
+        self.room_id: Optional[int] = None
+        self.inserter = BulkInserter(
+            [
+                Shape,
+                *SUBTYPE_TABLES.values(),
+                ShapeOwner,
+                Tracker,
+                Aura,
+                ShapeLabel,
+            ]
+        )
+
+    def import_users(self, users: Dict[str, Any], room: Dict[str, Any]) -> None:
+        for user_data in users["_"]:
+            default_options = UserOptions(**user_data["default_options"])
+            default_options.save()
+
+            user = user_data["_"]
+            og_id = user["id"]
+            del user["id"]
+
+            user["default_options"] = default_options
+            u = User(**user)
+            u.set_password("test")
+            u.save()
+
+            self.user_mapping[og_id] = u.id
+
+        for label in users["labels"]:
+            lb = Label(**label)
+            lb.user_id = self.user_mapping[label["user"]]
+            lb.save(force_insert=True)
+
+        # Load base room data
+        default_options = LocationOptions(**room["default_options"])
         default_options.save()
 
-        user = user_data["_"]
-        og_id = user["id"]
-        del user["id"]
-
-        user["default_options"] = default_options
-        u = User(**user)
-        u.set_password("test")
-        u.save()
-
-        USER_MAPPING[og_id] = u.id
-
-    for label in import_data["users"]["labels"]:
-        lb = Label(**label)
-        lb.user_id = USER_MAPPING[label["user"]]
-        lb.save(force_insert=True)
+        room_data = room["_"]
+        room_data["default_options"] = default_options
+        room_data["creator"] = self.user_mapping[room_data["creator"]]
+        r = Room(**room_data)
+        r.save()
 
-    # Load base room data
-    default_options = LocationOptions(**import_data["room"]["default_options"])
-    default_options.save()
+        self.room_id = r.id
 
-    room_data = import_data["room"]["_"]
-    room_data["default_options"] = default_options
-    room_data["creator"] = USER_MAPPING[room_data["creator"]]
-    r = Room(**room_data)
-    r.save()
-
-    ROOM_ID = r.id
-
-    # Load locations
-
-    LOCATION_MAPPING = {}
-
-    for location in import_data["locations"]:
+    def import_location(self, location: Dict[str, Any]) -> None:
         og_id = location["_"]["id"]
         del location["_"]["id"]
-        location["_"]["room"] = ROOM_ID
+        location["_"]["room"] = self.room_id
 
         location_options = LocationOptions(**location["location_options"])
         location_options.save()
@@ -212,10 +480,9 @@ def import_campaign(fp: str):
         l = Location(**location["_"])
         l.save()
 
-        LOCATION_MAPPING[og_id] = l.id
+        self.location_mapping[og_id] = l.id
 
         for floor in location["floors"]:
-            # og_id = floor["_"]["id"]
             del floor["_"]["id"]
             floor["_"]["location"] = l.id
 
@@ -223,7 +490,6 @@ def import_campaign(fp: str):
             f.save()
 
             for layer in floor["layers"]:
-                # og_id =
                 del layer["_"]["id"]
                 layer["_"]["floor"] = f.id
 
@@ -231,88 +497,62 @@ def import_campaign(fp: str):
                 ly.save()
 
                 for shape in layer["shapes"]:
-
-                    # general shape
-
-                    shape["_"]["layer"] = ly
-                    shape["_"]["asset"] = None
-                    shape["_"]["group"] = None
-                    s = Shape(**shape["_"])
-                    s.save(force_insert=True)
-
-                    # access
-
-                    for access in shape["access"]:
-                        if access["user"] not in USER_MAPPING:
-                            continue
-
-                        sa = ShapeOwner(**access)
-                        sa.user_id = USER_MAPPING[access["user"]]
-                        sa.save(force_insert=True)
-
-                    # auras
-
-                    for tracker in shape["trackers"]:
-                        tr = Tracker(**tracker)
-                        tr.save(force_insert=True)
-
-                    for auras in shape["auras"]:
-                        au = Aura(**auras)
-                        au.save(force_insert=True)
-
-                    # labels
-
-                    for label in shape["labels"]:
-                        lb = ShapeLabel(**label)
-                        lb.save(force_insert=True)
-
-                    # subtype
-
-                    if s.type_ == "assetrect":
-                        st = AssetRect(**shape["st"])
-                        st.save(force_insert=True)
-                    elif s.type_ == "circulartoken":
-                        st = CircularToken(**shape["st"])
-                        st.save(force_insert=True)
-                    elif s.type_ == "circle":
-                        st = Circle(**shape["st"])
-                        st.save(force_insert=True)
-                    elif s.type_ == "line":
-                        st = Line(**shape["st"])
-                        st.save(force_insert=True)
-                    elif s.type_ == "polygon":
-                        st = Polygon(**shape["st"])
-                        st.save(force_insert=True)
-                    elif s.type_ == "rect":
-                        st = Rect(**shape["st"])
-                        st.save(force_insert=True)
-                    elif s.type_ == "text":
-                        st = Text(**shape["st"])
-                        st.save(force_insert=True)
-                    elif s.type_ == "togglecomposite":
-                        st = ToggleComposite(**shape["st"])
-                        st.save(force_insert=True)
-
-    # Load notes
-
-    for note in import_data["room"]["notes"]:
-        nt = Note(**note)
-        nt.location_id = LOCATION_MAPPING[note["location"]]
-        nt.user_id = USER_MAPPING[note["user"]]
-        nt.room_id = ROOM_ID
-        nt.save(force_insert=True)
-
-    # Load PlayerRoom data
-
-    for player in import_data["players"]:
-        user_options = UserOptions(**player["user_options"])
-        user_options.save()
-
-        player["_"]["user_options"] = user_options
-        player["_"]["room"] = ROOM_ID
-        player["_"]["player"] = USER_MAPPING[player["_"]["player"]]
-        player["_"]["active_location"] = LOCATION_MAPPING[
-            player["_"]["active_location"]
-        ]
-        pr = PlayerRoom(**player["_"])
-        pr.save()
+                    self._import_shape(shape, ly.id)
+
+        self.inserter.flush()
+
+    def _import_shape(self, shape: Dict[str, Any], layer_id: int) -> None:
+        shape["_"]["layer"] = layer_id
+        shape["_"]["asset"] = None
+        shape["_"]["group"] = None
+        shape["_"]["options"] = load_options(shape["_"].get("options", None))
+        self.inserter.add(Shape, shape["_"])
+
+        for access in shape["access"]:
+            if access["user"] not in self.user_mapping:
+                continue
+            access["user"] = self.user_mapping[access["user"]]
+            self.inserter.add(ShapeOwner, access)
+
+        for tracker in shape["trackers"]:
+            self.inserter.add(Tracker, tracker)
+
+        for aura in shape["auras"]:
+            self.inserter.add(Aura, aura)
+
+        for label in shape["labels"]:
+            self.inserter.add(ShapeLabel, label)
+
+        subtype = SUBTYPE_TABLES.get(shape["_"]["type_"], None)
+        if subtype is Polygon:
+            vertices = json.loads(shape["st"]["vertices"])
+            shape["st"]["vertices"] = pack_vertices(vertices)
+        if subtype is not None:
+            self.inserter.add(subtype, shape["st"])
+
+    def finish(self, room: Dict[str, Any], players: List[Dict[str, Any]]) -> None:
+        self.inserter.flush()
+
+        # Load notes
+
+        for note in room["notes"]:
+            nt = Note(**note)
+            nt.location_id = self.location_mapping[note["location"]]
+            nt.user_id = self.user_mapping[note["user"]]
+            nt.room_id = self.room_id
+            nt.save(force_insert=True)
+
+        # Load PlayerRoom data
+
+        for player in players:
+            user_options = UserOptions(**player["user_options"])
+            user_options.save()
+
+            player["_"]["user_options"] = user_options
+            player["_"]["room"] = self.room_id
+            player["_"]["player"] = self.user_mapping[player["_"]["player"]]
+            player["_"]["active_location"] = self.location_mapping[
+                player["_"]["active_location"]
+            ]
+            pr = PlayerRoom(**player["_"])
+            pr.save()
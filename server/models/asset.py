@@ -1,5 +1,6 @@
 import json
-from typing import Any, Dict
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
 
 from peewee import ForeignKeyField, TextField
 from playhouse.shortcuts import model_to_dict
@@ -27,14 +28,30 @@ class Asset(BaseModel):
         self.options = json.dumps([[k, v] for k, v in options.items()])
 
     def as_dict(self, children=False, recursive=False):
-        asset = model_to_dict(self, exclude=[Asset.owner, Asset.parent])
-        if children:
-            asset["children"] = [
-                child.as_dict(children=children and recursive, recursive=recursive)
-                for child in Asset.select().where(
-                    (Asset.owner == self.owner) & (Asset.parent == self)
+        if not children:
+            return model_to_dict(self, exclude=[Asset.owner, Asset.parent])
+        if recursive:
+            children_map = Asset.get_children_map(self.owner_id)
+        else:
+            children_map = {
+                self.id: list(
+                    Asset.select().where(
+                        (Asset.owner == self.owner_id) & (Asset.parent == self)
+                    )
                 )
-            ]
+            }
+        return self._as_tree_dict(children_map, recursive)
+
+    def _as_tree_dict(
+        self, children_map: Dict[Optional[int], List["Asset"]], recursive: bool
+    ):
+        asset = model_to_dict(self, exclude=[Asset.owner, Asset.parent])
+        asset["children"] = [
+            child._as_tree_dict(children_map, recursive)
+            if recursive
+            else child.as_dict()
+            for child in children_map.get(self.id, [])
+        ]
         return asset
 
     def get_child(self, name: str) -> "Asset":
@@ -51,18 +68,31 @@ class Asset(BaseModel):
         return root
 
     @classmethod
-    def get_user_structure(cls, user, parent=None):
+    def get_children_map(cls, user) -> Dict[Optional[int], List["Asset"]]:
+        """
+        Loads all assets of a user with a single query, grouped by parent id.
+        """
+        children_map: Dict[Optional[int], List["Asset"]] = defaultdict(list)
+        for asset in cls.select().where(cls.owner == user).order_by(cls.id):
+            children_map[asset.parent_id].append(asset)
+        return children_map
+
+    @classmethod
+    def get_user_structure(cls, user, parent=None) -> Dict[str, Any]:
         if parent is None:
             parent = cls.get_root_folder(user)
-        # ideally we change this to a single query to get all assets and process them as such
-        data = {"__files": []}
-        for asset in Asset.select().where(
-            (Asset.owner == user) & (Asset.parent == parent)
-        ):
+        return cls._get_structure(cls.get_children_map(user), parent.id)
+
+    @classmethod
+    def _get_structure(
+        cls, children_map: Dict[Optional[int], List["Asset"]], parent_id: int
+    ) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"__files": []}
+        for asset in children_map.get(parent_id, []):
             if asset.file_hash:
                 data["__files"].append(
                     {"id": asset.id, "name": asset.name, "hash": asset.file_hash}
                 )
             else:
-                data[asset.name] = cls.get_user_structure(user, asset)
+                data[asset.name] = cls._get_structure(children_map, asset.id)
         return data
@@ -9,11 +9,9 @@ from peewee import (
     TextField,
 )
 from playhouse.shortcuts import model_to_dict
-from typing import Set
 
 from .asset import Asset
 from .base import BaseModel
-from .groups import Group
 from .user import User, UserOptions
 
 __all__ = [
@@ -221,17 +219,9 @@ class Floor(BaseModel):
         return f"<Floor {self.name} {[self.index]}>"
 
     def as_dict(self, user: User, dm: bool):
-        data = model_to_dict(self, recurse=False, exclude=[Floor.id, Floor.location])
-        if dm:
-            data["layers"] = [
-                l.as_dict(user, True) for l in self.layers.order_by(Layer.index)
-            ]
-        else:
-            data["layers"] = [
-                l.as_dict(user, False)
-                for l in self.layers.order_by(Layer.index).where(Layer.player_visible)
-            ]
-        return data
+        from .shape.snapshot import FloorSnapshot
+
+        return FloorSnapshot(self).as_dict(user, dm)
 
 
 class Layer(BaseModel):
@@ -251,22 +241,10 @@ class Layer(BaseModel):
         return f"{self.floor.location.get_path()}/{self.name}"
 
     def as_dict(self, user: User, dm: bool):
-        from .shape import Shape
+        from .shape.snapshot import FloorSnapshot
 
-        data = model_to_dict(
-            self,
-            recurse=False,
-            backrefs=False,
-            exclude=[Layer.id, Layer.player_visible],
-        )
-        groups_added: Set[Group] = set()
-        data["groups"] = []
-        data["shapes"] = []
-        for shape in self.shapes.order_by(Shape.index):
-            data["shapes"].append(shape.as_dict(user, dm))
-            if shape.group and not shape.group.uuid in groups_added:
-                data["groups"].append(model_to_dict(shape.group))
-        return data
+        snapshot = FloorSnapshot(self.floor, layers=[self])
+        return snapshot.layers[0].as_dict(user, dm)
 
     class Meta:
         indexes = ((("floor", "name"), True), (("floor", "index"), True))
@@ -0,0 +1,184 @@
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+from uuid import uuid4
+
+from peewee import chunked
+
+from .base import BaseModel
+from .campaign import Floor, Location, Room
+from .db import db
+from .groups import Group
+from .shape import (
+    AssetRect,
+    Aura,
+    Circle,
+    CircularToken,
+    CompositeShapeAssociation,
+    Line,
+    Polygon,
+    Rect,
+    Shape,
+    ShapeLabel,
+    Text,
+    ToggleComposite,
+    Tracker,
+)
+
+# Subtypes without references to other shapes, ToggleComposite is handled separately
+SIMPLE_SUBTYPES: Tuple[Type[BaseModel], ...] = (
+    AssetRect,
+    Circle,
+    CircularToken,
+    Line,
+    Polygon,
+    Rect,
+    Text,
+)
+# Shape data with its own uuid that has to be replaced as well
+UUID_MODELS: Tuple[Type[BaseModel], ...] = (Tracker, Aura)
+
+
+def clone_location(src_location: Location, room: Room) -> Location:
+    """
+    Copies a location with all of its floors and shapes to the given room.
+
+    New identifiers are generated up front and stored in temporary mapping tables,
+    after which every table is copied with a single INSERT ... SELECT.
+    Shape owners are not copied, labels are shared with the source shapes.
+    """
+    with db.atomic():
+        new_location = Location.create(
+            room=room, name=src_location.name, index=room.locations.count()
+        )
+
+        # old layer id -> new layer id
+        layer_mapping: Dict[int, int] = {}
+        for prev_floor in src_location.floors.order_by(Floor.index):
+            new_floor = new_location.create_floor(prev_floor.name)
+            new_layers = {layer.name: layer.id for layer in new_floor.layers}
+            for prev_layer in prev_floor.layers:
+                if prev_layer.name in new_layers:
+                    layer_mapping[prev_layer.id] = new_layers[prev_layer.name]
+
+        shapes = list(
+            Shape.select(Shape.uuid, Shape.layer, Shape.group).where(
+                Shape.layer << list(layer_mapping)
+            )
+        )
+        if not shapes:
+            return new_location
+
+        _create_mapping_tables()
+        try:
+            _fill_mapping(
+                "clone_shape",
+                ((s.uuid, str(uuid4()), layer_mapping[s.layer_id]) for s in shapes),
+            )
+            group_ids = {s.group_id for s in shapes if s.group_id is not None}
+            _fill_mapping("clone_group", ((g, str(uuid4()), None) for g in group_ids))
+            for model in UUID_MODELS:
+                query = (
+                    model.select(model.uuid)
+                    .join(Shape)
+                    .where(Shape.layer << list(layer_mapping))
+                )
+                _fill_mapping(
+                    "clone_uuid", ((r.uuid, str(uuid4()), None) for r in query)
+                )
+
+            _copy_rows(Group, "JOIN clone_group m ON m.old = t.uuid", uuid="m.new")
+            _copy_rows(
+                Shape,
+                "JOIN clone_shape m ON m.old = t.uuid "
+                "LEFT JOIN clone_group g ON g.old = t.group_id",
+                uuid="m.new",
+                layer_id="m.layer",
+                group_id="g.new",
+            )
+            for subtype in SIMPLE_SUBTYPES:
+                _copy_rows(
+                    subtype,
+                    "JOIN clone_shape m ON m.old = t.shape_id",
+                    shape_id="m.new",
+                )
+            _copy_rows(
+                ToggleComposite,
+                "JOIN clone_shape m ON m.old = t.shape_id "
+                "LEFT JOIN clone_shape v ON v.old = t.active_variant",
+                shape_id="m.new",
+                active_variant="v.new",
+            )
+            _copy_rows(
+                CompositeShapeAssociation,
+                "JOIN clone_shape m ON m.old = t.parent_id "
+                "JOIN clone_shape v ON v.old = t.variant_id",
+                id=None,
+                parent_id="m.new",
+                variant_id="v.new",
+            )
+            for model in UUID_MODELS:
+                _copy_rows(
+                    model,
+                    "JOIN clone_shape m ON m.old = t.shape_id "
+                    "JOIN clone_uuid u ON u.old = t.uuid",
+                    uuid="u.new",
+                    shape_id="m.new",
+                )
+            _copy_rows(
+                ShapeLabel,
+                "JOIN clone_shape m ON m.old = t.shape_id",
+                id=None,
+                shape_id="m.new",
+            )
+        finally:
+            _drop_mapping_tables()
+
+    return new_location
+
+
+def _create_mapping_tables() -> None:
+    for table in ("clone_shape", "clone_group", "clone_uuid"):
+        db.execute_sql(
+            f"CREATE TEMPORARY TABLE {table} "
+            "(old TEXT PRIMARY KEY, new TEXT NOT NULL, layer INTEGER)"
+        )
+
+
+def _drop_mapping_tables() -> None:
+    for table in ("clone_shape", "clone_group", "clone_uuid"):
+        db.execute_sql(f"DROP TABLE IF EXISTS temp.{table}")
+
+
+def _fill_mapping(table: str, rows: Iterable[Tuple[str, str, Optional[int]]]) -> None:
+    for batch in chunked(rows, 300):
+        db.execute_sql(
+            f"INSERT INTO {table} (old, new, layer) VALUES "
+            + ", ".join("(?, ?, ?)" for _ in batch),
+            [value for row in batch for value in row],
+        )
+
+
+def _copy_rows(model: Type[BaseModel], joins: str, **replace: Optional[str]) -> None:
+    """
+    Copies the rows of `model` that match the source table `t` joined with `joins`.
+
+    Columns are copied as is, unless they are named in `replace`,
+    in which case the given expression is used, or the column is left out for `None`.
+    """
+    columns: List[str] = []
+    values: List[str] = []
+    for field in model._meta.sorted_fields:
+        column = field.column_name
+        if column in replace:
+            expression = replace[column]
+            if expression is None:
+                continue
+            values.append(expression)
+        else:
+            values.append(f't."{column}"')
+        columns.append(f'"{column}"')
+
+    table = model._meta.table_name
+    db.execute_sql(
+        f'INSERT INTO "{table}" ({", ".join(columns)}) '
+        f'SELECT {", ".join(values)} FROM "{table}" t {joins}'
+    )
@@ -1,14 +1,223 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future
+from functools import partial, wraps
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from peewee import Model
+from playhouse.signals import post_save
 from playhouse.sqlite_ext import SqliteExtDatabase
 
-from config import SAVE_FILE
+from config import SAVE_FILE, config
+from utils import logger
 
-db = SqliteExtDatabase(
-    SAVE_FILE,
-    pragmas={
-        # "journal_mode": "wal",
-        # "cache_size": -1 * 6400,
-        "foreign_keys": 1,
-        # "ignore_check_constraints": 0,
-        # "synchronous": 0,
+# Pragma profiles that can be selected with the `profile` option in the `Database` config section.
+#   safe: every commit is fsynced, survives power loss
+#   balanced: commits survive an application crash, the last commits can be lost on power loss
+#   fast: no fsyncs at all, an OS crash or power loss can corrupt the save file
+PRAGMA_PROFILES: Dict[str, Dict[str, Any]] = {
+    "safe": {
+        "journal_mode": "wal",
+        "synchronous": "full",
+        "cache_size": -1 * 8000,
+        "mmap_size": 0,
+        "temp_store": "default",
+    },
+    "balanced": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "cache_size": -1 * 32000,
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "memory",
+    },
+    "fast": {
+        "journal_mode": "wal",
+        "synchronous": "off",
+        "cache_size": -1 * 64000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "memory",
     },
-)
+}
+
+# SQLite reports these pragmas as integers
+_PRAGMA_VALUES = {
+    "synchronous": {"off": 0, "normal": 1, "full": 2, "extra": 3},
+    "temp_store": {"default": 0, "file": 1, "memory": 2},
+}
+
+
+def get_pragmas() -> Dict[str, Any]:
+    profile = config.get("Database", "profile", fallback="balanced")
+    if profile not in PRAGMA_PROFILES:
+        logger.error(f"Unknown database profile {profile}, using balanced instead.")
+        profile = "balanced"
+
+    pragmas = {**PRAGMA_PROFILES[profile]}
+    # Individual pragmas of the profile can be overridden in the config
+    for name in pragmas:
+        if config.has_option("Database", name):
+            value = config.get("Database", name)
+            pragmas[name] = int(value) if value.lstrip("-").isdigit() else value
+    pragmas["foreign_keys"] = 1
+    return pragmas
+
+
+db = SqliteExtDatabase(SAVE_FILE, pragmas=get_pragmas())
+
+
+def check_pragmas() -> bool:
+    """
+    Verify that the configured pragmas are actually active on the database connection.
+    Some settings (e.g. WAL on network filesystems) can be silently refused by SQLite.
+    """
+    valid = True
+    for name, expected in db._pragmas:
+        actual = db.pragma(name)
+        if isinstance(expected, str):
+            expected = _PRAGMA_VALUES.get(name, {}).get(expected.lower(), expected)
+        if isinstance(actual, str) and isinstance(expected, str):
+            actual, expected = actual.lower(), expected.lower()
+        if actual != expected:
+            logger.warning(
+                f"Database pragma {name} is {actual} instead of the configured {expected}"
+            )
+            valid = False
+    return valid
+
+
+T = TypeVar("T")
+
+# An instance with the values of its fields that are written
+Change = Tuple[Model, Dict[str, Any]]
+
+
+def write_changes(changes: List[Change]) -> None:
+    """
+    Writes the given field values of existing rows in a single transaction, model signals are not sent.
+    """
+    with db.atomic():
+        for instance, values in changes:
+            model = type(instance)
+            fields = {model._meta.fields[name]: v for name, v in values.items()}
+            if fields:
+                model.update(fields).where(instance._pk_expr()).execute()
+
+
+class DatabaseExecutor:
+    """
+    Runs database work on a single dedicated thread, away from the asyncio event loop.
+
+    peewee connections are thread local, so the worker thread uses its own connection to the save file.
+    Requests are handled one at a time in the order they were submitted.
+    Bulk work, the write-behind flushes of the in-memory state (see state.write_behind)
+    and the writes of the socket handlers all go through here. A handler write that arrives
+    during a long job (e.g. cloning a location) is queued behind it instead of blocking
+    the event loop on SQLite's busy timeout. Handlers should use `save` instead of `Model.save`
+    and `run` for other writes, reads can stay on the event loop's own connection.
+
+    Model signals fire on the thread that saves the model,
+    receivers that touch state of the event loop have to be wrapped with `on_loop`.
+    """
+
+    def __init__(self) -> None:
+        self._queue: "queue.Queue[Optional[Tuple[Future, Callable[[], Any]]]]" = (
+            queue.Queue()
+        )
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Run `fn(*args, **kwargs)` on the database thread and wait for its result.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((future, partial(fn, *args, **kwargs)))
+        return await asyncio.wrap_future(future)
+
+    async def save(self, *instances: Model) -> None:
+        """
+        Write the changed fields of existing instances in a single transaction on the database thread.
+
+        The values are collected on the event loop, so the instances can keep changing
+        while the write is queued. post_save is sent on the event loop once the write committed.
+        """
+        changes: List[Change] = []
+        for instance in instances:
+            values = {name: instance.__data__.get(name) for name in instance._dirty}
+            instance._dirty.clear()
+            changes.append((instance, values))
+
+        try:
+            await self.run(write_changes, changes)
+        except BaseException:
+            for instance, values in changes:
+                instance._dirty.update(values)
+            raise
+
+        for instance, _ in changes:
+            post_save.send(instance, created=False)
+
+    def call_on_loop(self, fn: Callable[..., Any], *args, **kwargs) -> None:
+        """
+        Calls `fn` right away, unless this is the database thread,
+        in which case it is scheduled on the event loop that submitted the work.
+        """
+        if self._loop is not None and threading.current_thread() is self._thread:
+            self._loop.call_soon_threadsafe(partial(fn, *args, **kwargs))
+        else:
+            fn(*args, **kwargs)
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._work, name="db-executor", daemon=True
+                )
+                self._thread.start()
+
+    def _work(self) -> None:
+        db.connect(reuse_if_open=True)
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+
+                future, fn = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    result = fn()
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+        finally:
+            db.close()
+
+
+db_executor = DatabaseExecutor()
+
+
+def on_loop(fn: Callable[..., Any]) -> Callable[..., None]:
+    """
+    Makes a signal receiver run on the event loop, also for models saved by the database thread.
+    """
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs) -> None:
+        db_executor.call_on_loop(fn, *args, **kwargs)
+
+    return wrapper
@@ -16,6 +16,10 @@ class Initiative(BaseModel):
     sort = IntegerField(default=0)
     data = TextField()
 
+    class Meta:
+        # Kept in memory by the initiative engine (see state.initiative), only write what changed
+        only_save_dirty = True
+
     def as_dict(self):
         initiative = model_to_dict(self, recurse=False, exclude=[Initiative.id])
         initiative["data"] = json.loads(initiative["data"])
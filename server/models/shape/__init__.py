@@ -1,17 +1,29 @@
 import json
-from uuid import uuid4
 
-from peewee import BooleanField, FloatField, ForeignKeyField, IntegerField, TextField
+from copy import deepcopy
+from math import floor
+from peewee import (
+    BlobField,
+    BooleanField,
+    FloatField,
+    ForeignKeyField,
+    IntegerField,
+    TextField,
+    fn,
+)
 from playhouse.shortcuts import model_to_dict, update_model_from_dict
-from typing import Any, Dict, List, Tuple
+from playhouse.sqlite_ext import JSONField
+from typing import Any, Dict, List, Optional, Tuple
 
 from utils import logger
 from ..asset import Asset
 from ..base import BaseModel
 from ..campaign import Layer
+from ..db import db_executor
 from ..groups import Group
 from ..label import Label
 from ..user import User
+from .vertices import pack_vertices, unpack_vertices
 
 
 __all__ = [
@@ -27,9 +39,45 @@ __all__ = [
     "ShapeOwner",
     "Text",
     "Tracker",
+    "dump_options",
+    "get_restricted_dict",
+    "load_options",
 ]
 
 
+def dump_options(options: Optional[Dict[str, Any]]) -> Optional[str]:
+    """
+    Converts the stored options to the format the client uses: a JSON list of [key, value] pairs.
+    """
+    if options is None:
+        return None
+    return json.dumps(list(options.items()))
+
+
+def load_options(data: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Converts options in the format the client uses to the stored JSON object.
+    """
+    if data is None:
+        return None
+    return dict(json.loads(data))
+
+
+def get_restricted_dict(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Strips a serialized shape down to what users without access to the shape are allowed to see.
+    """
+    data = {**data}
+    if not data["annotation_visible"]:
+        data["annotation"] = ""
+    if not data["name_visible"]:
+        data["name"] = "?"
+    data["trackers"] = [t for t in data["trackers"] if t["visible"]]
+    data["auras"] = [a for a in data["auras"] if a["visible"]]
+    data["labels"] = [l for l in data["labels"] if l["visible"]]
+    return data
+
+
 class Shape(BaseModel):
     uuid = TextField(primary_key=True)
     layer = ForeignKeyField(Layer, backref="shapes", on_delete="CASCADE")
@@ -45,8 +93,11 @@ class Shape(BaseModel):
     is_token = BooleanField(default=False)
     annotation = TextField(default="")
     draw_operator = TextField(default="source-over")
-    index = IntegerField()
-    options = TextField(null=True)
+    # Sort key of the shape within its layer, only the relative order is meaningful.
+    # Gaps are allowed, reordering picks a value between the new neighbours (see set_order).
+    index = FloatField()
+    # JSON object, the client exchanges it as a list of pairs (see dump_options)
+    options = JSONField(null=True)
     badge = IntegerField(default=1)
     show_badge = BooleanField(default=False)
     default_edit_access = BooleanField(default=False)
@@ -64,6 +115,11 @@ class Shape(BaseModel):
     is_door = BooleanField(default=False)
     is_teleport_zone = BooleanField(default=False)
 
+    class Meta:
+        # Shapes are cached in memory (see state.shapes), only write what actually changed
+        only_save_dirty = True
+        indexes = ((("layer", "index"), False),)
+
     def __repr__(self):
         return f"<Shape {self.get_path()}>"
 
@@ -74,10 +130,50 @@ class Shape(BaseModel):
             return self.name
 
     def get_options(self) -> Dict[str, Any]:
-        return dict(json.loads(self.options))
+        return dict(self.options or {})
 
-    def set_options(self, options: Dict[str, Any]) -> None:
-        self.options = json.dumps([[k, v] for k, v in options.items()])
+    def set_options(self, options: Optional[Dict[str, Any]]) -> None:
+        self.options = None if options is None else dict(options)
+
+    async def set_option(self, *path: str, value: Any) -> None:
+        """
+        Changes a single (nested) option with json_set, the other options are not rewritten.
+        Missing parent objects are created.
+
+        The change is written on the database thread and applied to this instance
+        without marking the field dirty, so a later save does not write the options again.
+        """
+        query = Shape.update(
+            options=fn.json_set(
+                fn.coalesce(Shape.options, "{}"),
+                _get_option_path(path),
+                fn.json(json.dumps(value)),
+            )
+        ).where(Shape.uuid == self.uuid)
+        await db_executor.run(query.execute)
+
+        options = deepcopy(self.get_options())
+        target = options
+        for key in path[:-1]:
+            target = target.setdefault(key, {})
+        target[path[-1]] = value
+        self.__data__["options"] = options
+
+    async def remove_options(self, *keys: str) -> None:
+        """
+        Removes the given options with json_remove, see set_option.
+        """
+        query = Shape.update(
+            options=fn.json_remove(
+                Shape.options, *(_get_option_path([k]) for k in keys)
+            )
+        ).where(Shape.uuid == self.uuid)
+        await db_executor.run(query.execute)
+
+        if self.options is not None:
+            self.__data__["options"] = {
+                k: v for k, v in self.options.items() if k not in keys
+            }
 
     # todo: Change this API to accept a PlayerRoom instead
     def as_dict(self, user: User, dm: bool):
@@ -88,36 +184,110 @@ class Shape(BaseModel):
             ).items()
             if v is not None
         }
+        if "options" in data:
+            data["options"] = dump_options(data["options"])
         # Owner query > list of usernames
         data["owners"] = [owner.as_dict() for owner in self.owners]
         # Layer query > layer name
         data["layer"] = self.layer.name
         data["floor"] = self.layer.floor.name
         # Aura and Tracker queries > json
+        data["trackers"] = [t.as_dict() for t in self.trackers]
+        data["auras"] = [a.as_dict() for a in self.auras]
+        data["labels"] = [l.as_dict() for l in self.labels.join(Label)]
         owned = (
             dm
             or self.default_edit_access
             or self.default_vision_access
             or any(user.name == o["user"] for o in data["owners"])
         )
-        tracker_query = self.trackers
-        aura_query = self.auras
-        label_query = self.labels.join(Label)
         if not owned:
-            if not self.annotation_visible:
-                data["annotation"] = ""
-            tracker_query = tracker_query.where(Tracker.visible)
-            aura_query = aura_query.where(Aura.visible)
-            label_query = label_query.where(Label.visible)
-            if not self.name_visible:
-                data["name"] = "?"
-        data["trackers"] = [t.as_dict() for t in tracker_query]
-        data["auras"] = [a.as_dict() for a in aura_query]
-        data["labels"] = [l.as_dict() for l in label_query]
+            data = get_restricted_dict(data)
         # Subtype
         data.update(**self.subtype.as_dict(exclude=[self.subtype.__class__.shape]))
         return data
 
+    @staticmethod
+    def get_next_index(layer) -> float:
+        """
+        Returns the index that places a new shape on top of all other shapes of the layer.
+        """
+        highest = Shape.select(fn.Max(Shape.index)).where(Shape.layer == layer).scalar()
+        if highest is None:
+            return 0
+        return floor(highest) + 1
+
+    @staticmethod
+    def rebalance_indices(layer) -> None:
+        """
+        Spreads the indices of all shapes on the layer evenly again, in a single update.
+        """
+        ranked = (
+            Shape.select(
+                Shape.uuid,
+                (fn.row_number().over(order_by=[Shape.index, Shape.uuid]) - 1).alias(
+                    "position"
+                ),
+            )
+            .where(Shape.layer == layer)
+            .alias("ranked")
+        )
+        Shape.update(index=ranked.c.position).from_(ranked).where(
+            Shape.uuid == ranked.c.uuid
+        ).execute()
+
+    def set_order(self, position: int) -> None:
+        """
+        Change the index so that the shape ends up at the given position
+        (0 being the bottom) among the other shapes of its layer.
+
+        Only this shape is modified, unless there is no room left between the new neighbours,
+        in which case the layer is rebalanced first.
+        """
+        index = self._get_order_index(position)
+        if index is None:
+            Shape.rebalance_indices(self.layer_id)
+            index = self._get_order_index(position)
+        if index is None:
+            logger.error(
+                f"Could not find an index for shape {self.uuid} at position {position}"
+            )
+            return
+        self.index = index
+
+    def _get_order_index(self, position: int) -> Optional[float]:
+        """
+        The index between the new neighbours of the shape, None if there is no room left.
+        """
+        siblings = Shape.select(Shape.index).where(
+            (Shape.layer == self.layer_id) & (Shape.uuid != self.uuid)
+        )
+        below: Optional[float] = None
+        above: Optional[float] = None
+        if position > 0:
+            neighbours = [
+                s[0]
+                for s in siblings.order_by(Shape.index)
+                .offset(position - 1)
+                .limit(2)
+                .tuples()
+            ]
+            if neighbours:
+                below = neighbours[0]
+                above = neighbours[1] if len(neighbours) > 1 else None
+            else:
+                # The position is past the last sibling, so the shape goes on top
+                below = siblings.select(fn.Max(Shape.index)).scalar()
+        else:
+            above = siblings.order_by(Shape.index).limit(1).scalar()
+
+        if above is None:
+            return 0 if below is None else floor(below) + 1
+        if below is None:
+            return above - 1
+        index = (below + above) / 2
+        return index if below < index < above else None
+
     def center_at(self, x: int, y: int) -> None:
         x_off, y_off = self.subtype.get_center_offset(x, y)
         self.x = x - x_off
@@ -127,52 +297,10 @@ class Shape(BaseModel):
     def subtype(self):
         return getattr(self, f"{self.type_}_set").get()
 
-    def make_copy(self, dst_layer, new_group):
-        new_shape = Shape.create(
-            uuid=str(uuid4()),
-            layer=dst_layer,
-            type_=self.type_,
-            x=self.x,
-            y=self.y,
-            name=self.name,
-            name_visible=self.name_visible,
-            fill_colour=self.fill_colour,
-            stroke_colour=self.stroke_colour,
-            vision_obstruction=self.vision_obstruction,
-            movement_obstruction=self.movement_obstruction,
-            is_token=self.is_token,
-            annotation=self.annotation,
-            draw_operator=self.draw_operator,
-            index=self.index,
-            options=self.options,
-            badge=self.badge,
-            show_badge=self.show_badge,
-            default_edit_access=self.default_edit_access,
-            default_vision_access=self.default_vision_access,
-            is_invisible=self.is_invisible,
-            is_defeated=self.is_defeated,
-            default_movement_access=self.default_movement_access,
-            is_locked=self.is_locked,
-            angle=self.angle,
-            stroke_width=self.stroke_width,
-            asset=self.asset,
-            group=new_group,
-            annotation_visible=self.annotation_visible,
-            ignore_zoom_size=self.ignore_zoom_size,
-        )
-
-        self.subtype.make_copy(new_shape)
-
-        for aura in self.auras:
-            aura.make_copy(new_shape)
-
-        for tracker in self.trackers:
-            tracker.make_copy(new_shape)
-
-        for label in self.labels:
-            label.make_copy(new_shape)
 
-        return new_shape
+def _get_option_path(keys):
+    # Keys are quoted, so that they are never interpreted as a path themselves
+    return Shape.options[".".join(f'"{key}"' for key in keys)].path
 
 
 class ShapeLabel(BaseModel):
@@ -182,9 +310,6 @@ class ShapeLabel(BaseModel):
     def as_dict(self):
         return self.label.as_dict()
 
-    def make_copy(self, shape):
-        ShapeLabel.create(shape=shape, label=self.label.make_copy())
-
 
 class Tracker(BaseModel):
     uuid = TextField(primary_key=True)
@@ -203,11 +328,6 @@ class Tracker(BaseModel):
     def as_dict(self):
         return model_to_dict(self, recurse=False, exclude=[Tracker.shape])
 
-    def make_copy(self, new_shape):
-        dict = self.as_dict()
-        dict["uuid"] = str(uuid4())
-        type(self).create(shape=new_shape, **dict)
-
 
 class Aura(BaseModel):
     uuid = TextField(primary_key=True)
@@ -229,11 +349,6 @@ class Aura(BaseModel):
     def as_dict(self):
         return model_to_dict(self, recurse=False, exclude=[Aura.shape])
 
-    def make_copy(self, new_shape):
-        dict = self.as_dict()
-        dict["uuid"] = str(uuid4())
-        type(self).create(shape=new_shape, **dict)
-
 
 class ShapeOwner(BaseModel):
     shape = ForeignKeyField(Shape, backref="owners", on_delete="CASCADE")
@@ -247,7 +362,7 @@ class ShapeOwner(BaseModel):
 
     def as_dict(self):
         return {
-            "shape": self.shape.uuid,
+            "shape": self.shape_id,
             "user": self.user.name,
             "edit_access": self.edit_access,
             "movement_access": self.movement_access,
@@ -258,6 +373,9 @@ class ShapeOwner(BaseModel):
 class ShapeType(BaseModel):
     shape = ForeignKeyField(Shape, primary_key=True, on_delete="CASCADE")
 
+    class Meta:
+        only_save_dirty = True
+
     @staticmethod
     def pre_create(**kwargs):
         return kwargs
@@ -278,14 +396,9 @@ class ShapeType(BaseModel):
     def get_center_offset(self, x: int, y: int) -> Tuple[int, int]:
         return 0, 0
 
-    def set_location(self, points: List[List[int]]) -> None:
+    def set_location(self, points: List[List[float]]) -> None:
         logger.error("Attempt to set location on shape without location info")
 
-    def make_copy(self, new_shape):
-        table = type(self)
-        dict = self.as_dict(exclude=[table.shape])
-        table.create(shape=new_shape, **dict)
-
 
 class BaseRect(ShapeType):
     width = FloatField()
@@ -319,27 +432,27 @@ class Line(ShapeType):
 
 
 class Polygon(ShapeType):
-    vertices = TextField()
+    # See vertices.py, only decoded when the shape is serialized
+    vertices = BlobField()
     line_width = IntegerField()
     open_polygon = BooleanField()
 
     @staticmethod
     def pre_create(**kwargs):
-        kwargs["vertices"] = json.dumps(kwargs["vertices"])
+        kwargs["vertices"] = pack_vertices(kwargs["vertices"])
         return kwargs
 
     def as_dict(self, *args, **kwargs):
         model = model_to_dict(self, *args, **kwargs)
-        model["vertices"] = json.loads(model["vertices"])
+        model["vertices"] = unpack_vertices(model["vertices"])
         return model
 
     def update_from_dict(self, data, *args, **kwargs):
-        data["vertices"] = json.dumps(data["vertices"])
+        data["vertices"] = pack_vertices(data["vertices"])
         return update_model_from_dict(self, data, *args, **kwargs)
 
-    def set_location(self, points: List[List[int]]) -> None:
-        self.vertices = json.dumps(points)
-        self.save()
+    def set_location(self, points: List[List[float]]) -> None:
+        self.vertices = pack_vertices(points)
 
 
 class Rect(BaseRect):
@@ -365,12 +478,17 @@ class ToggleComposite(ShapeType):
                 parent=subshape, variant=variant["uuid"], name=variant["name"]
             )
 
-    def as_dict(self, *args, **kwargs):
+    def as_dict(self, *args, variants=None, **kwargs):
         model = model_to_dict(self, *args, **kwargs)
-        model["variants"] = [
-            {"uuid": sv.variant.uuid, "name": sv.name}
-            for sv in self.shape.shape_variants
-        ]
+        if variants is None:
+            # Bulk serialization (see snapshot.py) provides the variants itself
+            variants = [
+                {"uuid": sv.variant_id, "name": sv.name}
+                for sv in CompositeShapeAssociation.select().where(
+                    CompositeShapeAssociation.parent == self.shape_id
+                )
+            ]
+        model["variants"] = variants
         return model
 
 
@@ -1,16 +1,19 @@
+from typing import Optional
+
 from models.campaign import PlayerRoom
 from models.role import Role
-from models.shape import Shape, ShapeOwner
+from models.shape import Shape
+from state.permissions import permission_index
 
 
-def has_ownership(shape: Shape, pr: PlayerRoom, movement=False) -> bool:
+def has_ownership(shape: Optional[Shape], pr: PlayerRoom, movement=False) -> bool:
     if shape is None:
         return False
 
     if pr.role == Role.DM:
         return True
 
-    if not shape.layer.player_editable:
+    if not permission_index.is_layer_editable(shape.layer_id):
         return False
 
     if shape.default_edit_access:
@@ -19,4 +22,4 @@ def has_ownership(shape: Shape, pr: PlayerRoom, movement=False) -> bool:
     if movement and shape.default_movement_access:
         return True
 
-    return ShapeOwner.get_or_none(shape=shape, user=pr.player) is not None
+    return pr.player_id in permission_index.get_owners(shape)
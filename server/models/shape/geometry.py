@@ -0,0 +1,160 @@
+"""
+Vision and movement blocking geometry of a floor.
+
+This is the input of the triangulation the client does for vision and movement
+(see vision/state.ts in the client), prepared for an entire floor at once.
+Every blocking shape is turned into edges the same way the client does it:
+rects and circles as their (rotated) bounding rectangle, lines as a single segment
+and polygons as their vertices, closed unless it is an open polygon.
+
+The edges of all shapes are merged into one (n, 4) array of x1, y1, x2, y2 rows,
+without zero length or duplicate edges and sorted along a Z-order curve,
+so that edges that are close to each other are also close in the array.
+Custom SVG walls of assets are only known to the client and are not part of it.
+
+NumPy is optional and not part of requirements.txt,
+`get_blocker_edges` can only be used when it is installed.
+"""
+
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+__all__ = ["get_blocker_edges", "has_geometry_support"]
+
+
+def has_geometry_support() -> bool:
+    return np is not None
+
+
+def get_blocker_edges(shapes: Iterable[Dict[str, Any]]) -> "np.ndarray":
+    """Edges of the given serialized shapes (see FloorSnapshot)"""
+    rects: List[List[float]] = []
+    lines: List[List[float]] = []
+    polygons: Dict[bool, List[Dict[str, Any]]] = defaultdict(list)
+    for shape in shapes:
+        x, y, angle = shape["x"], shape["y"], shape.get("angle", 0)
+        if "radius" in shape:
+            r = shape["radius"]
+            # The bounding box of a circle does not rotate along with it
+            rects.append([x - r, y - r, 2 * r, 2 * r, 0])
+        elif "width" in shape:
+            if shape["width"] != 0 and shape["height"] != 0:
+                rects.append([x, y, shape["width"], shape["height"], angle])
+        elif "x2" in shape:
+            lines.append([x, y, shape["x2"], shape["y2"], angle])
+        elif "vertices" in shape:
+            polygons[shape.get("open_polygon", False)].append(shape)
+
+    edges = [
+        _get_rect_edges(np.array(rects, dtype=float).reshape(-1, 5)),
+        _get_line_edges(np.array(lines, dtype=float).reshape(-1, 5)),
+        _get_polygon_edges(polygons[False], closed=True),
+        _get_polygon_edges(polygons[True], closed=False),
+    ]
+    return _merge(np.concatenate(edges))
+
+
+def _rotate(x, y, cx, cy, angle):
+    c, s = np.cos(angle), np.sin(angle)
+    dx, dy = x - cx, y - cy
+    return c * dx - s * dy + cx, s * dx + c * dy + cy
+
+
+def _get_rect_edges(rects: "np.ndarray") -> "np.ndarray":
+    x, y, w, h, angle = (rects[:, i : i + 1] for i in range(5))
+    corners_x = np.hstack([x, x, x + w, x + w])
+    corners_y = np.hstack([y, y + h, y + h, y])
+    px, py = _rotate(corners_x, corners_y, x + w / 2, y + h / 2, angle)
+    # Every corner connects to the next one, the last one back to the first
+    qx, qy = np.roll(px, -1, axis=1), np.roll(py, -1, axis=1)
+    return np.stack([px, py, qx, qy], axis=-1).reshape(-1, 4)
+
+
+def _get_line_edges(lines: "np.ndarray") -> "np.ndarray":
+    x1, y1, x2, y2, angle = (lines[:, i] for i in range(5))
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    px, py = _rotate(x1, y1, cx, cy, angle)
+    qx, qy = _rotate(x2, y2, cx, cy, angle)
+    return np.stack([px, py, qx, qy], axis=-1)
+
+
+def _get_polygon_edges(polygons: List[Dict[str, Any]], closed: bool) -> "np.ndarray":
+    if not polygons:
+        return np.empty((0, 4))
+
+    points = np.array(
+        [point for p in polygons for point in ([p["x"], p["y"]], *p["vertices"])],
+        dtype=float,
+    )
+    counts = np.array([len(p["vertices"]) + 1 for p in polygons])
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    angles = np.array([p.get("angle", 0) for p in polygons], dtype=float)
+    if angles.any():
+        # Polygons rotate around the average of their unique vertices
+        centers = np.zeros((len(polygons), 2))
+        for i in np.flatnonzero(angles):
+            polygon = points[starts[i] : starts[i] + counts[i]]
+            centers[i] = np.unique(polygon, axis=0).mean(axis=0)
+        owner = np.repeat(np.arange(len(polygons)), counts)
+        x, y = _rotate(
+            points[:, 0],
+            points[:, 1],
+            centers[owner, 0],
+            centers[owner, 1],
+            angles[owner],
+        )
+        points = np.stack([x, y], axis=-1)
+
+    # Every vertex connects to the next one of the same polygon
+    ends = starts + counts - 1
+    following = np.arange(1, len(points) + 1)
+    following[ends] = starts
+    edges = np.hstack([points, points[following]])
+    if not closed:
+        keep = np.ones(len(points), dtype=bool)
+        keep[ends] = False
+        edges = edges[keep]
+    return edges
+
+
+def _merge(edges: "np.ndarray") -> "np.ndarray":
+    # Same precision as the client uses for its constraints
+    edges = np.round(edges, 10)
+    edges = edges[(edges[:, 0] != edges[:, 2]) | (edges[:, 1] != edges[:, 3])]
+    if len(edges) == 0:
+        return edges
+
+    # Point every edge in the same direction, so that A-B and B-A are the same edge
+    swap = (edges[:, 0] > edges[:, 2]) | (
+        (edges[:, 0] == edges[:, 2]) & (edges[:, 1] > edges[:, 3])
+    )
+    edges[swap] = edges[swap][:, [2, 3, 0, 1]]
+    edges = np.unique(edges, axis=0)
+
+    # Sort on the Z-order curve of the edge midpoints
+    mid_x = (edges[:, 0] + edges[:, 2]) / 2
+    mid_y = (edges[:, 1] + edges[:, 3]) / 2
+    return edges[np.argsort(_z_order(mid_x, mid_y), kind="stable")]
+
+
+def _z_order(x: "np.ndarray", y: "np.ndarray") -> "np.ndarray":
+    def quantize(values: "np.ndarray") -> "np.ndarray":
+        span = values.max() - values.min()
+        scaled = (values - values.min()) / span * 0xFFFF if span else values * 0
+        return scaled.astype(np.uint32)
+
+    def spread(n: "np.ndarray") -> "np.ndarray":
+        # Puts a zero bit in between every bit of the 16 bit values
+        n = (n | (n << 8)) & 0x00FF00FF
+        n = (n | (n << 4)) & 0x0F0F0F0F
+        n = (n | (n << 2)) & 0x33333333
+        return (n | (n << 1)) & 0x55555555
+
+    return spread(quantize(x)) | (spread(quantize(y)) << 1)
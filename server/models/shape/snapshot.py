@@ -0,0 +1,392 @@
+import json
+from collections import defaultdict
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Set, Tuple
+
+from playhouse.shortcuts import model_to_dict
+
+from . import (
+    Aura,
+    CompositeShapeAssociation,
+    Shape,
+    ShapeLabel,
+    ShapeOwner,
+    ToggleComposite,
+    Tracker,
+    dump_options,
+    get_restricted_dict,
+)
+from .geometry import get_blocker_edges
+from .spatial import Bounds, GridIndex, get_shape_bounds
+from ..campaign import Floor, Layer
+from ..groups import Group
+from ..label import Label
+from ..user import User
+
+
+__all__ = ["FloorSnapshot"]
+
+
+class ShapeSnapshot:
+    """
+    Serialized form of a single shape.
+
+    Both the full version (DM and owners) and the restricted version (everyone else)
+    are prepared up front, so picking the right one for a user does not touch the database.
+    """
+
+    __slots__ = ("uuid", "owners", "default_access", "full", "restricted", "_size")
+
+    def __init__(self, shape: Shape, data: Dict[str, Any]):
+        self.uuid: str = shape.uuid
+        self.owners: Set[str] = {o["user"] for o in data["owners"]}
+        self.default_access: bool = (
+            shape.default_edit_access or shape.default_vision_access
+        )
+        self.full = data
+        self.restricted = get_restricted_dict(data)
+        self._size: Optional[int] = None
+
+    @property
+    def size(self) -> int:
+        """Approximate size of the serialized shape in bytes, computed on first use"""
+        if self._size is None:
+            self._size = len(json.dumps(self.full))
+        return self._size
+
+    def update(self, data: Dict[str, Any]) -> None:
+        """
+        Patches fields that are the same for everyone, e.g. the position of the shape.
+        """
+        self.full.update(data)
+        self.restricted.update(data)
+        self._size = None
+
+    def is_owned_by(self, user: User) -> bool:
+        return self.default_access or user.name in self.owners
+
+    def as_dict(self, user: User, dm: bool) -> Dict[str, Any]:
+        if dm or self.is_owned_by(user):
+            return self.full
+        return self.restricted
+
+
+class LayerSnapshot:
+    __slots__ = ("id", "player_visible", "data", "groups", "shapes")
+
+    def __init__(self, layer: Layer):
+        self.id: int = layer.id
+        self.player_visible: bool = layer.player_visible
+        self.data = model_to_dict(
+            layer,
+            recurse=False,
+            backrefs=False,
+            exclude=[Layer.id, Layer.player_visible],
+        )
+        self.groups: List[Dict[str, Any]] = []
+        self.shapes: List[ShapeSnapshot] = []
+
+    def as_dict(self, user: User, dm: bool) -> Dict[str, Any]:
+        return {
+            **self.data,
+            "groups": self.groups,
+            "shapes": [shape.as_dict(user, dm) for shape in self.shapes],
+        }
+
+
+class FloorSnapshot:
+    """
+    Serialized form of a floor with all of its layers and shapes.
+
+    Serializing shapes one by one with Shape.as_dict costs half a dozen queries per shape.
+    A snapshot instead loads everything it needs with a fixed number of queries,
+    independent of the number of shapes on the floor.
+
+    The payload only differs between viewers in the shapes they own,
+    so payloads are built once per viewer class (see `get_viewer_key`) and reused afterwards.
+
+    Alternatively the floor can be sent in chunks starting with the shapes closest
+    to the viewer's viewport (see `as_chunks`), using a spatial index built on first use.
+    """
+
+    def __init__(self, floor: Floor, layers: Optional[List[Layer]] = None):
+        self.id: int = floor.id
+        self.location_id: int = floor.location_id
+        self.data = model_to_dict(
+            floor, recurse=False, exclude=[Floor.id, Floor.location]
+        )
+        if layers is None:
+            layers = list(floor.layers.order_by(Layer.index))
+        self.layers = [LayerSnapshot(layer) for layer in layers]
+        # user name -> shapes only accessible because of an explicit ShapeOwner entry
+        self.owned_shapes: Dict[str, Set[str]] = defaultdict(set)
+        self.shape_ids: Set[str] = set()
+        self.group_ids: Set[str] = set()
+        self.label_ids: Set[str] = set()
+        self._payloads: Dict[Hashable, Dict[str, Any]] = {}
+        # shape uuid -> layer and position of the shape in that layer
+        self._positions: Dict[str, Tuple[LayerSnapshot, int]] = {}
+        # toggle composite uuid -> uuids of its variants
+        self._variants: Dict[str, List[str]] = {}
+        self._index: Optional[GridIndex] = None
+        self._blockers: Dict[bool, Dict[str, bytes]] = {}
+        self._load(floor, layers)
+
+    def get_viewer_key(self, user: User, dm: bool) -> Hashable:
+        if dm:
+            return "dm"
+        return frozenset(self.owned_shapes.get(user.name, ()))
+
+    def as_dict(self, user: User, dm: bool) -> Dict[str, Any]:
+        key = self.get_viewer_key(user, dm)
+        payload = self._payloads.get(key)
+        if payload is None:
+            payload = self._payloads[key] = {
+                **self.data,
+                "layers": [
+                    layer.as_dict(user, dm)
+                    for layer in self.layers
+                    if dm or layer.player_visible
+                ],
+            }
+        return payload
+
+    def as_chunks(
+        self, user: User, dm: bool, viewport: Bounds, max_size: int
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Splits the payload of `as_dict` in chunks of roughly `max_size` bytes of shapes,
+        ordered by their distance to the given viewport.
+        Chunks are only put together when requested,
+        so consumers can hold off on the next chunk until the previous one is handled.
+
+        The first chunk is the floor itself with the closest shapes,
+        the others only contain the name of the floor and the shapes per layer.
+        Every layer lists the position of its shapes next to them,
+        so that the client can restore their order as the chunks come in.
+        Variants of a toggle composite are always sent before the composite itself.
+        """
+        layers = [layer for layer in self.layers if dm or layer.player_visible]
+        visible = {layer.id for layer in layers}
+
+        def get_chunk(uuids: List[str]) -> Dict[int, List[Tuple[int, Any]]]:
+            shapes: Dict[int, List[Tuple[int, Any]]] = defaultdict(list)
+            for uuid in uuids:
+                layer, position = self._positions[uuid]
+                shape = layer.shapes[position].as_dict(user, dm)
+                shapes[layer.id].append((position, shape))
+            return shapes
+
+        def as_layer(layer: LayerSnapshot, chunk: Dict[int, Any]) -> Dict[str, Any]:
+            shapes = sorted(chunk.get(layer.id, []), key=lambda s: s[0])
+            return {
+                "name": layer.data["name"],
+                "shapes": [shape for _, shape in shapes],
+                "indices": [position for position, _ in shapes],
+            }
+
+        first = True
+        for uuids in self._get_chunks(viewport, visible, max_size):
+            chunk = get_chunk(uuids)
+            if first:
+                first = False
+                yield {
+                    **self.data,
+                    "layers": [
+                        {**layer.data, "groups": layer.groups, **as_layer(layer, chunk)}
+                        for layer in layers
+                    ],
+                }
+            else:
+                yield {
+                    "floor": self.data["name"],
+                    "layers": [
+                        as_layer(layer, chunk) for layer in layers if layer.id in chunk
+                    ],
+                }
+        if first:
+            yield self.as_dict(user, dm)
+
+    def get_blockers(self, dm: bool) -> Dict[str, bytes]:
+        """
+        Vision and movement blocking edges of the floor (see models/shape/geometry.py),
+        as little endian float64 x1, y1, x2, y2 values.
+        Players only get the edges of the layers they can see.
+        Requires NumPy.
+        """
+        blockers = self._blockers.get(dm)
+        if blockers is None:
+            shapes = [
+                shape.full
+                for layer in self.layers
+                if dm or layer.player_visible
+                for shape in layer.shapes
+            ]
+            blockers = self._blockers[dm] = {}
+            for target in ("vision", "movement"):
+                edges = get_blocker_edges(
+                    s for s in shapes if s[f"{target}_obstruction"]
+                )
+                blockers[target] = edges.astype("<f8").tobytes()
+        return blockers
+
+    def update_shape(self, uuid: str, data: Dict[str, Any]) -> None:
+        """
+        Patches the serialized shape in place (see ShapeSnapshot.update),
+        cached payloads share the shape dicts and stay valid.
+        """
+        layer, position = self._positions[uuid]
+        shape = layer.shapes[position]
+        shape.update(data)
+        self._index = None
+        if shape.full["vision_obstruction"] or shape.full["movement_obstruction"]:
+            self._blockers.clear()
+
+    def get_layer(self, layer_id: int) -> Optional[LayerSnapshot]:
+        for layer in self.layers:
+            if layer.id == layer_id:
+                return layer
+        return None
+
+    def _get_chunks(
+        self, viewport: Bounds, layer_ids: Set[int], max_size: int
+    ) -> Iterator[List[str]]:
+        if self._index is None:
+            self._index = GridIndex()
+            for layer in self.layers:
+                for shape in layer.shapes:
+                    self._index.add(shape.uuid, get_shape_bounds(shape.full))
+
+        chunk: List[str] = []
+        chunk_size = 0
+        sent: Set[str] = set()
+        for uuid in self._index.nearest(viewport):
+            for shape_id in [*self._variants.get(uuid, ()), uuid]:
+                if shape_id in sent or shape_id not in self._positions:
+                    continue
+                sent.add(shape_id)
+                layer, position = self._positions[shape_id]
+                if layer.id not in layer_ids:
+                    continue
+                chunk.append(shape_id)
+                chunk_size += layer.shapes[position].size
+            if chunk_size >= max_size:
+                yield chunk
+                chunk = []
+                chunk_size = 0
+        if chunk:
+            yield chunk
+
+    def _load(self, floor: Floor, layers: List[Layer]) -> None:
+        layer_ids = [layer.id for layer in layers]
+        if not layer_ids:
+            return
+
+        shapes: List[Shape] = list(
+            Shape.select().where(Shape.layer << layer_ids).order_by(Shape.index)
+        )
+        if not shapes:
+            return
+
+        owners = defaultdict(list)
+        for owner in (
+            ShapeOwner.select(ShapeOwner, User)
+            .join(User)
+            .switch(ShapeOwner)
+            .join(Shape)
+            .where(Shape.layer << layer_ids)
+        ):
+            owners[owner.shape_id].append(owner.as_dict())
+
+        trackers = defaultdict(list)
+        for tracker in Tracker.select().join(Shape).where(Shape.layer << layer_ids):
+            trackers[tracker.shape_id].append(tracker.as_dict())
+
+        auras = defaultdict(list)
+        for aura in Aura.select().join(Shape).where(Shape.layer << layer_ids):
+            auras[aura.shape_id].append(aura.as_dict())
+
+        labels = defaultdict(list)
+        for shape_label in (
+            ShapeLabel.select(ShapeLabel, Label, User)
+            .join(Label)
+            .join(User)
+            .switch(ShapeLabel)
+            .join(Shape)
+            .where(Shape.layer << layer_ids)
+        ):
+            labels[shape_label.shape_id].append(shape_label.as_dict())
+
+        variants = defaultdict(list)
+        if any(shape.type_ == "togglecomposite" for shape in shapes):
+            for association in (
+                CompositeShapeAssociation.select()
+                .join(Shape, on=CompositeShapeAssociation.parent == Shape.uuid)
+                .where(Shape.layer << layer_ids)
+            ):
+                variants[association.parent_id].append(
+                    {"uuid": association.variant_id, "name": association.name}
+                )
+            self._variants = {
+                parent: [variant["uuid"] for variant in parent_variants]
+                for parent, parent_variants in variants.items()
+            }
+
+        # One query per subtype table that is actually in use on this floor
+        subtypes: Dict[str, Dict[str, Any]] = {}
+        for type_ in {shape.type_ for shape in shapes}:
+            table = getattr(Shape, f"{type_}_set").field.model
+            for subtype in table.select().join(Shape).where(Shape.layer << layer_ids):
+                kwargs = {}
+                if table is ToggleComposite:
+                    kwargs["variants"] = variants[subtype.shape_id]
+                subtypes[subtype.shape_id] = subtype.as_dict(
+                    exclude=[table.shape], **kwargs
+                )
+
+        self.group_ids = {
+            shape.group_id for shape in shapes if shape.group_id is not None
+        }
+        groups = {}
+        if self.group_ids:
+            groups = {
+                group.uuid: model_to_dict(group)
+                for group in Group.select().where(Group.uuid << list(self.group_ids))
+            }
+
+        layer_snapshots = {layer.id: layer for layer in self.layers}
+        layer_names = {layer.id: layer.name for layer in layers}
+        layer_groups: Dict[int, Set[str]] = defaultdict(set)
+        for shape in shapes:
+            data = {
+                k: v
+                for k, v in model_to_dict(
+                    shape, recurse=False, exclude=[Shape.layer, Shape.index]
+                ).items()
+                if v is not None
+            }
+            if "options" in data:
+                data["options"] = dump_options(data["options"])
+            data["owners"] = owners[shape.uuid]
+            data["layer"] = layer_names[shape.layer_id]
+            data["floor"] = floor.name
+            data["trackers"] = trackers[shape.uuid]
+            data["auras"] = auras[shape.uuid]
+            data["labels"] = labels[shape.uuid]
+            data.update(**subtypes.get(shape.uuid, {}))
+
+            snapshot = ShapeSnapshot(shape, data)
+            if not snapshot.default_access:
+                for user_name in snapshot.owners:
+                    self.owned_shapes[user_name].add(shape.uuid)
+            self.shape_ids.add(shape.uuid)
+            self.label_ids.update(label["uuid"] for label in data["labels"])
+
+            layer = layer_snapshots[shape.layer_id]
+            self._positions[shape.uuid] = (layer, len(layer.shapes))
+            layer.shapes.append(snapshot)
+            if (
+                shape.group_id in groups
+                and shape.group_id not in layer_groups[shape.layer_id]
+            ):
+                layer_groups[shape.layer_id].add(shape.group_id)
+                layer.groups.append(groups[shape.group_id])
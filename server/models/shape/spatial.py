@@ -0,0 +1,93 @@
+import math
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Set, Tuple
+
+__all__ = ["Bounds", "GridIndex", "get_shape_bounds"]
+
+# min x, min y, max x, max y in world coordinates
+Bounds = Tuple[float, float, float, float]
+
+
+def get_shape_bounds(data: Dict[str, Any]) -> Bounds:
+    """
+    Bounding box of a serialized shape (see FloorSnapshot).
+
+    The subtype is recognized by its fields, rotation is not taken into account.
+    """
+    x, y = data["x"], data["y"]
+    if "radius" in data:
+        r = data["radius"]
+        return (x - r, y - r, x + r, y + r)
+    if "width" in data:
+        x2, y2 = x + data["width"], y + data["height"]
+        return (min(x, x2), min(y, y2), max(x, x2), max(y, y2))
+    if "x2" in data:
+        x2, y2 = data["x2"], data["y2"]
+        return (min(x, x2), min(y, y2), max(x, x2), max(y, y2))
+    if data.get("vertices"):
+        xs = [x, *(v[0] for v in data["vertices"])]
+        ys = [y, *(v[1] for v in data["vertices"])]
+        return (min(xs), min(ys), max(xs), max(ys))
+    return (x, y, x, y)
+
+
+class GridIndex:
+    """
+    Uniform grid over the bounding boxes of shapes.
+
+    A shape is registered in every cell its bounds overlap,
+    so that large shapes (e.g. the map image) are found from anywhere they cover.
+    Shapes that would cover more than `max_cells` cells are kept aside instead.
+    """
+
+    def __init__(self, cell_size: float = 500, max_cells: int = 4096) -> None:
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self._cells: Dict[Tuple[int, int], List[str]] = defaultdict(list)
+        self._large: List[str] = []
+
+    def add(self, uuid: str, bounds: Bounds) -> None:
+        if not all(map(math.isfinite, bounds)):
+            self._large.append(uuid)
+            return
+        x0, y0, x1, y1 = self._get_cells(bounds)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > self.max_cells:
+            self._large.append(uuid)
+            return
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                self._cells[(cx, cy)].append(uuid)
+
+    def nearest(self, bounds: Bounds) -> Iterator[str]:
+        """
+        Yields every shape once, ordered by the distance of its nearest cell to the given area.
+
+        Shapes overlapping the area come first, followed by the surrounding cells ring by ring.
+        Shapes that were kept aside because of their size are always yielded first.
+        """
+        x0, y0, x1, y1 = self._get_cells(bounds)
+
+        def distance(cell: Tuple[int, int]) -> int:
+            dx = max(x0 - cell[0], 0, cell[0] - x1)
+            dy = max(y0 - cell[1], 0, cell[1] - y1)
+            return dx * dx + dy * dy
+
+        seen: Set[str] = set()
+        for uuid in self._large:
+            if uuid not in seen:
+                seen.add(uuid)
+                yield uuid
+        for cell in sorted(self._cells, key=distance):
+            for uuid in self._cells[cell]:
+                if uuid not in seen:
+                    seen.add(uuid)
+                    yield uuid
+
+    def _get_cells(self, bounds: Bounds) -> Tuple[int, int, int, int]:
+        size = self.cell_size
+        return (
+            math.floor(bounds[0] / size),
+            math.floor(bounds[1] / size),
+            math.floor(bounds[2] / size),
+            math.floor(bounds[3] / size),
+        )
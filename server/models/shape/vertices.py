@@ -0,0 +1,31 @@
+"""
+Storage format of Polygon.vertices.
+
+The [x, y] points of a polygon are stored as a flat array of little endian doubles
+(x1, y1, x2, y2, ...) instead of JSON text, which is both smaller
+and a lot cheaper to write on every position update of the polygon.
+Doubles are used so that the points are stored exactly as they were received.
+"""
+
+import sys
+from array import array
+from itertools import chain
+from typing import Iterable, List, Sequence
+
+__all__ = ["pack_vertices", "unpack_vertices"]
+
+
+def pack_vertices(points: Iterable[Sequence[float]]) -> bytes:
+    values = array("d", chain.from_iterable(points))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def unpack_vertices(data: bytes) -> List[List[float]]:
+    values = array("d")
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    pairs = iter(values)
+    return [[x, y] for x, y in zip(pairs, pairs)]
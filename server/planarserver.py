@@ -27,7 +27,11 @@ from aiohttp import web
 import api.http
 import routes
 from state.asset import asset_state
+from state.exports import export_manager
 from state.game import game_state
+from state.initiative import initiative_engine
+from state.shapes import shape_store
+from state.uploads import upload_manager
 
 # Force loading of socketio routes
 from api.socket import *
@@ -35,6 +39,7 @@ from api.socket.constants import GAME_NS
 from app import admin_app, app as main_app, runners, setup_runner, sio
 from config import config
 from models import User, Room
+from models.db import check_pragmas, db_executor
 from utils import logger
 
 loop = asyncio.get_event_loop()
@@ -51,6 +56,10 @@ if sys.platform.startswith("win"):
 async def on_shutdown(_):
     for sid in [*game_state._sid_map.keys(), *asset_state._sid_map.keys()]:
         await sio.disconnect(sid, namespace=GAME_NS)
+    await shape_store.flush()
+    await initiative_engine.flush()
+    upload_manager.clear()
+    export_manager.clear()
 
 
 async def start_http(app: web.Application, host, port):
@@ -144,7 +153,15 @@ def server_main(args):
     if not save_newly_created:
         save.check_outdated()
 
+    check_pragmas()
+    upload_manager.clear()
+    export_manager.clear()
+
     loop.create_task(start_servers())
+    loop.create_task(shape_store.flush_periodically())
+    loop.create_task(initiative_engine.flush_periodically())
+    loop.create_task(upload_manager.expire_periodically())
+    loop.create_task(export_manager.collect_periodically())
 
     try:
         main_app.on_shutdown.append(on_shutdown)
@@ -155,6 +172,7 @@ def server_main(args):
     finally:
         for runner in runners:
             loop.run_until_complete(runner.cleanup())
+        db_executor.stop()
 
 
 def list_main(args):
@@ -214,7 +232,11 @@ def reset_password_main(args):
 
 
 def import_main(args):
-    import_campaign(args.file)
+    def report_progress(done: int, total: int):
+        print(f"\rImporting {args.file}: {done * 100 // max(total, 1)}%", end="")
+
+    import_campaign(args.file, report_progress)
+    print()
 
 
 def add_subcommand(name, func, parent_parser, args):
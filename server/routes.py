@@ -101,6 +101,13 @@ main_app.router.add_patch(
 main_app.router.add_get(
     f"{subpath}/api/rooms/{{creator}}/{{roomname}}/export", api.http.rooms.export
 )
+main_app.router.add_get(
+    f"{subpath}/api/rooms/{{creator}}/{{roomname}}/export/{{uuid}}",
+    api.http.rooms.get_export,
+)
+main_app.router.add_get(
+    f"{subpath}/api/assets/export/{{uuid}}", api.http.assets.get_export
+)
 main_app.router.add_post(f"{subpath}/api/invite", api.http.claim_invite)
 main_app.router.add_get(f"{subpath}/api/version", api.http.version.get_version)
 main_app.router.add_get(f"{subpath}/api/changelog", api.http.version.get_changelog)
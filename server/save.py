@@ -13,13 +13,13 @@ When writing migrations make sure that these things are respected:
     - e.g. a column added to Circle also needs to be added to CircularToken
 """
 
-SAVE_VERSION = 69
+SAVE_VERSION = 72
 
 import json
 import logging
 import os
 import secrets
-import shutil
+import sqlite3
 import sys
 from pathlib import Path
 from uuid import uuid4
@@ -27,6 +27,7 @@ from uuid import uuid4
 from config import SAVE_FILE
 from models import ALL_MODELS, Constants
 from models.db import db
+from models.shape.vertices import pack_vertices
 from utils import OldVersionException, UnknownVersionException
 
 logger: logging.Logger = logging.getLogger("PlanarAllyServer")
@@ -422,6 +423,61 @@ def upgrade(version):
                         "UPDATE shape SET options=? WHERE uuid=?",
                         (json.dumps(unpacked_options), uuid),
                     )
+    elif version == 69:
+        # Change Shape.index to a sparse REAL sort key and index it per layer
+        with db.atomic():
+            db.execute_sql("CREATE TEMPORARY TABLE _shape_69 AS SELECT * FROM shape")
+            db.execute_sql("DROP TABLE shape")
+            db.execute_sql(
+                'CREATE TABLE "shape" ("uuid" TEXT NOT NULL PRIMARY KEY, "layer_id" INTEGER NOT NULL, "type_" TEXT NOT NULL, "x" REAL NOT NULL, "y" REAL NOT NULL, "name" TEXT, "name_visible" INTEGER NOT NULL, "fill_colour" TEXT NOT NULL, "stroke_colour" TEXT NOT NULL, "vision_obstruction" INTEGER NOT NULL, "movement_obstruction" INTEGER NOT NULL, "is_token" INTEGER NOT NULL, "annotation" TEXT NOT NULL, "draw_operator" TEXT NOT NULL, "index" REAL NOT NULL, "options" TEXT, "badge" INTEGER NOT NULL, "show_badge" INTEGER NOT NULL, "default_edit_access" INTEGER NOT NULL, "default_vision_access" INTEGER NOT NULL, "is_invisible" INTEGER NOT NULL, "is_defeated" INTEGER NOT NULL, "default_movement_access" INTEGER NOT NULL, "is_locked" INTEGER NOT NULL, "angle" REAL NOT NULL, "stroke_width" INTEGER NOT NULL, "asset_id" INTEGER, "group_id" TEXT, "annotation_visible" INTEGER NOT NULL, "ignore_zoom_size" INTEGER NOT NULL, "is_door" INTEGER NOT NULL DEFAULT 0, "is_teleport_zone" INTEGER NOT NULL DEFAULT 0, FOREIGN KEY ("layer_id") REFERENCES "layer" ("id") ON DELETE CASCADE, FOREIGN KEY ("asset_id") REFERENCES "asset" ("id"), FOREIGN KEY ("group_id") REFERENCES "group" ("uuid"))'
+            )
+            db.execute_sql(
+                'INSERT INTO "shape" ("uuid", layer_id, type_, x, y, name, name_visible, fill_colour, stroke_colour, vision_obstruction, movement_obstruction, is_token, annotation, draw_operator, "index", options, badge, show_badge, default_edit_access, default_vision_access, is_invisible, is_defeated, default_movement_access, is_locked, angle, stroke_width, asset_id, group_id, annotation_visible, ignore_zoom_size, is_door, is_teleport_zone) SELECT "uuid", layer_id, type_, x, y, name, name_visible, fill_colour, stroke_colour, vision_obstruction, movement_obstruction, is_token, annotation, draw_operator, "index", options, badge, show_badge, default_edit_access, default_vision_access, is_invisible, is_defeated, default_movement_access, is_locked, angle, stroke_width, asset_id, group_id, annotation_visible, ignore_zoom_size, is_door, is_teleport_zone FROM _shape_69'
+            )
+            db.execute_sql("DROP TABLE _shape_69")
+            db.execute_sql('CREATE INDEX "shape_layer_id" ON "shape" ("layer_id")')
+            db.execute_sql('CREATE INDEX "shape_asset_id" ON "shape" ("asset_id")')
+            db.execute_sql('CREATE INDEX "shape_group_id" ON "shape" ("group_id")')
+            db.execute_sql(
+                'CREATE INDEX "shape_layer_id_index" ON "shape" ("layer_id", "index")'
+            )
+    elif version == 70:
+        # Store Polygon.vertices as packed doubles instead of JSON text
+        with db.atomic():
+            db.execute_sql(
+                "CREATE TEMPORARY TABLE _polygon_70 AS SELECT * FROM polygon"
+            )
+            db.execute_sql("DROP TABLE polygon")
+            db.execute_sql(
+                'CREATE TABLE "polygon" ("shape_id" TEXT NOT NULL PRIMARY KEY, "vertices" BLOB NOT NULL, "line_width" INTEGER NOT NULL, "open_polygon" INTEGER NOT NULL, FOREIGN KEY ("shape_id") REFERENCES "shape" ("uuid") ON DELETE CASCADE)'
+            )
+            data = db.execute_sql(
+                "SELECT shape_id, vertices, line_width, open_polygon FROM _polygon_70"
+            )
+            for row in data.fetchall():
+                shape_id, vertices, line_width, open_polygon = row
+                db.execute_sql(
+                    "INSERT INTO polygon (shape_id, vertices, line_width, open_polygon) VALUES (?, ?, ?, ?)",
+                    (
+                        shape_id,
+                        pack_vertices(json.loads(vertices)),
+                        line_width,
+                        open_polygon,
+                    ),
+                )
+            db.execute_sql("DROP TABLE _polygon_70")
+    elif version == 71:
+        # Store Shape.options as a JSON object instead of a list of [key, value] pairs
+        with db.atomic():
+            data = db.execute_sql(
+                "SELECT uuid, options FROM shape WHERE options IS NOT NULL"
+            )
+            for row in data.fetchall():
+                uuid, options = row
+                db.execute_sql(
+                    "UPDATE shape SET options=json(?) WHERE uuid=?",
+                    (json.dumps(dict(json.loads(options))), uuid),
+                )
     else:
         raise UnknownVersionException(
             f"No upgrade code for save format {version} was found."
@@ -430,6 +486,26 @@ def upgrade(version):
     db.foreign_keys = True
 
 
+def backup_save(backup_path: Path):
+    """
+    Copy the save file using SQLite's backup API.
+
+    In WAL mode the main save file alone is not guaranteed to contain all committed data,
+    some of it can still live in the -wal file. The backup API takes care of this and
+    produces a single self-contained file.
+    """
+    for suffix in ("-wal", "-shm"):
+        stale = Path(f"{backup_path}{suffix}")
+        if stale.exists():
+            stale.unlink()
+
+    target = sqlite3.connect(str(backup_path))
+    try:
+        db.connection().backup(target)
+    finally:
+        target.close()
+
+
 def check_outdated():
     try:
         save_version = get_save_version()
@@ -450,7 +526,7 @@ def check_outdated():
             save_backups.mkdir()
         backup_path = save_backups.resolve() / f"{Path(SAVE_FILE).name}.{save_version}"
         logger.warning(f"Backing up old save as {backup_path}")
-        shutil.copyfile(SAVE_FILE, backup_path)
+        backup_save(backup_path)
         logger.warning(f"Starting upgrade to {save_version + 1}")
         try:
             upgrade(save_version)
@@ -0,0 +1,80 @@
+"""
+Compares the payload size and encode time of the JSON and msgpack encodings
+of the game namespace (see api/socket/encoding.py) on the layers in your save file.
+
+The largest layers are serialized with Layer.as_dict, as they would be sent to a DM
+loading the location, and then encoded as JSON, as plain msgpack
+and as msgpack with interned keys (the encoding used by the server).
+
+Usage: `python scripts/benchmark_encoding.py [--layers N] [--repeat N]` from the server folder
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+# Insert parent folder in the lookup
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import msgpack
+from peewee import fn
+
+from api.socket.encoding import pack
+from models import Floor, Layer, Location, Room, Shape
+
+
+def measure(encode: Callable[[Any], Any], data: Any, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encoded = encode(data)
+    elapsed = (time.perf_counter() - start) / repeat
+    return len(encoded), elapsed * 1000
+
+
+def benchmark(layer_count: int, repeat: int):
+    layers = (
+        Layer.select(Layer, fn.COUNT(Shape.uuid).alias("shape_count"))
+        .join(Shape)
+        .group_by(Layer.id)
+        .order_by(fn.COUNT(Shape.uuid).desc())
+        .limit(layer_count)
+    )
+
+    encoders = {
+        "json": lambda d: json.dumps(d).encode("utf-8"),
+        "msgpack": msgpack.packb,
+        "msgpack+keys": pack,
+    }
+
+    print(f"{'layer':<30}{'shapes':>8}", end="")
+    for name in encoders:
+        print(f"{name + ' KB':>16}{'ms':>8}", end="")
+    print()
+
+    for layer in layers:
+        creator = (
+            Room.select(Room.creator)
+            .join(Location)
+            .join(Floor)
+            .where(Floor.id == layer.floor_id)
+            .get()
+            .creator
+        )
+        data = layer.as_dict(creator, True)
+        print(
+            f"{layer.floor.name + '/' + layer.name:<30}{layer.shape_count:>8}", end=""
+        )
+        for encode in encoders.values():
+            size, ms = measure(encode, data, repeat)
+            print(f"{size / 1024:>16.1f}{ms:>8.2f}", end="")
+        print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--layers", type=int, default=5, help="Amount of layers")
+    parser.add_argument("--repeat", type=int, default=10, help="Encodes per layer")
+    args = parser.parse_args()
+    benchmark(args.layers, args.repeat)
@@ -1,5 +1,7 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Generator, Generic, Tuple, TypeVar
+from typing import Any, Dict, Generator, Generic, Set, Tuple, TypeVar
+
+from peewee import Model
 
 from models import User
 
@@ -8,13 +10,24 @@ T = TypeVar("T")
 
 
 class State(ABC, Generic[T]):
+    # Foreign keys of the stored values that get_sids can resolve without scanning all sids
+    indexed_fields: Tuple[str, ...] = ()
+
     def __init__(self) -> None:
         self._sid_map: Dict[str, T] = {}
+        # field -> foreign key id -> sids
+        self._indices: Dict[str, Dict[Any, Set[str]]] = {
+            field: {} for field in self.indexed_fields
+        }
+        # sid -> field -> foreign key id the sid is currently indexed under
+        self._sid_keys: Dict[str, Dict[str, Any]] = {}
 
     async def add_sid(self, sid: str, value: T) -> None:
         self._sid_map[sid] = value
+        self.reindex_sid(sid)
 
     async def remove_sid(self, sid: str) -> None:
+        self._unindex_sid(sid)
         del self._sid_map[sid]
 
     def has_sid(self, sid: str) -> bool:
@@ -27,13 +40,46 @@ class State(ABC, Generic[T]):
     def get_user(self, sid: str) -> User:
         pass
 
+    def reindex_sid(self, sid: str) -> None:
+        """
+        Updates the indices for the given sid.
+        This must be called whenever one of the indexed fields of its value changes.
+        """
+        self._unindex_sid(sid)
+        value = self._sid_map[sid]
+        keys = self._sid_keys[sid] = {}
+        for field, index in self._indices.items():
+            key = keys[field] = getattr(value, f"{field}_id")
+            index.setdefault(key, set()).add(sid)
+
+    def _unindex_sid(self, sid: str) -> None:
+        for field, key in self._sid_keys.pop(sid, {}).items():
+            sids = self._indices[field][key]
+            sids.discard(sid)
+            if not sids:
+                del self._indices[field][key]
+
     def get_sids(self, skip_sid=None, **options) -> Generator[str, None, None]:
-        for sid, value in dict(self._sid_map).items():
-            if skip_sid == sid:
+        indexed: Dict[str, Set[str]] = {}
+        for option, value in options.items():
+            if option in self._indices:
+                key = value.get_id() if isinstance(value, Model) else value
+                indexed[option] = self._indices[option].get(key, set())
+
+        if indexed:
+            smallest: Set[str] = min(indexed.values(), key=len)
+            candidates = list(smallest)
+        else:
+            candidates = list(self._sid_map)
+
+        for sid in candidates:
+            if skip_sid == sid or sid not in self._sid_map:
                 continue
 
             if all(
-                getattr(self.get(sid), option, None) == value
+                sid in indexed[option]
+                if option in indexed
+                else getattr(self.get(sid), option, None) == value
                 for option, value in options.items()
             ):
                 yield sid
@@ -1,18 +1,41 @@
+from collections import defaultdict
 from typing import Any, Dict
 
 from . import State
 from app import app
-from models import User
+from models import Asset, User
+from models.db import db_executor
 
 
 class AssetState(State[User]):
     def __init__(self) -> None:
         super().__init__()
-        self.pending_file_upload_cache: Dict[str, Any] = {}
+        # user id -> asset structure as sent to game clients (see Asset.get_user_structure)
+        self._structures: Dict[int, Dict[str, Any]] = {}
+        # Bumped on every invalidation, used to detect structures that went stale while being built
+        self._structure_versions: Dict[int, int] = defaultdict(int)
 
     def get_user(self, sid: str) -> User:
         return self._sid_map[sid]
 
+    async def get_structure(self, user: User) -> Dict[str, Any]:
+        structure = self._structures.get(user.id, None)
+        if structure is not None:
+            return structure
+
+        version = self._structure_versions[user.id]
+        built: Dict[str, Any] = await db_executor.run(Asset.get_user_structure, user)
+        if version == self._structure_versions[user.id]:
+            self._structures[user.id] = built
+        return built
+
+    def invalidate_structure(self, user: User) -> None:
+        """
+        Has to be called by everything that changes the assets of a user.
+        """
+        self._structure_versions[user.id] += 1
+        self._structures.pop(user.id, None)
+
 
 asset_state = AssetState()
 app["state"]["asset"] = asset_state
@@ -0,0 +1,198 @@
+import asyncio
+import multiprocessing
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Awaitable, Dict, List, Optional
+from uuid import uuid4
+
+from app import sio
+from config import config
+from export.assets import COMPRESSION_MODES, build_asset_archive, init_worker
+from export.campaign import export_campaign
+from models import Room
+from models.db import db_executor
+from utils import ASSETS_DIR, FILE_DIR, logger
+from .shapes import shape_store
+
+EXPORTS_DIR = FILE_DIR / "exports"
+if not EXPORTS_DIR.exists():
+    EXPORTS_DIR.mkdir()
+
+
+class ExportJob:
+    def __init__(self, user_id: int, sid: Optional[str], name: str) -> None:
+        self.uuid = str(uuid4())
+        self.user_id = user_id
+        # Socket to report progress to, jobs started over HTTP are polled instead
+        self.sid = sid
+        self.name = name
+        self.path = EXPORTS_DIR / f"{self.uuid}{Path(name).suffix}"
+        self.done = False
+        self.failed = False
+        self.finished_at = 0.0
+
+    @property
+    def running(self) -> bool:
+        return not (self.done or self.failed)
+
+
+class ExportManager:
+    """
+    Builds exports in the background, so that large exports do not block the event loop.
+
+    Asset exports are compressed in a pool of worker processes and report their progress
+    to the requesting client over the asset socket.
+    Campaign exports need the database and run on the database thread instead.
+    Finished exports are downloaded over HTTP and removed `export_retention` seconds later.
+    """
+
+    def __init__(self) -> None:
+        self._jobs: Dict[str, ExportJob] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._progress: "Optional[multiprocessing.Queue[Any]]" = None
+        self._progress_task: "Optional[asyncio.Task[None]]" = None
+        self.workers = config.getint("Webserver", "export_workers", fallback=1)
+        self.retention = config.getfloat(
+            "Webserver", "export_retention", fallback=3600.0
+        )
+        self.compression = config.get("Webserver", "export_compression", fallback="gz")
+        if self.compression not in COMPRESSION_MODES:
+            logger.warning(
+                f"Unknown export compression {self.compression}, falling back to gz"
+            )
+            self.compression = "gz"
+        self.compression_level = config.getint(
+            "Webserver", "export_compression_level", fallback=6
+        )
+
+    def get(self, uuid: str) -> Optional[ExportJob]:
+        return self._jobs.get(uuid, None)
+
+    def start(
+        self,
+        user_id: int,
+        sid: str,
+        json_data: str,
+        file_hashes: List[str],
+        compression: Optional[str] = None,
+    ) -> ExportJob:
+        if compression not in COMPRESSION_MODES:
+            compression = self.compression
+
+        job = ExportJob(user_id, sid, "assets.paa")
+        self._jobs[job.uuid] = job
+
+        future = self._get_executor().submit(
+            build_asset_archive,
+            job.uuid,
+            job.path,
+            ASSETS_DIR,
+            json_data,
+            file_hashes,
+            compression,
+            self.compression_level,
+        )
+        asyncio.ensure_future(self._wait(job, asyncio.wrap_future(future)))
+        if self._progress_task is None or self._progress_task.done():
+            self._progress_task = asyncio.ensure_future(self._forward_progress())
+        return job
+
+    def start_campaign(self, user_id: int, room: Room) -> ExportJob:
+        job = ExportJob(user_id, None, f"{room.name}-{room.creator.name}.json")
+        self._jobs[job.uuid] = job
+        asyncio.ensure_future(self._wait(job, self._export_campaign(room, job.path)))
+        return job
+
+    async def _export_campaign(self, room: Room, path: Path) -> None:
+        # Changes that are only in memory so far would be missing from the export
+        await shape_store.flush()
+        await db_executor.run(export_campaign, room, path)
+
+    def collect_garbage(self) -> None:
+        deadline = time.time() - self.retention
+        for job in list(self._jobs.values()):
+            if not job.running and job.finished_at < deadline:
+                self._remove(job)
+
+    def clear(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._jobs.clear()
+        # Also removes leftovers of a previous run
+        for path in EXPORTS_DIR.iterdir():
+            path.unlink()
+
+    async def collect_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(max(self.retention / 4, 60))
+            self.collect_garbage()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._progress = multiprocessing.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=init_worker,
+                initargs=(self._progress,),
+            )
+        return self._executor
+
+    async def _wait(self, job: ExportJob, future: Awaitable[None]) -> None:
+        try:
+            await future
+        except Exception:
+            logger.exception(f"Export of {job.name} failed")
+            job.failed = True
+        else:
+            job.done = True
+        job.finished_at = time.time()
+
+        if job.failed:
+            # The job itself is kept around until garbage collection, so that it can be polled
+            self._remove_file(job)
+
+        if job.sid is None:
+            return
+        if job.failed:
+            await self._emit(job, "Asset.Export.Fail", job.uuid)
+        else:
+            await self._emit(job, "Asset.Export.Finish", job.uuid)
+
+    async def _forward_progress(self) -> None:
+        while any(job.running for job in self._jobs.values()):
+            await asyncio.sleep(0.25)
+            while self._progress is not None:
+                try:
+                    uuid, done, total = self._progress.get_nowait()
+                except queue.Empty:
+                    break
+                job = self._jobs.get(uuid, None)
+                if job is None or not job.running:
+                    continue
+                await self._emit(
+                    job,
+                    "Asset.Export.Progress",
+                    {"uuid": uuid, "done": done, "total": total},
+                )
+
+    async def _emit(self, job: ExportJob, event: str, data: Any) -> None:
+        # The socket package imports this module, so import its namespace lazily
+        from api.socket.constants import ASSET_NS
+
+        await sio.emit(event, data, room=job.sid, namespace=ASSET_NS)
+
+    def _remove(self, job: ExportJob) -> None:
+        self._jobs.pop(job.uuid, None)
+        self._remove_file(job)
+
+    def _remove_file(self, job: ExportJob) -> None:
+        try:
+            job.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+export_manager = ExportManager()
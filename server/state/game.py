@@ -1,25 +1,93 @@
-from typing import Dict, Set
+from typing import Dict, NamedTuple, Set
 
 from . import State
 from api.socket.constants import GAME_NS
 from app import app, sio
 from data_types.location import LocationOptions
-from models import PlayerRoom, User
+from models import Location, PlayerRoom, Room, User
+from models.role import Role
+from .initiative import initiative_engine
+from .permissions import permission_index
+from .shapes import shape_store
+from .snapshots import snapshot_cache
+
+
+class Session(NamedTuple):
+    """
+    Pre-resolved information about a connected client.
+    Hot paths should use this instead of following foreign keys on the PlayerRoom.
+    """
+
+    player_id: int
+    player_name: str
+    room_id: int
+    room_path: str
+    location_id: int
+    location_path: str
+    role: Role
 
 
 class GameState(State[PlayerRoom]):
+    indexed_fields = ("room", "active_location", "player")
+
     def __init__(self) -> None:
         super().__init__()
+        self._sessions: Dict[str, Session] = {}
         self.client_temporaries: Dict[str, Set[str]] = {}
         self.client_locations: Dict[str, LocationOptions] = {}
 
     def get_user(self, sid: str) -> User:
         return self._sid_map[sid].player
 
+    def get_session(self, sid: str) -> Session:
+        return self._sessions[sid]
+
     async def remove_sid(self, sid: str) -> None:
+        location_id = self._sid_map[sid].active_location_id
         await self.clear_temporaries(sid)
-        del self.client_locations[sid]
+        # Only known once the client reported its viewport
+        self.client_locations.pop(sid, None)
+        del self._sessions[sid]
         await super().remove_sid(sid)
+        self.release_location(location_id)
+
+    def reindex_sid(self, sid: str) -> None:
+        """
+        Updates the indices and the session record of the given sid.
+        This must be called whenever the location or role of its PlayerRoom changes.
+        """
+        super().reindex_sid(sid)
+        pr = self._sid_map[sid]
+        # Resolve location, room and room creator in one go
+        # and hand them to the PlayerRoom so that its own FK accesses are free as well.
+        location = (
+            Location.select(Location, Room, User)
+            .join(Room)
+            .join(User)
+            .where(Location.id == pr.active_location_id)
+            .get()
+        )
+        pr.active_location = location
+        permission_index.load_location(location.id)
+        self._sessions[sid] = Session(
+            player_id=pr.player_id,
+            player_name=pr.player.name,
+            room_id=pr.room_id,
+            room_path=location.room.get_path(),
+            location_id=location.id,
+            location_path=location.get_path(),
+            role=Role(pr.role),
+        )
+
+    def release_location(self, location_id: int) -> None:
+        """
+        Unloads the in-memory state of a location once no client is using it anymore.
+        """
+        if location_id not in self._indices["active_location"]:
+            shape_store.unload_location(location_id)
+            permission_index.unload_location(location_id)
+            snapshot_cache.invalidate_location(location_id)
+            initiative_engine.unload(location_id)
 
     async def clear_temporaries(self, sid: str) -> None:
         if sid in self.client_temporaries:
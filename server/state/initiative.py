@@ -0,0 +1,217 @@
+import asyncio
+import json
+from typing import Any, Dict, List, Mapping, Optional
+
+from config import config
+from models import Initiative
+from .write_behind import WriteBehind
+
+
+def sort_initiative(data: List[Dict[str, Any]], sort: int) -> List[Dict[str, Any]]:
+    if sort == 2:
+        return data
+    return sorted(data, key=lambda x: x.get("initiative", 0) or 0, reverse=sort == 0)
+
+
+class LocationInitiative:
+    """
+    Initiative tracker of a single location.
+
+    The actors are kept both in turn order and indexed by shape.
+    Round, turn and sort are plain columns that are saved on their own,
+    the actor json blob is only rewritten when one of the actors actually changed.
+    """
+
+    def __init__(self, model: Initiative) -> None:
+        self.model = model
+        self.actors: List[Dict[str, Any]] = json.loads(model.data)
+        self._index: Dict[str, Dict[str, Any]] = {a["shape"]: a for a in self.actors}
+        self.actors_changed = False
+
+    @property
+    def turn(self) -> int:
+        return self.model.turn
+
+    @property
+    def round(self) -> int:
+        return self.model.round
+
+    @property
+    def sort(self) -> int:
+        return self.model.sort
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "location": self.model.location_id,
+            "round": self.model.round,
+            "turn": self.model.turn,
+            "sort": self.model.sort,
+            "data": self.actors,
+        }
+
+    def get(self, shape: str) -> Optional[Dict[str, Any]]:
+        return self._index.get(shape, None)
+
+    def get_current_actor(self) -> Optional[Dict[str, Any]]:
+        if 0 <= self.model.turn < len(self.actors):
+            return self.actors[self.model.turn]
+        return None
+
+    def add(self, data: Mapping[str, Any]) -> Dict[str, Any]:
+        actor = self._index.get(data["shape"], None)
+        if actor is None:
+            actor = self._index[data["shape"]] = dict(data)
+            self.actors.append(actor)
+        else:
+            actor.update(**data)
+        self.actors_changed = True
+        return actor
+
+    def remove(self, shape: str) -> None:
+        actor = self._index.pop(shape, None)
+        if actor is not None:
+            self.actors.remove(actor)
+            self.actors_changed = True
+
+    def set_value(self, shape: str, value: Optional[int]) -> bool:
+        actor = self._index.get(shape, None)
+        if actor is None:
+            return False
+        actor["initiative"] = value
+        self.apply_sort()
+        return True
+
+    def set_option(self, shape: str, option: str, value: Any) -> bool:
+        actor = self._index.get(shape, None)
+        if actor is None:
+            return False
+        actor[option] = value
+        self.actors_changed = True
+        return True
+
+    def clear_values(self) -> None:
+        for actor in self.actors:
+            actor["initiative"] = None
+        self.actors_changed = True
+
+    def change_order(self, shape: str, old_index: int, new_index: int) -> bool:
+        size = len(self.actors)
+        if not (0 <= old_index < size and 0 <= new_index < size):
+            return False
+        if self.actors[old_index]["shape"] != shape:
+            return False
+
+        if self.actors[new_index].get("initiative", 0) != self.actors[old_index].get(
+            "initiative", 0
+        ):
+            self.model.sort = 2
+
+        self.actors.insert(new_index, self.actors.pop(old_index))
+        self.apply_sort()
+        return True
+
+    def set_sort(self, sort: int) -> None:
+        self.model.sort = sort
+        self.apply_sort()
+
+    def apply_sort(self) -> None:
+        self.actors[:] = sort_initiative(self.actors, self.model.sort)
+        self.actors_changed = True
+
+    def set_turn(self, turn: int) -> None:
+        next_turn = turn > self.model.turn
+        self.model.turn = turn
+
+        effects = self.actors[turn]["effects"]
+        for i, effect in enumerate(effects[-1:]):
+            try:
+                turns = int(effect["turns"])
+                if turns <= 0 and next_turn:
+                    effects.pop(i)
+                elif turns > 0 and next_turn:
+                    effect["turns"] = str(turns - 1)
+                else:
+                    effect["turns"] = str(turns + 1)
+            except ValueError:
+                # For non-number inputs do not update the effect
+                pass
+        self.actors_changed = True
+
+    def set_round(self, round: int) -> None:
+        self.model.round = round
+
+    def get_effects(self, shape: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Effects of the given actor, callers that modify the list have to call `mark_effects_changed`.
+        """
+        actor = self._index.get(shape, None)
+        if actor is None:
+            return None
+        return actor["effects"]
+
+    def mark_effects_changed(self) -> None:
+        self.actors_changed = True
+
+
+class InitiativeEngine:
+    """
+    In-memory initiative trackers of the loaded locations.
+
+    Handlers mutate the tracker and call `mark_dirty`, changes are written to the database
+    in one go on the database thread every `flush_interval` seconds (see the Database config section)
+    and on shutdown.
+    """
+
+    def __init__(self) -> None:
+        self._locations: Dict[int, LocationInitiative] = {}
+        self._dirty = WriteBehind("initiative", prepare=self._serialize_actors)
+        self.flush_interval = config.getfloat(
+            "Database", "flush_interval", fallback=1.0
+        )
+
+    def get(self, location_id: int) -> Optional[LocationInitiative]:
+        initiative = self._locations.get(location_id, None)
+        if initiative is None:
+            model = Initiative.get_or_none(location=location_id)
+            if model is None:
+                return None
+            initiative = self._locations[location_id] = LocationInitiative(model)
+        return initiative
+
+    def get_or_create(self, location_id: int) -> LocationInitiative:
+        initiative = self.get(location_id)
+        if initiative is None:
+            model = Initiative.create(location=location_id, round=0, turn=0, data="[]")
+            initiative = self._locations[location_id] = LocationInitiative(model)
+        return initiative
+
+    def mark_dirty(self, initiative: LocationInitiative) -> None:
+        self._dirty.mark_dirty(initiative.model)
+
+    def unload(self, location_id: int) -> None:
+        """
+        Forget about the tracker of the location, pending changes are still written by the next flush.
+        """
+        initiative = self._locations.pop(location_id, None)
+        if initiative is not None and initiative.model in self._dirty:
+            self._serialize_actors(initiative.model, initiative)
+
+    async def flush(self) -> None:
+        await self._dirty.flush()
+
+    async def flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _serialize_actors(
+        self, model: Initiative, initiative: Optional[LocationInitiative] = None
+    ) -> None:
+        if initiative is None:
+            initiative = self._locations.get(model.location_id, None)
+        if initiative is not None and initiative.actors_changed:
+            model.data = json.dumps(initiative.actors)
+            initiative.actors_changed = False
+
+
+initiative_engine = InitiativeEngine()
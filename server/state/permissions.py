@@ -0,0 +1,183 @@
+from typing import Dict, NamedTuple, Optional, Set
+
+from playhouse.signals import post_save, pre_delete
+
+from models import Floor, Layer, Shape, ShapeOwner
+from models.db import on_loop
+
+
+class OwnerAccess(NamedTuple):
+    edit_access: bool
+    movement_access: bool
+    vision_access: bool
+
+
+class LayerAccess(NamedTuple):
+    location_id: int
+    player_editable: bool
+
+
+class PermissionIndex:
+    """
+    In-memory copy of the data needed to decide whether a player has access to a shape.
+
+    Locations are loaded once a client enters them (see GameState.reindex_sid)
+    and unloaded together with the shape store.
+    Lookups for locations that no client is using are answered from the database without caching them.
+    The default access flags are not duplicated here, they are read from the shape itself.
+    """
+
+    def __init__(self) -> None:
+        self._layers: Dict[int, LayerAccess] = {}
+        # shape uuid -> user id -> access, contains every shape of the loaded locations
+        self._owners: Dict[str, Dict[int, OwnerAccess]] = {}
+        self._location_shapes: Dict[int, Set[str]] = {}
+
+    def load_location(self, location_id: int) -> None:
+        if location_id in self._location_shapes:
+            return
+
+        self._location_shapes[location_id] = set()
+
+        layer_ids = []
+        for layer in (
+            Layer.select(Layer.id, Layer.player_editable)
+            .join(Floor)
+            .where(Floor.location == location_id)
+        ):
+            layer_ids.append(layer.id)
+            self._layers[layer.id] = LayerAccess(location_id, layer.player_editable)
+
+        for shape in Shape.select(Shape.uuid).where(Shape.layer << layer_ids):
+            self._add_shape(location_id, shape.uuid)
+
+        for owner in (
+            ShapeOwner.select()
+            .join(Shape)
+            .join(Layer)
+            .join(Floor)
+            .where(Floor.location == location_id)
+        ):
+            self._set_owner(owner)
+
+    def unload_location(self, location_id: int) -> None:
+        for uuid in self._location_shapes.pop(location_id, ()):
+            self._owners.pop(uuid, None)
+        self._layers = {
+            layer_id: layer
+            for layer_id, layer in self._layers.items()
+            if layer.location_id != location_id
+        }
+
+    def is_layer_editable(self, layer_id: int) -> bool:
+        layer = self._get_layer(layer_id)
+        return layer is not None and layer.player_editable
+
+    def get_owners(self, shape: Shape) -> Dict[int, OwnerAccess]:
+        owners = self._owners.get(shape.uuid, None)
+        if owners is None:
+            # A shape of a location that is not loaded or that was added after its location was loaded
+            owners = {
+                owner.user_id: self._get_access(owner)
+                for owner in ShapeOwner.select().where(ShapeOwner.shape == shape.uuid)
+            }
+            layer = self._get_layer(shape.layer_id)
+            if layer is not None and layer.location_id in self._location_shapes:
+                self._add_shape(layer.location_id, shape.uuid)
+                self._owners[shape.uuid] = owners
+        return owners
+
+    def remove_owner(self, shape_id: str, user_id: int) -> None:
+        owners = self._owners.get(shape_id, None)
+        if owners is not None:
+            owners.pop(user_id, None)
+
+    def _get_layer(self, layer_id: int) -> Optional[LayerAccess]:
+        layer = self._layers.get(layer_id, None)
+        if layer is None:
+            row = (
+                Layer.select(Floor.location, Layer.player_editable)
+                .join(Floor)
+                .where(Layer.id == layer_id)
+                .tuples()
+                .first()
+            )
+            if row is None:
+                return None
+            layer = LayerAccess(*row)
+            if layer.location_id in self._location_shapes:
+                self._layers[layer_id] = layer
+        return layer
+
+    def _add_shape(self, location_id: int, uuid: str) -> None:
+        if uuid not in self._owners:
+            self._location_shapes[location_id].add(uuid)
+            self._owners[uuid] = {}
+
+    def _set_owner(self, owner: ShapeOwner) -> None:
+        owners = self._owners.get(owner.shape_id, None)
+        if owners is not None:
+            owners[owner.user_id] = self._get_access(owner)
+
+    @staticmethod
+    def _get_access(owner: ShapeOwner) -> OwnerAccess:
+        return OwnerAccess(
+            owner.edit_access, owner.movement_access, owner.vision_access
+        )
+
+    def _forget_shape(self, uuid: str) -> None:
+        if self._owners.pop(uuid, None) is None:
+            return
+        for shapes in self._location_shapes.values():
+            shapes.discard(uuid)
+
+
+permission_index = PermissionIndex()
+
+
+# Keep the index coherent with changes made through model instances.
+# Bulk queries (e.g. ShapeOwner.delete()) have to update the index themselves.
+
+
+@post_save(sender=ShapeOwner)
+@on_loop
+def on_shape_owner_save(model_class, instance: ShapeOwner, created: bool):
+    permission_index._set_owner(instance)
+
+
+@pre_delete(sender=ShapeOwner)
+@on_loop
+def on_shape_owner_delete(model_class, instance: ShapeOwner):
+    permission_index.remove_owner(instance.shape_id, instance.user_id)
+
+
+@post_save(sender=Shape)
+@on_loop
+def on_shape_created(model_class, instance: Shape, created: bool):
+    if not created:
+        return
+    layer = permission_index._layers.get(instance.layer_id, None)
+    if layer is not None:
+        permission_index._add_shape(layer.location_id, instance.uuid)
+
+
+@pre_delete(sender=Shape)
+@on_loop
+def on_shape_removed(model_class, instance: Shape):
+    permission_index._forget_shape(instance.uuid)
+
+
+@post_save(sender=Layer)
+@on_loop
+def on_layer_save(model_class, instance: Layer, created: bool):
+    layer = permission_index._layers.get(instance.id, None)
+    if layer is not None:
+        permission_index._layers[instance.id] = LayerAccess(
+            layer.location_id, instance.player_editable
+        )
+    elif created:
+        location_id = instance.floor.location_id
+        if location_id in permission_index._location_shapes:
+            permission_index._layers[instance.id] = LayerAccess(
+                location_id, instance.player_editable
+            )
@@ -0,0 +1,71 @@
+import asyncio
+from typing import Any, Dict, Mapping, Sequence, Tuple
+
+from api.socket.constants import GAME_NS
+from app import sio
+from config import config
+
+
+class PositionBroadcaster:
+    """
+    Coalesces Shapes.Position.Update broadcasts.
+
+    While dragging, clients send position updates far more often than other clients need them.
+    Updates are buffered per location room and sender for `interval` seconds,
+    after which only the latest position of every shape is broadcast.
+
+    Final (non temporary) positions are broadcast right away, together with anything still pending
+    for that sender, so that they can't arrive after events that follow them (e.g. Shapes.Remove).
+    """
+
+    def __init__(self) -> None:
+        self.interval = config.getfloat(
+            "Webserver", "position_update_interval", fallback=0.04
+        )
+        # (room, sender sid) -> shape uuid -> latest update
+        self._pending: Dict[Tuple[str, str], Dict[str, Mapping[str, Any]]] = {}
+
+    async def queue(
+        self,
+        sid: str,
+        room: str,
+        updates: Sequence[Mapping[str, Any]],
+        temporary: bool,
+    ) -> None:
+        key = (room, sid)
+        if not temporary or self.interval <= 0:
+            pending = self._pending.pop(key, None)
+            if pending:
+                for update in updates:
+                    pending[update["uuid"]] = update
+                updates = list(pending.values())
+            await self._emit(sid, room, updates)
+            return
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = {}
+            asyncio.ensure_future(self._flush_later(key))
+        for update in updates:
+            pending[update["uuid"]] = update
+
+    async def _flush_later(self, key: Tuple[str, str]) -> None:
+        await asyncio.sleep(self.interval)
+        pending = self._pending.pop(key, None)
+        if pending:
+            room, sid = key
+            await self._emit(sid, room, list(pending.values()))
+
+    async def _emit(
+        self, sid: str, room: str, updates: Sequence[Mapping[str, Any]]
+    ) -> None:
+        await sio.emit(
+            "Shapes.Position.Update",
+            updates,
+            room=room,
+            skip_sid=sid,
+            namespace=GAME_NS,
+        )
+
+
+position_broadcaster = PositionBroadcaster()
@@ -0,0 +1,175 @@
+import asyncio
+from typing import Callable, Dict, List, Optional, Union
+
+from playhouse.signals import post_save, pre_delete
+
+from config import config
+from models import Floor, Layer, Shape
+from models.db import on_loop
+from models.shape import ShapeType
+from .write_behind import Change, WriteBehind
+
+
+class ShapeStore:
+    """
+    In-memory authoritative copy of the shapes of all loaded locations.
+
+    Hot paths (e.g. position updates) mutate the cached model instances and mark them dirty
+    instead of saving them immediately. Dirty instances are written back in a single transaction
+    on the database thread every `flush_interval` seconds and on shutdown,
+    failed writes are retried on the next flush.
+
+    These writes do not send model signals, caches derived from the shapes
+    can register a callback with `on_written` instead.
+
+    Anything that reads shape data straight from the database (e.g. serializing a full floor)
+    should await `flush` first to make sure no pending changes are missed.
+    """
+
+    def __init__(self) -> None:
+        # location id -> shape uuid -> shape
+        self._locations: Dict[int, Dict[str, Shape]] = {}
+        # shape uuid -> location id
+        self._shape_locations: Dict[str, int] = {}
+        self._subtypes: Dict[str, ShapeType] = {}
+        self._dirty = WriteBehind("shape")
+        self._written_callbacks: List[Callable[[List[Change]], None]] = []
+        self.flush_interval = config.getfloat(
+            "Database", "flush_interval", fallback=1.0
+        )
+
+    def load_location(self, location_id: int) -> Dict[str, Shape]:
+        if location_id not in self._locations:
+            shapes = (
+                Shape.select(Shape, Layer)
+                .join(Layer)
+                .join(Floor)
+                .where(Floor.location == location_id)
+            )
+            self._locations[location_id] = {}
+            for shape in shapes:
+                self._add(location_id, shape)
+        return self._locations[location_id]
+
+    def unload_location(self, location_id: int) -> None:
+        """
+        Forget about the shapes of the location, pending changes are still written by the next flush.
+        """
+        if location_id not in self._locations:
+            return
+        for uuid in self._locations.pop(location_id):
+            self._shape_locations.pop(uuid, None)
+            self._subtypes.pop(uuid, None)
+
+    def get(self, location_id: int, uuid: str) -> Optional[Shape]:
+        shapes = self.load_location(location_id)
+        shape = shapes.get(uuid)
+        if shape is None:
+            # The shape was not yet part of the location when it was loaded
+            shape = (
+                Shape.select(Shape, Layer)
+                .join(Layer)
+                .join(Floor)
+                .where((Shape.uuid == uuid) & (Floor.location == location_id))
+                .first()
+            )
+            if shape is not None:
+                self._add(location_id, shape)
+        return shape
+
+    def get_subtype(self, shape: Shape) -> ShapeType:
+        subtype = self._subtypes.get(shape.uuid)
+        if subtype is None:
+            subtype = shape.subtype
+            if shape.uuid in self._shape_locations:
+                self._subtypes[shape.uuid] = subtype
+        return subtype
+
+    def mark_dirty(self, instance: Union[Shape, ShapeType]) -> None:
+        self._dirty.mark_dirty(instance)
+
+    def evict(self, uuids: List[str]) -> None:
+        """
+        Forget about the given shapes, they are loaded again on their next lookup.
+        Pending changes are still written by the next flush.
+        """
+        for uuid in uuids:
+            self._subtypes.pop(uuid, None)
+            location_id = self._shape_locations.pop(uuid, None)
+            if location_id is not None:
+                self._locations[location_id].pop(uuid, None)
+
+    def on_written(self, callback: Callable[[List[Change]], None]) -> None:
+        """
+        Register a callback that is called with the changes of every successful flush.
+        """
+        self._written_callbacks.append(callback)
+
+    async def flush(self) -> None:
+        changes = await self._dirty.flush()
+        if changes:
+            for callback in self._written_callbacks:
+                callback(changes)
+
+    async def flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _add(self, location_id: int, shape: Shape) -> None:
+        self._locations[location_id][shape.uuid] = shape
+        self._shape_locations[shape.uuid] = location_id
+
+    def _get_cached(self, uuid: str) -> Optional[Shape]:
+        location_id = self._shape_locations.get(uuid, None)
+        if location_id is None:
+            return None
+        return self._locations[location_id].get(uuid, None)
+
+    def _drop_stale(self, instance: Union[Shape, ShapeType]) -> None:
+        """
+        Forget a cached instance whose row was saved through another instance.
+        The saved row is newer, so the pending changes of the cached instance are dropped.
+        """
+        self._dirty.discard(instance)
+        if isinstance(instance, Shape):
+            location_id = self._shape_locations.pop(instance.uuid)
+            self._locations[location_id].pop(instance.uuid, None)
+        else:
+            self._subtypes.pop(instance.shape_id, None)
+
+    def _forget(self, uuid: str) -> None:
+        for instance in (self._get_cached(uuid), self._subtypes.pop(uuid, None)):
+            if instance is not None:
+                self._dirty.discard(instance)
+        location_id = self._shape_locations.pop(uuid, None)
+        if location_id is not None:
+            self._locations[location_id].pop(uuid, None)
+
+
+shape_store = ShapeStore()
+
+
+# Keep the store coherent with changes that are made outside of it.
+
+
+@post_save(sender=Shape)
+@on_loop
+def on_shape_save(model_class, instance: Shape, created: bool):
+    cached = shape_store._get_cached(instance.uuid)
+    if cached is not None and cached is not instance:
+        shape_store._drop_stale(cached)
+
+
+@post_save(sender=ShapeType)
+@on_loop
+def on_shape_subtype_save(model_class, instance: ShapeType, created: bool):
+    cached = shape_store._subtypes.get(instance.shape_id, None)
+    if cached is not None and cached is not instance:
+        shape_store._drop_stale(cached)
+
+
+@pre_delete(sender=Shape)
+@on_loop
+def on_shape_delete(model_class, instance: Shape):
+    shape_store._forget(instance.uuid)
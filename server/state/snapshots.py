@@ -0,0 +1,195 @@
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Union
+
+from playhouse.signals import post_delete, post_save
+
+from models import (
+    Aura,
+    Floor,
+    Group,
+    Label,
+    Layer,
+    Location,
+    Shape,
+    ShapeLabel,
+    ShapeOwner,
+    Tracker,
+)
+from models.db import db_executor, on_loop
+from models.shape import CompositeShapeAssociation, ShapeType
+from models.shape.snapshot import FloorSnapshot
+from models.shape.vertices import unpack_vertices
+from .shapes import shape_store
+from .write_behind import Change
+
+
+class SnapshotCache:
+    """
+    Keeps the serialized form of recently loaded floors around,
+    so that loading a location for multiple clients only hits the database once.
+
+    Changes to models are picked up through signals,
+    changes written by the shape store are reported by its `on_written` callback.
+    Code that changes shapes, layers or floors with bulk queries (e.g. `Shape.update(...)`)
+    bypasses those and has to invalidate the relevant part of the cache itself.
+    """
+
+    def __init__(self) -> None:
+        self._floors: Dict[int, FloorSnapshot] = {}
+        # Reverse indices to find the snapshot(s) affected by a change
+        self._layer_floors: Dict[int, int] = {}
+        self._shape_floors: Dict[str, int] = {}
+        # Bumped on every invalidation, used to detect snapshots that went stale while being built
+        self._versions: Dict[int, int] = defaultdict(int)
+
+    async def get_floor(self, floor: Floor) -> FloorSnapshot:
+        # Pending shape changes invalidate the snapshots they are part of once written
+        await shape_store.flush()
+        snapshot = self._floors.get(floor.id)
+        if snapshot is not None:
+            return snapshot
+
+        version = self._versions[floor.id]
+        built: FloorSnapshot = await db_executor.run(FloorSnapshot, floor)
+        if version == self._versions[floor.id]:
+            self._add(built)
+        return built
+
+    def invalidate_floor(self, floor_id: int) -> None:
+        self._versions[floor_id] += 1
+        snapshot = self._floors.pop(floor_id, None)
+        if snapshot is None:
+            return
+        for layer in snapshot.layers:
+            self._layer_floors.pop(layer.id, None)
+        for uuid in snapshot.shape_ids:
+            self._shape_floors.pop(uuid, None)
+
+    def invalidate_location(self, location_id: int) -> None:
+        for snapshot in list(self._floors.values()):
+            if snapshot.location_id == location_id:
+                self.invalidate_floor(snapshot.id)
+
+    def invalidate_layer(self, layer_id: int) -> None:
+        floor_id = self._layer_floors.get(layer_id, None)
+        if floor_id is not None:
+            self.invalidate_floor(floor_id)
+
+    def invalidate_shape(self, uuid: str) -> None:
+        floor_id = self._shape_floors.get(uuid, None)
+        if floor_id is not None:
+            self.invalidate_floor(floor_id)
+
+    def invalidate_matching(self, *, group_id=None, label_id=None) -> None:
+        for snapshot in list(self._floors.values()):
+            if group_id in snapshot.group_ids or label_id in snapshot.label_ids:
+                self.invalidate_floor(snapshot.id)
+
+    def on_shapes_written(self, changes: List[Change]) -> None:
+        """
+        The shape store mostly writes moved shapes,
+        those are patched in place instead of serializing their floor all over again.
+        """
+        for instance, values in changes:
+            uuid = instance.uuid if isinstance(instance, Shape) else instance.shape_id
+            floor_id = self._shape_floors.get(uuid, None)
+            position = get_position_data(instance, values)
+            if position is None:
+                self.invalidate_shape(uuid)
+                if isinstance(instance, Shape):
+                    self.invalidate_layer(instance.layer_id)
+            elif floor_id is not None:
+                self._floors[floor_id].update_shape(uuid, position)
+
+    def _add(self, snapshot: FloorSnapshot) -> None:
+        self._floors[snapshot.id] = snapshot
+        for layer in snapshot.layers:
+            self._layer_floors[layer.id] = snapshot.id
+        for uuid in snapshot.shape_ids:
+            self._shape_floors[uuid] = snapshot.id
+
+
+def get_position_data(
+    instance: Union[Shape, ShapeType], values: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    """
+    Serialized form of the changed fields, if only the position of the shape changed.
+    """
+    if isinstance(instance, Shape):
+        if values.keys() <= {"x", "y", "angle"}:
+            return values
+    elif values.keys() <= {"vertices"}:
+        return {"vertices": unpack_vertices(values["vertices"])}
+    return None
+
+
+snapshot_cache = SnapshotCache()
+shape_store.on_written(snapshot_cache.on_shapes_written)
+
+
+# Invalidate snapshots when the models they were built from change.
+
+
+@post_save(sender=Shape)
+@post_delete(sender=Shape)
+@on_loop
+def on_shape_change(model_class, instance: Shape, created: bool = False):
+    # The shape might have moved to another layer, so check both old and new
+    snapshot_cache.invalidate_shape(instance.uuid)
+    snapshot_cache.invalidate_layer(instance.layer_id)
+
+
+@post_save(sender=ShapeType)
+@post_delete(sender=ShapeType)
+@post_save(sender=Tracker)
+@post_delete(sender=Tracker)
+@post_save(sender=Aura)
+@post_delete(sender=Aura)
+@post_save(sender=ShapeOwner)
+@post_delete(sender=ShapeOwner)
+@post_save(sender=ShapeLabel)
+@post_delete(sender=ShapeLabel)
+@on_loop
+def on_shape_data_change(model_class, instance, created: bool = False):
+    snapshot_cache.invalidate_shape(instance.shape_id)
+
+
+@post_save(sender=CompositeShapeAssociation)
+@post_delete(sender=CompositeShapeAssociation)
+@on_loop
+def on_composite_change(model_class, instance, created: bool = False):
+    snapshot_cache.invalidate_shape(instance.parent_id)
+
+
+@post_save(sender=Layer)
+@post_delete(sender=Layer)
+@on_loop
+def on_layer_change(model_class, instance: Layer, created: bool = False):
+    snapshot_cache.invalidate_floor(instance.floor_id)
+
+
+@post_save(sender=Floor)
+@post_delete(sender=Floor)
+@on_loop
+def on_floor_change(model_class, instance: Floor, created: bool = False):
+    snapshot_cache.invalidate_floor(instance.id)
+
+
+@post_delete(sender=Location)
+@on_loop
+def on_location_delete(model_class, instance: Location):
+    snapshot_cache.invalidate_location(instance.id)
+
+
+@post_save(sender=Group)
+@post_delete(sender=Group)
+@on_loop
+def on_group_change(model_class, instance: Group, created: bool = False):
+    snapshot_cache.invalidate_matching(group_id=instance.uuid)
+
+
+@post_save(sender=Label)
+@post_delete(sender=Label)
+@on_loop
+def on_label_change(model_class, instance: Label, created: bool = False):
+    snapshot_cache.invalidate_matching(label_id=instance.uuid)
@@ -0,0 +1,207 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO, Dict, Optional
+
+from config import config
+from utils import ASSETS_DIR, logger
+
+if TYPE_CHECKING:
+    # The socket package imports this module, only needed for annotations
+    from api.socket.asset_manager.common import UploadData
+
+UPLOADS_DIR = ASSETS_DIR / ".uploads"
+if not UPLOADS_DIR.exists():
+    UPLOADS_DIR.mkdir()
+
+
+class UploadError(Exception):
+    pass
+
+
+class PendingUpload:
+    """
+    An asset upload that is still receiving slices.
+
+    Slices are appended to a temporary file as they arrive and hashed on the way,
+    so the complete file is never held in memory.
+    Slices that arrive out of order are kept around until the gap before them is filled,
+    up to `max_buffered` bytes. Clients send the slices one by one, so this is only a fallback.
+    """
+
+    def __init__(
+        self, user_id: int, upload_data: "UploadData", max_buffered: int
+    ) -> None:
+        self.uuid = upload_data["uuid"]
+        self.user_id = user_id
+        self.name = upload_data["name"]
+        self.total_slices = upload_data["totalSlices"]
+        self.next_slice = 0
+        self.size = 0
+        self.max_buffered = max_buffered
+        self._buffered = 0
+        self.last_activity = time.monotonic()
+        self._sha = hashlib.sha1()
+        self._out_of_order: Dict[int, bytes] = {}
+        fd, path = tempfile.mkstemp(dir=UPLOADS_DIR, prefix=f"{self.uuid}-")
+        self.path = Path(path)
+        self._file: Optional[BinaryIO] = os.fdopen(fd, "wb")
+
+    @property
+    def complete(self) -> bool:
+        return self.next_slice == self.total_slices
+
+    def add_slice(self, index: int, data: bytes) -> None:
+        self.last_activity = time.monotonic()
+        if index < self.next_slice or index in self._out_of_order:
+            # Resent slice, it has already been counted
+            return
+        if index != self.next_slice:
+            if self._buffered + len(data) > self.max_buffered:
+                raise UploadError("Too many slices received out of order")
+            self._out_of_order[index] = data
+            self._buffered += len(data)
+            self.size += len(data)
+            return
+        self.size += len(data)
+        self._write(data)
+        while self.next_slice in self._out_of_order:
+            data = self._out_of_order.pop(self.next_slice)
+            self._buffered -= len(data)
+            self._write(data)
+
+    def hexdigest(self) -> str:
+        return self._sha.hexdigest()
+
+    def store(self) -> str:
+        """
+        Moves the completed upload into the asset folder and returns its file hash.
+        """
+        self._close()
+        hashname = self.hexdigest()
+        if (ASSETS_DIR / hashname).exists():
+            self.path.unlink()
+        else:
+            os.replace(self.path, ASSETS_DIR / hashname)
+        return hashname
+
+    def discard(self) -> None:
+        self._close()
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _write(self, data: bytes) -> None:
+        assert self._file is not None
+        self._file.write(data)
+        self._sha.update(data)
+        self.next_slice += 1
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class UploadManager:
+    """
+    Keeps track of the asset uploads that are in progress.
+
+    The amount and combined size of uploads that a single user can have in flight is limited
+    and uploads that stop receiving slices are dropped after `upload_timeout` seconds.
+    The limits are configured in the Webserver config section.
+    """
+
+    def __init__(self) -> None:
+        self._uploads: Dict[str, PendingUpload] = {}
+        self.max_pending_uploads = config.getint(
+            "Webserver", "max_pending_uploads", fallback=10
+        )
+        self.max_pending_size = (
+            config.getint("Webserver", "max_pending_upload_size", fallback=1024)
+            * 1024
+            * 1024
+        )
+        self.max_buffered_size = (
+            config.getint("Webserver", "max_buffered_upload_size", fallback=8)
+            * 1024
+            * 1024
+        )
+        self.timeout = config.getfloat("Webserver", "upload_timeout", fallback=300.0)
+
+    def add_slice(
+        self, user_id: int, upload_data: "UploadData"
+    ) -> Optional[PendingUpload]:
+        """
+        Adds a slice to its upload and returns the upload once all of its slices are present.
+        The caller is responsible for storing or discarding a returned upload.
+        """
+        upload = self._uploads.get(upload_data["uuid"], None)
+        if upload is None:
+            upload = self._start(user_id, upload_data)
+        elif upload.user_id != user_id:
+            raise UploadError("Upload belongs to another user")
+
+        data = upload_data["data"]
+        if not (0 <= upload_data["slice"] < upload.total_slices):
+            self.abort(upload.uuid)
+            raise UploadError("Slice index out of range")
+        if self._get_pending_size(user_id) + len(data) > self.max_pending_size:
+            self.abort(upload.uuid)
+            raise UploadError("Size limit for pending uploads exceeded")
+
+        try:
+            upload.add_slice(upload_data["slice"], data)
+        except (OSError, UploadError):
+            self.abort(upload.uuid)
+            raise
+
+        if not upload.complete:
+            return None
+        del self._uploads[upload.uuid]
+        return upload
+
+    def abort(self, uuid: str) -> None:
+        upload = self._uploads.pop(uuid, None)
+        if upload is not None:
+            upload.discard()
+
+    def expire(self) -> None:
+        deadline = time.monotonic() - self.timeout
+        for upload in list(self._uploads.values()):
+            if upload.last_activity < deadline:
+                logger.warning(f"Upload of {upload.name} timed out")
+                self.abort(upload.uuid)
+
+    def clear(self) -> None:
+        for uuid in list(self._uploads):
+            self.abort(uuid)
+        # Leftovers of uploads that were in progress when the server stopped
+        for path in UPLOADS_DIR.iterdir():
+            path.unlink()
+
+    async def expire_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.timeout / 2)
+            self.expire()
+
+    def _start(self, user_id: int, upload_data: "UploadData") -> PendingUpload:
+        if upload_data["totalSlices"] <= 0:
+            raise UploadError("Upload without slices")
+        in_flight = sum(1 for u in self._uploads.values() if u.user_id == user_id)
+        if in_flight >= self.max_pending_uploads:
+            raise UploadError("Too many pending uploads")
+        upload = self._uploads[upload_data["uuid"]] = PendingUpload(
+            user_id, upload_data, self.max_buffered_size
+        )
+        return upload
+
+    def _get_pending_size(self, user_id: int) -> int:
+        return sum(u.size for u in self._uploads.values() if u.user_id == user_id)
+
+
+upload_manager = UploadManager()
@@ -0,0 +1,72 @@
+from typing import Callable, Dict, List, Optional
+
+from peewee import Model
+
+from models.db import Change, db_executor, write_changes
+from utils import logger
+
+
+class WriteBehind:
+    """
+    Model instances with changes that are written to the database later on.
+
+    Hot paths change the instances in memory and mark them dirty,
+    `flush` then writes all of their dirty fields in a single transaction on the database thread.
+    The values are collected on the event loop first, so the instances can keep changing meanwhile.
+    The changes of an instance are only forgotten once that transaction committed,
+    if it fails they stay pending and are retried by the next flush.
+
+    The writes are plain update queries, model signals are not sent.
+
+    `prepare` is called for every instance right before its values are collected,
+    e.g. to serialize state that is kept in a more convenient form in memory.
+    """
+
+    def __init__(
+        self, name: str, prepare: Optional[Callable[[Model], None]] = None
+    ) -> None:
+        self.name = name
+        self._prepare = prepare
+        self._pending: Dict[int, Model] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self._pending)
+
+    def __contains__(self, instance: Model) -> bool:
+        return id(instance) in self._pending
+
+    def mark_dirty(self, instance: Model) -> None:
+        self._pending[id(instance)] = instance
+
+    def discard(self, instance: Model) -> None:
+        self._pending.pop(id(instance), None)
+
+    async def flush(self) -> List[Change]:
+        """
+        Writes the pending changes and returns them, nothing is returned if the write failed.
+        """
+        changes = self._collect()
+        if not changes:
+            return []
+
+        try:
+            await db_executor.run(write_changes, changes)
+        except Exception:
+            logger.exception(f"Failed to write pending {self.name} changes, retrying")
+            for instance, values in changes:
+                instance._dirty.update(values)
+                self._pending.setdefault(id(instance), instance)
+            return []
+        return changes
+
+    def _collect(self) -> List[Change]:
+        changes: List[Change] = []
+        for instance in self._pending.values():
+            if self._prepare is not None:
+                self._prepare(instance)
+            if instance._dirty:
+                values = {name: instance.__data__.get(name) for name in instance._dirty}
+                changes.append((instance, values))
+                instance._dirty.clear()
+        self._pending.clear()
+        return changes
@@ -0,0 +1,23 @@
+import secrets
+import tempfile
+from pathlib import Path
+
+# The app reads its secret from the save on import, so the test save is set up first
+from models import ALL_MODELS, Constants
+from models.db import db, db_executor
+from save import SAVE_VERSION
+
+_save_dir = tempfile.TemporaryDirectory()
+db.init(str(Path(_save_dir.name) / "planar.sqlite"), pragmas=db._pragmas)
+db.create_tables(ALL_MODELS)
+Constants.create(
+    save_version=SAVE_VERSION,
+    secret_token=secrets.token_bytes(32),
+    api_token=secrets.token_hex(32),
+)
+
+
+def pytest_unconfigure(config):
+    db_executor.stop()
+    db.close()
+    _save_dir.cleanup()
@@ -0,0 +1,47 @@
+from uuid import uuid4
+
+from models import (
+    Layer,
+    Location,
+    LocationOptions,
+    PlayerRoom,
+    Rect,
+    Room,
+    Shape,
+    Tracker,
+    User,
+    UserOptions,
+)
+from models.role import Role
+
+
+def create_room(name: str):
+    user = User.create(
+        name=name, password_hash="", default_options=UserOptions.create()
+    )
+    room = Room.create(
+        name=name, creator=user, default_options=LocationOptions.create()
+    )
+    location = Location.create(room=room, name="start", index=1)
+    floor = location.create_floor()
+    layer = floor.layers.where(Layer.name == "tokens").get()
+    for index in range(3):
+        shape = Shape.create(
+            uuid=str(uuid4()), layer=layer, type_="rect", x=index, y=0, index=index
+        )
+        Rect.create(shape=shape, width=50, height=50)
+        Tracker.create(
+            uuid=str(uuid4()),
+            shape=shape,
+            visible=True,
+            name="HP",
+            value=10,
+            maxvalue=10,
+            draw=True,
+            primary_color="#00ff00",
+            secondary_color="#888888",
+        )
+    pr = PlayerRoom.create(
+        player=user, room=room, role=Role.DM, active_location=location
+    )
+    return pr, location
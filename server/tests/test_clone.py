@@ -0,0 +1,31 @@
+import asyncio
+
+from api.socket import location as location_api
+from factories import create_room
+from models import Floor, Layer, Location, Shape, Tracker
+
+
+def get_shapes(location: Location):
+    return Shape.select().join(Layer).join(Floor).where(Floor.location == location)
+
+
+def test_clone_location_handler(monkeypatch):
+    pr, location = create_room("clone-handler")
+    monkeypatch.setattr(location_api.game_state, "get", lambda sid: pr)
+
+    # Bypass the login check, the sid is never registered
+    handler = location_api.clone_location.__wrapped__
+    asyncio.run(handler("sid", {"location": location.id, "room": pr.room.name}))
+
+    locations = list(pr.room.locations.order_by(Location.index))
+    assert len(locations) == 2
+    clone = locations[1]
+    assert clone.name == location.name
+
+    shapes = list(get_shapes(clone))
+    original_shapes = list(get_shapes(location))
+    assert len(shapes) == len(original_shapes) == 3
+    assert {s.x for s in shapes} == {s.x for s in original_shapes}
+    assert not {s.uuid for s in shapes} & {s.uuid for s in original_shapes}
+    assert all(s.subtype.width == 50 for s in shapes)
+    assert Tracker.select().where(Tracker.shape << shapes).count() == 3
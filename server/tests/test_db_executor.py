@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+from factories import create_room
+from models import Floor, Layer, PlayerRoom, Shape
+from models.db import db, db_executor
+
+
+def hold_write_lock(seconds: float) -> None:
+    with db.atomic("IMMEDIATE"):
+        time.sleep(seconds)
+
+
+def test_save_writes_changed_fields():
+    pr, _ = create_room("executor-save")
+    pr.role = 1
+
+    asyncio.run(db_executor.save(pr))
+
+    assert not pr._dirty
+    assert PlayerRoom.get_by_id(pr.id).role == 1
+
+
+def test_save_waits_for_long_jobs_without_blocking_the_loop():
+    pr, _ = create_room("executor-busy")
+
+    async def main():
+        job = asyncio.ensure_future(db_executor.run(hold_write_lock, 0.5))
+        await asyncio.sleep(0.1)
+
+        pr.role = 1
+        start = time.perf_counter()
+        save = asyncio.ensure_future(db_executor.save(pr))
+        ticks = 0
+        while not save.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        await job
+        return ticks, time.perf_counter() - start
+
+    ticks, elapsed = asyncio.run(main())
+    assert elapsed > 0.3
+    # The loop kept running while the save was queued behind the job
+    assert ticks > 10
+    assert PlayerRoom.get_by_id(pr.id).role == 1
+
+
+def test_set_option_is_written_on_the_database_thread():
+    _, location = create_room("executor-option")
+    shape = Shape.select().join(Layer).join(Floor).where(Floor.location == location)[0]
+
+    asyncio.run(shape.set_option("teleport", "immediate", value=True))
+    assert shape.get_options()["teleport"] == {"immediate": True}
+    assert Shape.get_by_id(shape.uuid).get_options()["teleport"] == {"immediate": True}
+
+    asyncio.run(shape.remove_options("teleport"))
+    assert "teleport" not in Shape.get_by_id(shape.uuid).get_options()
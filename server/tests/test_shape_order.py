@@ -0,0 +1,52 @@
+from factories import create_room
+from models import Floor, Layer, Shape
+
+
+def get_layer_shapes(location):
+    return list(
+        Shape.select()
+        .join(Layer)
+        .join(Floor)
+        .where(Floor.location == location)
+        .order_by(Shape.index)
+    )
+
+
+def get_order(location):
+    return [shape.uuid for shape in get_layer_shapes(location)]
+
+
+def move(shape, position):
+    shape.set_order(position)
+    shape.save()
+
+
+def test_set_order_between_neighbours():
+    _, location = create_room("order-between")
+    bottom, middle, top = get_layer_shapes(location)
+
+    move(bottom, 1)
+
+    assert get_order(location) == [middle.uuid, bottom.uuid, top.uuid]
+    assert Shape.get_by_id(middle.uuid).index == 1
+
+
+def test_set_order_past_the_last_shape_moves_to_the_top():
+    _, location = create_room("order-top")
+    bottom, middle, top = get_layer_shapes(location)
+
+    move(bottom, 10)
+
+    assert get_order(location) == [middle.uuid, top.uuid, bottom.uuid]
+
+
+def test_set_order_rebalances_when_there_is_no_room():
+    _, location = create_room("order-rebalance")
+    bottom, middle, top = get_layer_shapes(location)
+    Shape.update(index=1).where(Shape.uuid << [bottom.uuid, middle.uuid]).execute()
+    top = Shape.get_by_id(top.uuid)
+
+    move(top, 1)
+
+    assert get_order(location)[1] == top.uuid
+    assert sorted(shape.index for shape in get_layer_shapes(location)) == [0, 0.5, 1]
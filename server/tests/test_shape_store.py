@@ -0,0 +1,35 @@
+import asyncio
+
+from factories import create_room
+from models import Floor, Layer, Shape
+from state.shapes import shape_store
+
+
+def get_shape(location):
+    return Shape.select().join(Layer).join(Floor).where(Floor.location == location)[0]
+
+
+def test_flush_writes_pending_changes():
+    _, location = create_room("store-flush")
+    shape = shape_store.get(location.id, get_shape(location).uuid)
+    shape.x = 111
+    shape_store.mark_dirty(shape)
+
+    assert Shape.get_by_id(shape.uuid).x != 111
+    asyncio.run(shape_store.flush())
+    assert Shape.get_by_id(shape.uuid).x == 111
+
+
+def test_saving_another_instance_drops_pending_changes():
+    _, location = create_room("store-stale")
+    shape = shape_store.get(location.id, get_shape(location).uuid)
+    shape.x = 111
+    shape_store.mark_dirty(shape)
+
+    other = Shape.get_by_id(shape.uuid)
+    other.x = 999
+    other.save()
+    asyncio.run(shape_store.flush())
+
+    assert Shape.get_by_id(shape.uuid).x == 999
+    assert shape_store.get(location.id, shape.uuid).x == 999
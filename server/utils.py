@@ -21,6 +21,10 @@ FILE_DIR = get_file_dir()
 # SETUP PATHS
 os.chdir(FILE_DIR)
 
+ASSETS_DIR = FILE_DIR / "static" / "assets"
+if not ASSETS_DIR.exists():
+    ASSETS_DIR.mkdir()
+
 # SETUP LOGGING
 
 logger = logging.getLogger("PlanarAllyServer")